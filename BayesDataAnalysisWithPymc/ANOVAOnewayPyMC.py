@@ -7,12 +7,17 @@ More info: http://doingbayesiandataanalysis.blogspot.com.br/
 '''
 from __future__ import division
 
-import pymc
 import numpy as np
-from matplotlib import pyplot as plot
 from plot_post import plot_post
-from normalize import (normalize, convert_baseline, convert_deflection,
-                       convert_sigma)
+from normalize import Standardizer
+from data_loader import load_columns
+from model_cache import ModelCache, LazyModel, model_key, find_node
+from sampling import fit as fit_model, merge_chains
+from profiling import timed, phase
+from densities import AnovaDensity
+from contrasts import contrast_table, contrast_stats
+import hmc
+from collections import OrderedDict
 from math import ceil
 from os import path
 
@@ -22,140 +27,243 @@ scr_dir = path.dirname(__file__)
 file_name = 'McDonaldSK1991data.txt'
 comp_dir = path.join(scr_dir, 'Data', file_name)
 
-# Using data from the book for easier comparison.
-# Data from McDonald (1991) study about geographical location and muscle size
-# in mussels.
-# Again we use Numpy to assign the data to variables.
+# Define the contrasts, by label. Each one compares the mean effect of
+# the groups with positive weights to that of the groups with negative
+# weights. Use 'contrasts.pairwise(5)' for every pairwise comparison.
 
-x, y = np.genfromtxt(comp_dir, delimiter=' ',
-                     skip_header=19, usecols=(0, 1), unpack=True)
+contrasts = OrderedDict([
+    ('3, 5 vs 1, 2, 4', (-1/3, -1/3, 1/2, -1/3, 1/2)),
+    ('1 vs 2', (1, -1, 0, 0, 0)),
+    ('3 vs 1, 2', (-1/2, -1/2, 1, 0, 0)),
+    ('3, 4 vs 1, 2', (-1/2, -1/2, 1/2, 1/2, 0)),
+    ('1, 2, 3 vs 4', (1/3, 1/3, 1/3, -1, 0)),
+    ('5 vs 1, 2, 3, 4', (-1/4, -1/4, -1/4, -1/4, 1)),
+    ('1, 2, 3 vs 4, 5', (1/3, 1/3, 1/3, -1/2, -1/2)),
+    ('5 vs 4', (0, 0, 0, -1, 1))])
 
-# Define the contrasts.
-# TODO: use dictionary for easier retrieval of contrast description.
+# Built models are cached, so that new data with the same shape
+# reuse the graph.
 
-contrasts = np.array(((-1/3, -1/3, 1/2, -1/3, 1/2),
-                      (1, -1, 0, 0, 0),
-                      (-1/2, -1/2, 1, 0, 0),
-                      (-1/2, -1/2, 1/2, 1/2, 0),
-                      (1/3, 1/3, 1/3, -1, 0),
-                      (-1/4, -1/4, -1/4, -1/4, 1),
-                      (1/3, 1/3, 1/3, -1/2, -1/2),
-                      (0, 0, 0, -1, 1)))
-# Random data, for test purposes:
+_cache = ModelCache()
 
-# y_truesd = 4.0
-# a0_true = 100
-# atrue = [15, -10, -7, 8, -6]
 
-#x = [1] * 3 + [2] * 4 + [3] * 3 + [4] * 5 + [5] * 3
-#y = [a0_true + atrue[i - 1] + np.random.normal(0, y_truesd) for i in x]
+@timed('build', model='ANOVAOnewayPyMC')
+def build_model(data, a_sd_shape=1.01005, a_sd_rate=0.1005, a0_tau=0.001,
+                sigma_upper=10):
+    '''Build the oneway ANOVA model.
 
+    :Arguments:
+        data: pair (x, y) with the group of each observation (integers
+              from 1 to the number of levels) and the observed values,
+              in their original scale. 'y' is normalized here.
+        a_sd_shape, a_sd_rate: shape and rate of the gamma prior for the
+                               SD of the deflections.
+        a0_tau: precision of the normal prior for the baseline.
+        sigma_upper: upper limit of the uniform prior for the cell SD.
 
-# Normalize the data for better MCMC performance.
-# And define the total number of levels in our categorical variable.
+    The moments of 'y' are kept in 'model.scaling', a 'Standardizer' that
+    converts the parameters back to the original scale. Returns a
+    'model_cache.LazyModel': the PyMC graph is built (or fetched from the
+    cache and bound to this data) when MCMC samples it.
 
-zy = normalize(y)
-x_levels = len(set(x))
-y_mean = np.mean(y)
-y_sd = np.sqrt(np.var(y))
+    '''
+    priors = dict(a_sd_shape=a_sd_shape, a_sd_rate=a_sd_rate, a0_tau=a0_tau,
+                  sigma_upper=sigma_upper)
 
-# Begin the definition of the model.
-# First, we define a Gamma distribution for the precision of
-# the deflection parameters.
+    # Normalize the data for better MCMC performance.
+    # And define the total number of levels in our categorical variable.
 
-a_sd = pymc.Gamma('a_sd', 1.01005, 0.1005)
+    x, y = data
+    scaling = Standardizer(y=y)
+    zy = scaling.transform('y', y)
+    x_levels = len(np.unique(x))
 
-@pymc.deterministic
-def a_tau(a_sd=a_sd):
-    return 1.0 / a_sd**2
+    # The group of each observation, as a zero-based index of 'a'.
 
-# Then we define a normal prior on the baseline and deflection parameters.
+    idx = np.asarray(x, dtype=int) - 1
 
-a0 = pymc.Normal('a0', mu=0.0, tau=0.001)
-a = pymc.Normal('a', mu=0.0, tau=a_tau, size=x_levels)
+    def build():
+        import pymc
 
-# Almost there! We still need to set the prior on the data variance.
+        # Begin the definition of the model.
+        # First, we define a Gamma distribution for the precision of
+        # the deflection parameters.
 
-sigma = pymc.Uniform('sigma', 0, 10)
+        a_sd = pymc.Gamma('a_sd', a_sd_shape, a_sd_rate)
 
+        @pymc.deterministic
+        def a_tau(a_sd=a_sd):
+            return 1.0 / a_sd**2
 
-@pymc.deterministic
-def tau(sigma=sigma):
-    return 1.0 / sigma**2
+        # Then we define a normal prior on the baseline and deflection
+        # parameters.
 
-# The priors are all set! Now we can define the linear model.
-# Maybe it can be clearly defined using the 'Lambda()' class.
-# But we will use a 'for' loop for easier readability.
+        a0 = pymc.Normal('a0', mu=0.0, tau=a0_tau)
+        a = pymc.Normal('a', mu=0.0, tau=a_tau, size=x_levels)
 
-mu = []
-for i in x:
-    mu.append(a0 + a[int(i - 1)])
+        # Almost there! We still need to set the prior on the data variance.
 
-# And the likelihood.
+        sigma = pymc.Uniform('sigma', 0, sigma_upper)
 
-like_y = pymc.Normal('like_y', mu=mu, tau=tau, value=zy, observed=True)
+        @pymc.deterministic
+        def tau(sigma=sigma):
+            return 1.0 / sigma**2
 
-# Now we build the model, set the MAP and sample the posterior distribution.
+        # The priors are all set! Now we can define the linear model.
+        # A single deterministic indexes the deflections by group, so the
+        # graph does not grow with the number of observations.
 
-model = pymc.Model([like_y, a0, a, sigma, a_tau, a_sd])
-map_ = pymc.MAP(model)
-map_.fit()
-mcmc = pymc.MCMC(model)
-mcmc.sample(iter=80000, burn=20000, thin=10)
+        @pymc.deterministic
+        def mu(a0=a0, a=a, idx=idx):
+            return a0 + a[idx]
 
-# Extract the samples.
+        # And the likelihood.
 
-a0_sample = mcmc.trace('a0')[:]
-a_sample = mcmc.trace('a')[:]
-sigma_sample = mcmc.trace('sigma')[:]
-a_sd_sample = mcmc.trace('a_sd')[:]
+        like_y = pymc.Normal('like_y', mu=mu, tau=tau, value=zy,
+                             observed=True)
 
-# Convert the values.
+        return pymc.Model([like_y, a0, a, sigma, a_tau, a_sd])
 
-b0_sample = convert_baseline(a0_sample, a_sample, x_levels, y)
-b_sample = convert_deflection(a0_sample, a_sample, x_levels, y)
+    def set_data(model):
+        find_node(model, 'mu').parents['idx'] = idx
+        find_node(model, 'like_y').set_value(zy, force=True)
 
-sig_sample = convert_sigma(y, sigma_sample)
-b_sd_sample = convert_sigma(y, a_sd_sample)
+    # The number of levels sets the size of 'a', so it is part of the key.
+    key = model_key([x, y, (x_levels,)], priors)
+    return LazyModel((build_model, (data,), priors),
+                     lambda: _cache.get(key, build, set_data),
+                     scaling=scaling)
 
-# Plot the results.
 
-plot.figure(figsize=(6.0, 4.0))
+@timed('fit', model='ANOVAOnewayPyMC')
+def fit(model, iter=80000, burn=20000, thin=10, chains=1, seed=None,
+        dbdir=None, target_ess=None, sampler='metropolis',
+        warm_start=None, warm_burn=None):
+    '''Sample the posterior of a model built by 'build_model'.
 
-plot.subplot(211)
-plot_post(sig_sample, title=r'$\sigma$ (cell SD) posterior')
+    Returns a dictionary with the (chain, draw, ...) traces of the
+    normalized 'a0', 'a', 'sigma' and 'a_sd'.
+    With 'dbdir', the traces are memory-mapped files in that directory.
+    With 'target_ess', sampling stops as soon as every parameter reaches
+    that effective sample size, or after 'iter' iterations.
 
-plot.subplot(212)
-plot_post(b_sd_sample, title=r'$aSD$ posterior')
+    With 'sampler'='nuts', the non-centered model is sampled by the
+    No-U-Turn sampler of 'hmc', which avoids the funnel between 'a_sd'
+    and 'a': use much shorter runs, such as iter=2000, burn=1000 and
+    thin=1.
 
-plot.subplots_adjust(wspace=0.2, hspace=0.5)
+    With 'warm_start', a 'state_cache.StateCache' (or True), MCMC starts
+    from the states saved by a previous fit of the same data, or of the
+    data before rows were appended, with a burn-in of 'warm_burn'
+    (default: burn / 10).
 
-plot.figure(figsize=(18.0, 3.0))
-total_subplot = len(b_sample[0, :])
-plot_n = 100 + (total_subplot + 1) * 10 + 1
+    '''
+    if sampler == 'nuts':
+        if target_ess is not None:
+            raise ValueError('target_ess needs the metropolis sampler')
+        _, ((x, y),), priors = model.recipe
+        density = AnovaDensity(np.asarray(x, dtype=int) - 1,
+                               model.scaling.transform('y', y),
+                               len(np.unique(x)), **priors)
+        return hmc.fit(density, iter=iter, burn=burn, thin=thin,
+                       chains=chains, seed=seed, dbdir=dbdir)
 
-plot.subplot(plot_n)
-plot_post(b0_sample, title=r'$\beta_0$ posterior')
+    return fit_model(model, ('a0', 'a', 'sigma', 'a_sd'), iter=iter,
+                     burn=burn, thin=thin, chains=chains, seed=seed,
+                     dbdir=dbdir, target_ess=target_ess,
+                     warm_start=warm_start, warm_burn=warm_burn)
 
-for i in range(total_subplot):
-    plot.subplot(plot_n + i + 1)
-    plot_post(b_sample[:, i], title=r'$\beta_{1%i}$ posterior' % (i + 1))
 
-plot.subplots_adjust(wspace=0.2)
+def main():
+    from matplotlib import pyplot as plot
 
-n_cons = len(contrasts)
-if n_cons > 0:
-    plot_per_rows = 5
-    plot_rows = ceil(n_cons / plot_per_rows)
-    plot_cols = ceil(n_cons / plot_rows)
+    # Using data from the book for easier comparison.
+    # Data from McDonald (1991) study about geographical location and muscle
+    # size in mussels.
+    # Again we load the columns by name, from the binary cache after
+    # the first run.
 
-    plot.figure(figsize=(3.75 * plot_cols, 2.5 * plot_rows))
+    data = load_columns(comp_dir, ('Group', 'Size'), delimiter=None,
+                        dtypes={'Group': int})
+    x, y = data['Group'], data['Size']
 
-    for i in range(n_cons):
-        contrast = contrasts[i, :]
-        comp = np.dot(b_sample, contrast)
-        plot.subplot(plot_rows, plot_cols, i + 1)
-        plot_post(comp, title='Contrast %i' % (i + 1), comp=0.0)
+    # Random data, for test purposes:
 
-plot.subplots_adjust(wspace=0.2, hspace=0.5)
-plot.show()
+    # y_truesd = 4.0
+    # a0_true = 100
+    # atrue = [15, -10, -7, 8, -6]
+
+    #x = [1] * 3 + [2] * 4 + [3] * 3 + [4] * 5 + [5] * 3
+    #y = [a0_true + atrue[i - 1] + np.random.normal(0, y_truesd) for i in x]
+
+    # Now we build the model, set the MAP and sample the posterior
+    # distribution.
+
+    model = build_model((x, y))
+    trace = merge_chains(fit(model))
+
+    # Extract the samples.
+
+    a0_sample = trace['a0']
+    a_sample = trace['a']
+    sigma_sample = trace['sigma']
+    a_sd_sample = trace['a_sd']
+
+    # Convert the values. The deflections are converted in place,
+    # so no other (draws, levels) array is allocated.
+
+    with phase('convert', model='ANOVAOnewayPyMC'):
+        b0_sample, b_sample = model.scaling.anova(a0_sample, a_sample,
+                                                  b_out=a_sample)
+        sig_sample = model.scaling.sigma(sigma_sample)
+        b_sd_sample = model.scaling.sigma(a_sd_sample)
+
+    # Plot the results.
+
+    plot.figure(figsize=(6.0, 4.0))
+
+    plot.subplot(211)
+    plot_post(sig_sample, title=r'$\sigma$ (cell SD) posterior')
+
+    plot.subplot(212)
+    plot_post(b_sd_sample, title=r'$aSD$ posterior')
+
+    plot.subplots_adjust(wspace=0.2, hspace=0.5)
+
+    plot.figure(figsize=(18.0, 3.0))
+    total_subplot = len(b_sample[0, :])
+    plot_n = 100 + (total_subplot + 1) * 10 + 1
+
+    plot.subplot(plot_n)
+    plot_post(b0_sample, title=r'$\beta_0$ posterior')
+
+    for i in range(total_subplot):
+        plot.subplot(plot_n + i + 1)
+        plot_post(b_sample[:, i], title=r'$\beta_{1%i}$ posterior' % (i + 1))
+
+    plot.subplots_adjust(wspace=0.2)
+
+    n_cons = len(contrasts)
+    if n_cons > 0:
+        plot_per_rows = 5
+        plot_rows = ceil(n_cons / plot_per_rows)
+        plot_cols = ceil(n_cons / plot_rows)
+
+        plot.figure(figsize=(3.75 * plot_cols, 2.5 * plot_rows))
+
+        # Every contrast is computed once, by a single matrix product,
+        # with its HDI, tail probabilities and histogram. The plots only
+        # draw those statistics.
+
+        table = contrast_table(b_sample, contrasts, comp=0.0, bins=25)
+        for i, label in enumerate(table['label']):
+            plot.subplot(plot_rows, plot_cols, i + 1)
+            plot_post(None, title=label, comp=0.0,
+                      stats=contrast_stats(table, i))
+
+    plot.subplots_adjust(wspace=0.2, hspace=0.5)
+    plot.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,95 +8,178 @@ More info: http://doingbayesiandataanalysis.blogspot.com.br/
 '''
 from __future__ import division
 
-import pymc
-from matplotlib import pyplot as plot
+import numpy as np
 from plot_post import plot_post
+from model_cache import ModelCache, LazyModel, model_key, find_node
+from sampling import fit as fit_model, merge_chains
+from profiling import timed
+
+# Built models are cached, so that new data with the same shape
+# reuse the graph.
+
+_cache = ModelCache()
+
+
+@timed('build', model='BernBetaMuKappaPyMC')
+def build_model(data, a_mu=2.0, b_mu=2.0, s_kappa=10**2 / 10**2,
+                r_kappa=10 / 10**2, likelihood='binomial'):
+    '''Build the hierarchical Bernoulli model.
+
+    :Arguments:
+        data: pair (z, N) with the number of successes of each subject
+              and the number of trials (a single integer for all subjects
+              or one integer per subject).
+        a_mu, b_mu: constants of the overall beta distribution for mu.
+        s_kappa, r_kappa: shape and rate of the overall gamma distribution
+                          for kappa.
+        likelihood: 'binomial' (default) evaluates a single Binomial node
+                    over the counts of all subjects. 'bernoulli' expands
+                    the counts into one Bernoulli node per subject, with
+                    one value per trial. Both give the same posterior.
+
+    Returns a 'model_cache.LazyModel': the PyMC graph is built (or
+    fetched from the cache and bound to this data) when MCMC samples it.
+
+    '''
+    if likelihood not in ('binomial', 'bernoulli'):
+        raise ValueError("likelihood must be 'binomial' or 'bernoulli', "
+                         "not %r" % (likelihood,))
+    priors = dict(a_mu=a_mu, b_mu=b_mu, s_kappa=s_kappa, r_kappa=r_kappa,
+                  likelihood=likelihood)
+    z, N = data
+    z = np.asarray(z, dtype=int)
+    N = np.broadcast_to(np.asarray(N, dtype=int), z.shape)
+
+    if likelihood == 'bernoulli':
+        # Build the Bernoulli trial data.
+        trials = [[0] * (n - i) + [1] * i for i, n in zip(z, N)]
+
+    def build():
+        import pymc
+
+        # Again, with PyMC we design the model from top to bottom.
+        # Let's start with the overall beta and gamma distributions.
+
+        mu = pymc.Beta('mu', a_mu, b_mu)
+        kappa = pymc.Gamma('kappa', s_kappa, r_kappa)
+
+        # Instead of using a 'for' loop for multiple stochastic variables,
+        # we use the 'size' parameter of PyMC.
+        # We could use a '@deterministic' wrapper, but operations already
+        # generate it.
 
-# For better code flow, we define the data first.
-# Based on the original code's 'Therapeutic touch data'.
+        a = mu * kappa
+        b = (1.0 - mu) * kappa
 
-z = [1, 2, 3, 3, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4,
-     4, 5, 5, 5, 5, 5, 5, 5, 6, 6, 7, 7, 7, 8]
-N = 10  # Number of trials for each z.
+        # One beta for each subject.
+        theta = pymc.Beta('theta', a, b, size=len(z))
 
-data = [[0] * (N - i) + [1] * i for i in z]  # Build the Bernoulli trial data.
+        # The priors are defined. Now we need to set the likelihood of our
+        # data. The number of successes of each subject is a sufficient
+        # statistic, so a single Binomial node covers all subjects.
 
-# Again, with PyMC we design the model from top to bottom.
-# Let's start defining the hierarchical prior's constants.
-# A,B constant for the overall beta distribution for mu.
+        if likelihood == 'binomial':
+            like = pymc.Binomial('like', n=N, p=theta, value=z,
+                                 observed=True)
 
-a_mu = 2.0
-b_mu = 2.0
+        # The explicit trials can't be defined the same way.
+        # We need a 'for' loop. Or the 'Lambda()' class.
+        # For more info: https://github.com/pymc-devs/pymc/issues/319
 
-# Shape and rate constants for the overall gamma distribution for kappa.
-# They are reparametrized as mean and standard deviation.
+        else:
+            like = []
+            for i in range(len(trials)):
+                like.append(pymc.Bernoulli('like_%i' % i, p=theta[i],
+                                           value=trials[i], observed=True))
 
-s_kappa = 10**2 / 10**2
-r_kappa = 10 / 10**2
+        # Done! Now we need to collect the variables.
 
-# Then, we define the overall beta and gamma distributions.
+        return pymc.Model([theta, mu, kappa])
 
-mu = pymc.Beta('mu', a_mu, b_mu)
-kappa = pymc.Gamma('kappa', s_kappa, r_kappa)
+    def set_data(model):
+        if likelihood == 'binomial':
+            find_node(model, 'like').parents['n'] = N
+            find_node(model, 'like').set_value(z, force=True)
+        else:
+            for i in range(len(trials)):
+                find_node(model, 'like_%i' % i).set_value(trials[i],
+                                                         force=True)
 
-# Instead of using a 'for' loop for multiple stochastic variables,
-# we use the 'size' parameter of PyMC. This is why we defined the data first.
-# We could use a '@deterministic' wrapper, but operations already generate it.
+    if likelihood == 'binomial':
+        # The graph has a single likelihood node, sized by the subjects.
+        shapes = [z]
+    else:
+        # The graph has one node per subject, with one value per trial.
+        shapes = [tuple(N)]
+    return LazyModel((build_model, (data,), priors),
+                     lambda: _cache.get(model_key(shapes, priors), build,
+                                        set_data))
 
-a = mu * kappa
-b = (1.0 - mu) * kappa
 
-theta = pymc.Beta('theta', a, b, size=len(data))  # One beta for each subject.
+@timed('fit', model='BernBetaMuKappaPyMC')
+def fit(model, iter=60000, burn=10000, thin=2, chains=1, seed=None,
+        dbdir=None, target_ess=None, warm_start=None, warm_burn=None):
+    '''Sample the posterior of a model built by 'build_model'.
 
-# The priors are defined. Now we need to set the likelihood of our data.
-# The likelihood can't be defined the same way. We need a 'for' loop.
-# Or the 'Lambda()' class.
-# For more info: https://github.com/pymc-devs/pymc/issues/319
-#
-# for i in range(len(data)):
-#     like_i = pymc.Bernoulli('like_%i' % i, p=theta[i], value=data[i],
-#                             observed=True)
-#
-# The code above works nicely (the posterior result is the same, and each theta
-# is updated with its data. But how does looping the declaration of the same
-# variable works? I prefer the following code, since it makes more sense.
+    Returns a dictionary with the (chain, draw, ...) traces of 'mu',
+    'kappa' and 'theta'.
+    With 'dbdir', the traces are memory-mapped files in that directory.
+    With 'target_ess', sampling stops as soon as every parameter reaches
+    that effective sample size, or after 'iter' iterations.
 
-like = []
-for i in range(len(data)):
-    like.append(pymc.Bernoulli('like_%i' % i, p=theta[i],
-                               value=data[i], observed=True))
+    With 'warm_start', a 'state_cache.StateCache' (or True), MCMC starts
+    from the states saved by a previous fit of the same data, or of the
+    data before rows were appended, with a burn-in of 'warm_burn'
+    (default: burn / 10).
 
-# Done! Now we need to collect the variables and fit our model.
+    '''
+    return fit_model(model, ('mu', 'kappa', 'theta'), iter=iter, burn=burn,
+                     thin=thin, chains=chains, seed=seed, dbdir=dbdir,
+                     target_ess=target_ess,
+                     warm_start=warm_start, warm_burn=warm_burn)
 
-model = pymc.Model([theta, mu, kappa])
 
-map_ = pymc.MAP(model)
-map_.fit()
+def main():
+    from matplotlib import pyplot as plot
 
-mcmc = pymc.MCMC(model)
-mcmc.sample(iter=60000, burn=10000, thin=2)
+    # For better code flow, we define the data first.
+    # Based on the original code's 'Therapeutic touch data'.
 
-# Extracting the parameter samples.
+    z = [1, 2, 3, 3, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4,
+         4, 5, 5, 5, 5, 5, 5, 5, 6, 6, 7, 7, 7, 8]
+    N = 10  # Number of trials for each z.
 
-mu_sample = mcmc.trace('mu')[:]
-kappa_sample = mcmc.trace('kappa')[:]
-theta_sample = mcmc.trace('theta')[:]
+    # Build the model and sample the posterior.
 
-# And plot them.
+    model = build_model((z, N))
+    trace = merge_chains(fit(model))
 
-plot.figure(figsize=(8.0, 8.0))
+    # Extracting the parameter samples.
 
-plot.subplot(221)
-plot_post(mu_sample, comp=0.5, title=r'$\mu$ posterior distribution')
+    mu_sample = trace['mu']
+    kappa_sample = trace['kappa']
+    theta_sample = trace['theta']
 
-plot.subplot(222)
-plot_post(kappa_sample, title=r'$\kappa$ posterior distribution')
+    # And plot them.
 
-plot.subplot(223)
-plot_post(theta_sample[:, 0], title=r'$\theta_1$ posterior distribution')
+    plot.figure(figsize=(8.0, 8.0))
 
-plot.subplot(224)
-plot_post(theta_sample[:, 27], title=r'$\theta_{28}$ posterior distribution')
+    plot.subplot(221)
+    plot_post(mu_sample, comp=0.5, title=r'$\mu$ posterior distribution')
 
-plot.subplots_adjust(wspace=0.2, hspace=0.2)
-plot.show()
+    plot.subplot(222)
+    plot_post(kappa_sample, title=r'$\kappa$ posterior distribution')
+
+    plot.subplot(223)
+    plot_post(theta_sample[:, 0], title=r'$\theta_1$ posterior distribution')
+
+    plot.subplot(224)
+    plot_post(theta_sample[:, 27],
+              title=r'$\theta_{28}$ posterior distribution')
+
+    plot.subplots_adjust(wspace=0.2, hspace=0.2)
+    plot.show()
+
+
+if __name__ == '__main__':
+    main()
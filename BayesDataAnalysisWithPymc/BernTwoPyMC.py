@@ -7,66 +7,306 @@ More info: http://doingbayesiandataanalysis.blogspot.com.br/
 '''
 from __future__ import division
 
-import pymc
-from matplotlib import pyplot as plot
+import numpy as np
 from plot_post import plot_post
+from model_cache import ModelCache, LazyModel, model_key, find_node
+from sampling import fit as fit_model, merge_chains
+from profiling import timed
+from conjugate import beta_posterior, beta_draws, beta_hdi, exact_traces
+from short_hdi import batch_hdi
+from posterior_store import PosteriorStore
 
 # TODO: It would be good to import data from CSV files.
 
-# Model specification in PyMC goes backwards, in comparison to JAGS:
-# first the prior are specified, THEN the likelihood function.
+# Built models are cached, so that new data with the same shape
+# reuse the graph.
 
-# TODO: With PyMC, it´s possible to define many stochastic variables
-# in just one variable name using the 'size' function parameter.
+_cache = ModelCache()
 
-# But for now, I will use multiple variable names for simplicity.
 
-theta1 = pymc.Beta('theta1', alpha=3, beta=3)
-theta2 = pymc.Beta('theta2', alpha=3, beta=3)
+@timed('build', model='BernTwoPyMC')
+def build_model(data, alpha=3.0, beta=3.0):
+    '''Build the two proportions model.
 
-# Define the observed data.
+    :Arguments:
+        data: pair of lists with the 0/1 outcomes of each group.
+        alpha, beta: constants of the Beta prior of both proportions.
 
-data = [[1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 0, 0, 0, 0, 1, 1],
-        [1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0]]
+    Returns a 'model_cache.LazyModel': the PyMC graph is only built (or
+    fetched from the cache) when MCMC samples it, so the exact posterior
+    of 'fit' does not need PyMC.
 
-# Define the likelihood function for the observed data.
+    '''
+    priors = dict(alpha=alpha, beta=beta)
 
-like1 = pymc.Bernoulli('like1', theta1, observed=True, value=data[0])
-like2 = pymc.Bernoulli('like2', theta2, observed=True, value=data[1])
+    def build():
+        import pymc
 
-# Use the PyMC 'Model' class to collect all the variables we are interested in.
+        # Model specification in PyMC goes backwards, in comparison to JAGS:
+        # first the prior are specified, THEN the likelihood function.
 
-model = pymc.Model([theta1, theta2])
+        # TODO: With PyMC, it´s possible to define many stochastic variables
+        # in just one variable name using the 'size' function parameter.
 
-# And instantiate the MCMC class to sample the posterior.
+        # But for now, I will use multiple variable names for simplicity.
 
-mcmc = pymc.MCMC(model)
-mcmc.sample(40000, 10000, 1)
+        theta1 = pymc.Beta('theta1', alpha=alpha, beta=beta)
+        theta2 = pymc.Beta('theta2', alpha=alpha, beta=beta)
 
-# Use PyMC built-in plot function to show graphs of the samples.
+        # Define the likelihood function for the observed data.
 
-# pymc.Matplot.plot(mcmc)
-# plot.show()
+        like1 = pymc.Bernoulli('like1', theta1, observed=True, value=data[0])
+        like2 = pymc.Bernoulli('like2', theta2, observed=True, value=data[1])
 
-# Let's try plotting using Matplotlib's 'pyplot'.
-# First, we extract the traces for the parameters of interest.
+        # Use the PyMC 'Model' class to collect all the variables
+        # we are interested in.
 
-theta1_samples = mcmc.trace('theta1')[:]
-theta2_samples = mcmc.trace('theta2')[:]
-theta_diff = theta2_samples - theta1_samples
+        return pymc.Model([theta1, theta2])
 
-# Then, we plot a histogram of their individual sample values.
+    def set_data(model):
+        find_node(model, 'like1').set_value(data[0], force=True)
+        find_node(model, 'like2').set_value(data[1], force=True)
 
-plot.figure(figsize=(8.0, 10))
+    # The exact posterior needs no graph: it is only built for MCMC.
+    return LazyModel((build_model, (data,), priors),
+                     lambda: _cache.get(model_key(data, priors), build, set_data))
 
-plot.subplot(311)
-plot_post(theta1_samples, title=r'Posterior of $\theta_1$')
 
-plot.subplot(312)
-plot_post(theta2_samples, title=r'Posterior of $\theta_2$')
+@timed('fit', model='BernTwoPyMC')
+def fit(model, iter=40000, burn=10000, thin=1, chains=1, seed=None,
+        dbdir=None, target_ess=None, method='auto',
+        warm_start=None, warm_burn=None):
+    '''Sample the posterior of a model built by 'build_model'.
 
-plot.subplot(313)
-plot_post(theta_diff, title=r'Posterior of $\Delta\theta$', comp=0.0)
+    Returns a dictionary with the (chain, draw) traces of 'theta1'
+    and 'theta2'.
+    With 'dbdir', the traces are memory-mapped files in that directory.
+    With 'target_ess', sampling stops as soon as every parameter reaches
+    that effective sample size, or after 'iter' iterations.
 
-plot.subplots_adjust(hspace=0.5)
-plot.show()
+    The Beta priors are conjugate, so by default ('method'='auto') the
+    traces are independent draws of the exact Beta posteriors, as many
+    as MCMC would keep, and 'target_ess' is not needed. Use
+    'method'='mcmc' to sample with PyMC instead.
+
+    With 'warm_start', a 'state_cache.StateCache' (or True), MCMC starts
+    from the states saved by a previous fit of the same data, or of the
+    data before rows were appended, with a burn-in of 'warm_burn'
+    (default: burn / 10).
+
+    '''
+    if method == 'auto':
+        _, (data,), priors = model.recipe
+        posteriors = [beta_posterior(outcomes, priors['alpha'],
+                                     priors['beta'])
+                      for outcomes in data]
+
+        def sampler(size, rng):
+            return [beta_draws(a, b, size, rng) for a, b in posteriors]
+        return exact_traces(sampler, ('theta1', 'theta2'), iter, burn, thin,
+                            chains=chains, seed=seed, dbdir=dbdir)
+
+    return fit_model(model, ('theta1', 'theta2'), iter=iter, burn=burn,
+                     thin=thin, chains=chains, seed=seed, use_map=False,
+                     dbdir=dbdir, target_ess=target_ess,
+                     warm_start=warm_start, warm_burn=warm_burn)
+
+
+class StreamingModel(object):
+    '''Two proportions model updated as new outcomes arrive.
+
+    :Arguments:
+        alpha, beta: constants of the Beta prior of both proportions.
+        prior: another prior (default: None, the Beta priors). An object
+               with 'draws(size, rng)', returning arrays of theta1 and
+               theta2 drawn from it, and 'logp(theta1, theta2)', its log
+               density up to a constant.
+        particles: number of particles representing the posterior with
+                   'prior'.
+        min_ess: fraction of the particles under which their effective
+                 number triggers a resampling (default: 0.5).
+        moves: Metropolis moves of every particle after a resampling.
+        seed: seed of the random number generator.
+
+    Only the number of outcomes and of successes of each group are kept,
+    so an update costs O(batch), whatever the data seen before. With the
+    Beta priors the posterior is exact. With another prior, a weighted set
+    of particles drawn from it is reweighted by the likelihood of each
+    batch; when the weights degenerate, the particles are resampled and
+    moved by Metropolis steps on the posterior, which also only needs the
+    counts.
+
+    Usage:
+        stream = StreamingModel()
+        for outcomes1, outcomes2 in batches:
+            stream.update(outcomes1, outcomes2)
+            print(stream.summary()['P(theta2-theta1>0)'])
+
+    '''
+
+    def __init__(self, alpha=3.0, beta=3.0, prior=None, particles=20000,
+                 min_ess=0.5, moves=5, seed=None):
+        self.alpha, self.beta = alpha, beta
+        self.prior = prior
+        self.min_ess = min_ess
+        self.moves = moves
+        self.rng = np.random.RandomState(seed)
+        self.n = np.zeros(2, dtype=np.int64)
+        self.z = np.zeros(2, dtype=np.int64)
+        if prior is not None:
+            self.theta = np.column_stack(prior.draws(particles, self.rng))
+            self.log_weight = np.zeros(particles)
+
+    def update(self, outcomes1=(), outcomes2=()):
+        '''Add new 0/1 outcomes of each group.'''
+        counts = []
+        for outcomes in (outcomes1, outcomes2):
+            outcomes = np.asarray(outcomes)
+            counts.extend((len(outcomes), np.count_nonzero(outcomes)))
+        self.update_counts(*counts)
+
+    def update_counts(self, n1, z1, n2, z2):
+        '''Add 'n1' outcomes of group 1, 'z1' of them successes, and
+        'n2' outcomes of group 2, 'z2' of them successes.'''
+        n, z = np.array([n1, n2]), np.array([z1, z2])
+        self.n += n
+        self.z += z
+        if self.prior is not None:
+            self.log_weight += _log_likelihood(self.theta, n, z)
+            if self.ess() < self.min_ess * len(self.theta):
+                self._rejuvenate()
+
+    def ess(self):
+        '''Effective number of particles.'''
+        weight = np.exp(self.log_weight - self.log_weight.max())
+        return weight.sum()**2 / np.sum(weight**2)
+
+    def _log_posterior(self, theta):
+        return (self.prior.logp(theta[:, 0], theta[:, 1]) +
+                _log_likelihood(theta, self.n, self.z))
+
+    def _rejuvenate(self):
+        '''Resample the particles by their weights (systematic
+        resampling) and move them by random walk Metropolis steps, on the
+        logit scale, targeting the posterior of all the data seen.'''
+        size = len(self.theta)
+        weight = np.exp(self.log_weight - self.log_weight.max())
+        cumulative = np.cumsum(weight / weight.sum())
+        positions = (self.rng.uniform() + np.arange(size)) / size
+        index = np.minimum(np.searchsorted(cumulative, positions), size - 1)
+        theta = self.theta[index]
+        self.log_weight = np.zeros(size)
+
+        x = np.log(theta) - np.log1p(-theta)
+        scale = 2.38 / np.sqrt(2) * np.maximum(x.std(axis=0), 1e-3)
+        # The Jacobian of the logit makes the walk target the posterior.
+        current = self._log_posterior(theta) + np.sum(
+            np.log(theta) + np.log1p(-theta), axis=1)
+        for _ in range(self.moves):
+            x_new = x + scale * self.rng.standard_normal(x.shape)
+            theta_new = 1 / (1 + np.exp(-x_new))
+            proposed = self._log_posterior(theta_new) + np.sum(
+                np.log(theta_new) + np.log1p(-theta_new), axis=1)
+            accept = np.log(self.rng.uniform(size=size)) < proposed - current
+            x[accept] = x_new[accept]
+            theta[accept] = theta_new[accept]
+            current[accept] = proposed[accept]
+        self.theta = theta
+
+    def posterior(self):
+        '''Parameters (a, b) of the Beta posterior of each group, with
+        the Beta priors.'''
+        return [(self.alpha + z, self.beta + n - z)
+                for n, z in zip(self.n, self.z)]
+
+    def draws(self, size):
+        '''Draws of theta1 and theta2 from the current posterior.'''
+        if self.prior is None:
+            return [beta_draws(a, b, size, self.rng)
+                    for a, b in self.posterior()]
+        weight = np.exp(self.log_weight - self.log_weight.max())
+        index = self.rng.choice(len(self.theta), size, p=weight / weight.sum())
+        return [self.theta[index, 0], self.theta[index, 1]]
+
+    def summary(self, cred=0.95, size=100000):
+        '''Summary of the current posterior, from 'size' draws: the
+        counts, and the mean and HDI of theta1, theta2 and their
+        difference, and P(theta2 - theta1 > 0), with the keys of
+        'batch.summary_row'.'''
+        theta1, theta2 = self.draws(size)
+        columns = (('theta1', theta1), ('theta2', theta2),
+                   ('theta2-theta1', theta2 - theta1))
+        hdi_lim = batch_hdi(np.column_stack([c for _, c in columns]), cred)[0]
+        row = {'n1': int(self.n[0]), 'z1': int(self.z[0]),
+               'n2': int(self.n[1]), 'z2': int(self.z[1]),
+               'P(theta2-theta1>0)': float(np.mean(theta2 > theta1))}
+        for (name, sample), (low, high) in zip(columns, hdi_lim):
+            row[name + '_mean'] = float(sample.mean())
+            row[name + '_hdi_low'] = float(low)
+            row[name + '_hdi_high'] = float(high)
+
+        # The Beta posteriors have an exact mean and HDI.
+        if self.prior is None:
+            for name, (a, b) in zip(('theta1', 'theta2'), self.posterior()):
+                row[name + '_mean'] = a / (a + b)
+                if a >= 1 and b >= 1:
+                    row[name + '_hdi_low'], row[name + '_hdi_high'] = \
+                        beta_hdi(a, b, cred)
+        return row
+
+
+def _log_likelihood(theta, n, z):
+    '''Bernoulli log-likelihood of the counts, for (particles, 2) theta.'''
+    return np.sum(z * np.log(theta) + (n - z) * np.log1p(-theta), axis=1)
+
+
+def main():
+    from matplotlib import pyplot as plot
+
+    # Define the observed data.
+
+    data = [[1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 0, 1, 1, 1, 0, 0, 0, 0, 1, 1],
+            [1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 0]]
+
+    # Build the model and instantiate the MCMC class to sample the posterior.
+
+    model = build_model(data)
+    trace = merge_chains(fit(model))
+
+    # Use PyMC built-in plot function to show graphs of the samples.
+
+    # pymc.Matplot.plot(mcmc)
+    # plot.show()
+
+    # Let's try plotting using Matplotlib's 'pyplot'.
+    # First, we extract the traces for the parameters of interest.
+
+    theta1_samples = trace['theta1']
+    theta2_samples = trace['theta2']
+    theta_diff = theta2_samples - theta1_samples
+
+    # Questions about the posterior are answered from a store of the
+    # sorted draws, by binary search instead of a scan of the sample.
+
+    store = PosteriorStore(trace, diffs=[('theta2', 'theta1')])
+    print('P(theta2 > theta1) = %0.3f' % store.more('theta2-theta1', 0.0))
+
+    # Then, we plot a histogram of their individual sample values.
+
+    plot.figure(figsize=(8.0, 10))
+
+    plot.subplot(311)
+    plot_post(theta1_samples, title=r'Posterior of $\theta_1$')
+
+    plot.subplot(312)
+    plot_post(theta2_samples, title=r'Posterior of $\theta_2$')
+
+    plot.subplot(313)
+    plot_post(theta_diff, title=r'Posterior of $\Delta\theta$', comp=0.0)
+
+    plot.subplots_adjust(hspace=0.5)
+    plot.show()
+
+
+if __name__ == '__main__':
+    main()
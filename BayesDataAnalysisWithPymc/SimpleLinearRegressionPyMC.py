@@ -8,12 +8,17 @@ More info: http://doingbayesiandataanalysis.blogspot.com.br/
 '''
 from __future__ import division
 
-import pymc
 import numpy as np
-from matplotlib import pyplot as plot
 from plot_post import plot_post
-from normalize import (normalize, convert_intercept,
-                       convert_slope, convert_tau_sigma)
+from normalize import Standardizer
+from data_loader import load_columns
+from predictive import regression_predictive, regression_interval
+from model_cache import ModelCache, LazyModel, model_key, find_node
+from sampling import fit as fit_model, merge_chains
+from profiling import timed, phase
+from densities import RegressionDensity
+import hmc
+import svi
 from os import path
 
 # Code to find the data path.
@@ -22,108 +27,291 @@ scr_dir = path.dirname(__file__)
 file_name = 'McIntyre1994data.csv'
 comp_dir = path.join(scr_dir, 'Data', file_name)
 
-# So, let's be lazy: the data are from McIntyre cigarette weight.
-# Use numpy to load the data we want directly in the appropriate variables.
+# Built models are cached, so that new data with the same shape
+# reuse the graph.
 
-y, x = np.genfromtxt(comp_dir, delimiter=',',
-                     skip_header=1, usecols=(1, 3), unpack=True)
+_cache = ModelCache()
 
-# Let's try normalizing, as suggested by Krushcke.
 
-zy = normalize(y)
-zx = normalize(x)
+@timed('build', model='SimpleLinearRegressionPyMC')
+def build_model(data, b_tau=1.0e-10, tau_shape=0.01, tau_rate=0.01,
+                tdf_gain=1):
+    '''Build the robust linear regression model.
 
-# Define the priors for the model.
-# First, normal priors for the slope and intercept.
+    :Arguments:
+        data: pair (x, y) of predictor and predicted data arrays, in their
+              original scale. They are normalized here.
+        b_tau: precision of the normal priors for slope and intercept.
+        tau_shape, tau_rate: shape and rate of the gamma prior for tau.
+        tdf_gain: gain constant of Krushcke's DoF transformation.
 
-beta0 = pymc.Normal('b0', 0.0, 1.0e-10)
-beta1 = pymc.Normal('b1', 0.0, 1.0e-10)
+    The data moments are kept in 'model.scaling', a 'Standardizer' that
+    converts the parameters back to the original scale. Returns a
+    'model_cache.LazyModel': the PyMC graph is built (or fetched from the
+    cache and bound to this data) when MCMC samples it.
 
-# Then, gamma and uniform prior for precision and DoF.
-# Krushcke suggests the use of a Student's t distribution for the likelihood.
-# It makes the estimation more robust in the presence of outliers.
-# We will use Krushcke's DoF transformation using a gain constant.
+    '''
+    priors = dict(b_tau=b_tau, tau_shape=tau_shape, tau_rate=tau_rate,
+                  tdf_gain=tdf_gain)
+
+    # Let's try normalizing, as suggested by Krushcke.
+
+    x, y = data
+    scaling = Standardizer(x=x, y=y)
+    zy = scaling.transform('y', y)
+    zx = scaling.transform('x', x)
+
+    def build():
+        import pymc
+
+        # Define the priors for the model.
+        # First, normal priors for the slope and intercept.
+
+        beta0 = pymc.Normal('b0', 0.0, b_tau)
+        beta1 = pymc.Normal('b1', 0.0, b_tau)
+
+        # Then, gamma and uniform prior for precision and DoF.
+        # Krushcke suggests the use of a Student's t distribution for the
+        # likelihood. It makes the estimation more robust in the presence
+        # of outliers. We will use Krushcke's DoF transformation using
+        # a gain constant.
+
+        tau = pymc.Gamma('tau', tau_shape, tau_rate)
+        udf = pymc.Uniform('udf', 0.0, 1.0)
+
+        @pymc.deterministic
+        def tdf(udf=udf, tdf_gain=tdf_gain):
+            return 1 - tdf_gain * np.log(1 - udf)
+
+        # Defining the linear relationship between variables.
+
+        @pymc.deterministic
+        def mu(beta0=beta0, beta1=beta1, x=zx):
+            mu = beta0 + beta1 * x
+            return mu
+
+        # Finally, the likelihood using Student's t distribution.
+
+        like = pymc.NoncentralT('like', mu=mu, lam=tau, nu=tdf,
+                                value=zy, observed=True)
+
+        # For those who want a more traditional linear model:
+        #like = pymc.Normal('like', mu=mu, tau=tau, value=zy, observed=True)
+
+        return pymc.Model([beta0, beta1, tau, tdf])
+
+    def set_data(model):
+        find_node(model, 'mu').parents['x'] = zx
+        find_node(model, 'like').set_value(zy, force=True)
+
+    return LazyModel((build_model, (data,), priors),
+                     lambda: _cache.get(model_key([x, y], priors), build,
+                                        set_data),
+                     scaling=scaling)
+
+
+@timed('fit', model='SimpleLinearRegressionPyMC')
+def fit(model, iter=100000, burn=50000, thin=10, chains=1, seed=None,
+        dbdir=None, target_ess=None, sampler='metropolis',
+        warm_start=None, warm_burn=None, svi_kwargs=None):
+    '''Sample the posterior of a model built by 'build_model'.
+
+    Returns a dictionary with the (chain, draw) traces of the normalized
+    'b0', 'b1' and 'tau', and of 'tdf'.
+    With 'dbdir', the traces are memory-mapped files in that directory.
+    With 'target_ess', sampling stops as soon as every parameter reaches
+    that effective sample size, or after 'iter' iterations.
+
+    With 'sampler'='nuts', the model is sampled by the No-U-Turn sampler
+    of 'hmc', which mixes far better than PyMC's Metropolis steps: use
+    much shorter runs, such as iter=2000, burn=1000 and thin=1.
+
+    With 'sampler'='svi', the posterior is approximated by stochastic
+    variational inference ('svi.fit', with the arguments in 'svi_kwargs'),
+    on minibatches of the data, and the traces are (iter - burn) // thin
+    independent draws per chain of the approximation. Use it when the
+    data are too many for MCMC; see also 'fit_streaming'.
+
+    With 'warm_start', a 'state_cache.StateCache' (or True), MCMC starts
+    from the states saved by a previous fit of the same data, or of the
+    data before rows were appended, with a burn-in of 'warm_burn'
+    (default: burn / 10).
+
+    '''
+    if sampler == 'nuts':
+        if target_ess is not None:
+            raise ValueError('target_ess needs the metropolis sampler')
+        _, ((x, y),), priors = model.recipe
+        density = RegressionDensity(model.scaling.transform('x', x),
+                                    model.scaling.transform('y', y),
+                                    **priors)
+        return hmc.fit(density, iter=iter, burn=burn, thin=thin,
+                       chains=chains, seed=seed, dbdir=dbdir)
+
+    if sampler == 'svi':
+        if target_ess is not None or dbdir is not None:
+            raise ValueError('target_ess and dbdir need an MCMC sampler')
+        _, ((x, y),), priors = model.recipe
+        zx = model.scaling.transform('x', x)
+        zy = model.scaling.transform('y', y)
+        density = RegressionDensity(zx, zy, **priors)
+        approx = svi.fit(density, lambda: svi.chunks((zx, zy)), len(zy),
+                         seed=seed, **(svi_kwargs or {}))
+        return svi.sample_traces(density, approx, (iter - burn) // thin,
+                                 chains=chains, seed=seed)
+
+    return fit_model(model, ('b0', 'b1', 'tau', 'tdf'), iter=iter,
+                     burn=burn, thin=thin, chains=chains, seed=seed,
+                     dbdir=dbdir, target_ess=target_ess,
+                     warm_start=warm_start, warm_burn=warm_burn)
+
+
+@timed('fit', model='SimpleLinearRegressionPyMC', sampler='svi')
+def fit_streaming(stream, draws=10000, seed=None, svi_kwargs=None,
+                  **priors):
+    '''Approximate the posterior of data streamed in chunks, by SVI.
+
+    :Arguments:
+        stream: function returning a new iterator over (x, y) chunks of
+                the data, in their original scale, at every pass. For
+                columns on disk, use 'svi.chunks' on the memory-mapped
+                arrays of 'load_columns':
+                    columns = load_columns(path, ('Wt', 'Tar'))
+                    stream = lambda: svi.chunks((columns['Wt'],
+                                                 columns['Tar']))
+        draws: number of draws of the approximation.
+        seed: seed of the random number generator.
+        svi_kwargs: arguments of 'svi.fit', such as 'iter' or 'batch'.
+        priors: priors of the model, as in 'build_model'.
+
+    A first pass computes the moments of the data; the fit reads them
+    again one chunk at a time, so they never have to fit in memory.
+    Returns the (chain, draw) traces of the normalized 'b0', 'b1' and
+    'tau', and of 'tdf', as 'fit' does, and the 'Standardizer' that
+    converts them back to the original scale.
+
+    '''
+    scaling = Standardizer()
+    size = 0
+    for x, y in stream():
+        scaling.partial_fit('x', x)
+        scaling.partial_fit('y', y)
+        size += len(y)
+
+    def normalized():
+        for x, y in stream():
+            yield scaling.transform('x', x), scaling.transform('y', y)
+
+    density = RegressionDensity((), (), **priors)
+    approx = svi.fit(density, normalized, size, seed=seed,
+                     **(svi_kwargs or {}))
+    return svi.sample_traces(density, approx, draws, seed=seed), scaling
+
+
+def check_svi(x, y, subsample=2000, seed=None, svi_kwargs=None, **priors):
+    '''Compare the SVI approximation with NUTS on a random subsample.
+
+    :Arguments:
+        x, y: predictor and predicted data, in their original scale.
+        subsample: number of rows both methods are fitted to.
+        seed, svi_kwargs, priors: as in 'fit_streaming'.
+
+    Returns the report of 'svi.compare' for the normalized parameters:
+    the difference of the means in posterior SDs ('z') and the ratio of
+    the SDs ('sd_ratio') of each one.
+
+    '''
+    rng = np.random.RandomState(seed)
+    rows = rng.choice(len(y), min(subsample, len(y)), replace=False)
+    x, y = np.asarray(x)[rows], np.asarray(y)[rows]
+    scaling = Standardizer(x=x, y=y)
+    zx, zy = scaling.transform('x', x), scaling.transform('y', y)
+    density = RegressionDensity(zx, zy, **priors)
+
+    approx = svi.fit(density, lambda: svi.chunks((zx, zy)), len(zy),
+                     seed=seed, **(svi_kwargs or {}))
+    approx_trace = svi.sample_traces(density, approx, 4000, seed=seed)
+    mcmc_trace = hmc.fit(density, iter=2000, burn=1000, chains=2, seed=seed)
+    return svi.compare(approx_trace, mcmc_trace)
 
-tau = pymc.Gamma('tau', 0.01, 0.01)
-udf = pymc.Uniform('udf', 0.0, 1.0)
-tdf_gain = 1
 
+def main():
+    from matplotlib import pyplot as plot
 
-@pymc.deterministic
-def tdf(udf=udf, tdf_gain=tdf_gain):
-    return 1 - tdf_gain * np.log(1 - udf)
+    # So, let's be lazy: the data are from McIntyre cigarette weight.
+    # Load the columns we want by name. They are cached in binary form
+    # after the first run.
 
-# Defining the linear relationship between variables.
+    data = load_columns(comp_dir, ('Tar', 'Wt'))
+    y, x = data['Tar'], data['Wt']
 
+    # The model is ready! Sampling code below.
 
-@pymc.deterministic
-def mu(beta0=beta0, beta1=beta1, x=zx):
-    mu = beta0 + beta1 * x
-    return mu
+    model = build_model((x, y))
+    trace = merge_chains(fit(model))
 
+    # Collect the sample values for the parameters.
 
-# Finally, the likelihood using Student's t distribution.
+    z0_sample = trace['b0']
+    z1_sample = trace['b1']
+    ztau_sample = trace['tau']
+    tdf_sample = trace['tdf']
 
-like = pymc.NoncentralT('like', mu=mu, lam=tau, nu=tdf,
-                        value=zy, observed=True)
+    # Convert the data back to scale, with the moments computed
+    # when the model was built.
 
-# For those who want a more traditional linear model:
-#like = pymc.Normal('like', mu=mu, tau=tau, value=zy, observed=True)
+    with phase('convert', model='SimpleLinearRegressionPyMC'):
+        b0_sample = model.scaling.intercept(z0_sample, z1_sample)
+        b1_sample = model.scaling.slope(z1_sample)
+        sigma_sample = model.scaling.tau_sigma(ztau_sample)
 
-# The model is ready! Sampling code below.
+    # Plot the results
 
-model = pymc.Model([beta0, beta1, tau, tdf])
-fit = pymc.MAP(model)
-fit.fit()
-mcmc = pymc.MCMC(model)
-mcmc.sample(iter=100000, burn=50000, thin=10)
+    plot.figure(figsize=(8.0, 8.0))
 
-# Collect the sample values for the parameters.
+    plot.subplot(221)
+    plot_post(b0_sample, title=r'$\beta_0$ posterior')
 
-z0_sample = mcmc.trace('b0')[:]
-z1_sample = mcmc.trace('b1')[:]
-ztau_sample = mcmc.trace('tau')[:]
-tdf_sample = mcmc.trace('tdf')[:]
+    plot.subplot(222)
+    plot_post(b1_sample, title=r'$\beta_1$ posterior')
 
-# Convert the data back to scale.
+    plot.subplot(223)
+    plot_post(sigma_sample, title=r'$\sigma$ posterior')
 
-b0_sample = convert_intercept(x, y, z0_sample, z1_sample)
-b1_sample = convert_slope(x, y, z1_sample)
-sigma_sample = convert_tau_sigma(y, ztau_sample)
+    plot.subplot(224)
+    plot_post(tdf_sample, title=r'tDF posterior')
 
-# Plot the results
+    plot.subplots_adjust(wspace=0.2, hspace=0.2)
 
-plot.figure(figsize=(8.0, 8.0))
+    # Plot the data with some credible regression lines.
 
-plot.subplot(221)
-plot_post(b0_sample, title=r'$\beta_0$ posterior')
+    plot.figure(figsize=(8.0, 8.0))
 
-plot.subplot(222)
-plot_post(b1_sample, title=r'$\beta_1$ posterior')
+    plot.scatter(x, y, c='k', s=60)
+    plot.title('Data points with credible regression lines')
 
-plot.subplot(223)
-plot_post(sigma_sample, title=r'$\sigma$ posterior')
+    x1 = plot.axis()[0]
+    x2 = plot.axis()[1]
 
-plot.subplot(224)
-plot_post(tdf_sample, title=r'tDF posterior')
+    plot.autoscale(enable=False)
 
-plot.subplots_adjust(wspace=0.2, hspace=0.2)
+    # The 95% posterior predictive HDI, on a grid of new x values.
 
-# Plot the data with some credible regression lines.
+    x_grid = np.linspace(x1, x2, 200)
+    pred_hdi = regression_interval(b0_sample, b1_sample, sigma_sample,
+                                   tdf_sample, x_grid, seed=0)
+    plot.fill_between(x_grid, pred_hdi[:, 0], pred_hdi[:, 1],
+                      color='#348ABD', alpha=0.2)
 
-plot.figure(figsize=(8.0, 8.0))
+    # Fifty credible lines, computed at once and drawn in a single call.
 
-plot.scatter(x, y, c='k', s=60)
-plot.title('Data points with credible regression lines')
+    step = max(1, len(b1_sample) // 50)
+    lines = regression_predictive(b0_sample[::step], b1_sample[::step],
+                                  None, None, [x1, x2], noise=False)
+    plot.plot([x1, x2], lines.T, c='#348ABD', lw=1)
 
-x1 = plot.axis()[0]
-x2 = plot.axis()[1]
+    plot.show()
 
-plot.autoscale(enable=False)
 
-for line in range(0, len(b1_sample), len(b1_sample) // 50):
-    plot.plot([x1, x2], [b0_sample[line] + b1_sample[line] * x1,
-                         b0_sample[line] + b1_sample[line] * x2],
-              c='#348ABD', lw=1)
-
-plot.show()
+if __name__ == '__main__':
+    main()
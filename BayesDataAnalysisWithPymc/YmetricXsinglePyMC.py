@@ -8,57 +8,140 @@ More info: http://doingbayesiandataanalysis.blogspot.com.br/
 '''
 from __future__ import division
 
-import pymc
 import numpy as np
-from matplotlib import pyplot as plot
 from plot_post import plot_post
+from model_cache import ModelCache, LazyModel, model_key, find_node
+from sampling import fit as fit_model, merge_chains
+from profiling import timed
+from conjugate import (normal_gamma_posterior, normal_gamma_draws,
+                       is_flat, exact_traces)
 
-# For simplicity's sake, I will generate random data just like
-# the R code in the book.
+# Built models are cached, so that new data with the same shape
+# reuse the graph.
 
-t_mean = 100
-t_sd = 15
-N = 20
+_cache = ModelCache()
 
-# Generate N samples, no rounding.
 
-y = np.random.normal(t_mean, t_sd, N)
+@timed('build', model='YmetricXsinglePyMC')
+def build_model(data, mu_mean=0.0, mu_tau=1.0e-10, tau_shape=0.01,
+                tau_rate=0.01):
+    '''Build the single group metric model.
 
-# Defining the priors for mu and tau.
+    :Arguments:
+        data: array of metric observations.
+        mu_mean, mu_tau: mean and precision of the normal prior for mu.
+        tau_shape, tau_rate: shape and rate of the gamma prior for tau.
 
-mu = pymc.Normal('mu', 0.0, 1.0e-10)  # Mean: 0.0, SD: 100000
-tau = pymc.Gamma('tau', 0.01, 0.01)  # Mean: 1.0, SD: 10
+    Returns a 'model_cache.LazyModel': the PyMC graph is only built (or
+    fetched from the cache) when MCMC samples it, so the exact posterior
+    of 'fit' does not need PyMC.
 
-# Now the likelihood function.
+    '''
+    priors = dict(mu_mean=mu_mean, mu_tau=mu_tau, tau_shape=tau_shape,
+                  tau_rate=tau_rate)
 
-like = pymc.Normal('like', mu, tau, value=y, observed=True)
+    def build():
+        import pymc
 
-# Create the model, generate initialization values and sample its posterior.
+        # Defining the priors for mu and tau.
 
-model = pymc.Model([like, mu, tau])
-map_ = pymc.MAP(model)
-map_.fit()
-mcmc = pymc.MCMC(model)
-mcmc.sample(iter=60000, burn=40000, thin=2)
+        mu = pymc.Normal('mu', mu_mean, mu_tau)  # Mean: 0.0, SD: 100000
+        tau = pymc.Gamma('tau', tau_shape, tau_rate)  # Mean: 1.0, SD: 10
 
-# Sample the posterior for the parameter estimates.
+        # Now the likelihood function.
 
-mu_sample = mcmc.trace('mu')[:]
-tau_sample = mcmc.trace('tau')[:]
+        like = pymc.Normal('like', mu, tau, value=data, observed=True)
 
-# Keeping the same idea as the book: convert the posterior samples to SD.
+        return pymc.Model([like, mu, tau])
 
-sigma_sample = 1 / np.sqrt(tau_sample)
+    def set_data(model):
+        find_node(model, 'like').set_value(data, force=True)
 
-# Plot the results.
+    # The exact posterior needs no graph: it is only built for MCMC.
+    return LazyModel((build_model, (data,), priors),
+                     lambda: _cache.get(model_key([data], priors), build, set_data))
 
-plot.figure(figsize=(8.0, 8.0))
 
-plot.subplot(211)
-plot_post(mu_sample, title=r'$\mu$ posterior distribution')
+@timed('fit', model='YmetricXsinglePyMC')
+def fit(model, iter=60000, burn=40000, thin=2, chains=1, seed=None,
+        dbdir=None, target_ess=None, method='auto',
+        warm_start=None, warm_burn=None):
+    '''Sample the posterior of a model built by 'build_model'.
 
-plot.subplot(212)
-plot_post(sigma_sample, title=r'$\sigma$ posterior distribution')
+    Returns a dictionary with the (chain, draw) traces of 'mu' and 'tau'.
+    With 'dbdir', the traces are memory-mapped files in that directory.
+    With 'target_ess', sampling stops as soon as every parameter reaches
+    that effective sample size, or after 'iter' iterations.
 
-plot.subplots_adjust(wspace=0.2, hspace=0.2)
-plot.show()
+    When the prior of mu is flat for the data (the default 'mu_tau' is),
+    the posterior is the Normal-Gamma one, and by default ('method'=
+    'auto') the traces are independent draws of it, as many as MCMC
+    would keep. Otherwise, or with 'method'='mcmc', PyMC samples it.
+
+    With 'warm_start', a 'state_cache.StateCache' (or True), MCMC starts
+    from the states saved by a previous fit of the same data, or of the
+    data before rows were appended, with a burn-in of 'warm_burn'
+    (default: burn / 10).
+
+    '''
+    _, (data,), priors = model.recipe
+    if method == 'auto' and is_flat(priors['mu_tau'], data):
+        posterior = normal_gamma_posterior(data, priors['tau_shape'],
+                                           priors['tau_rate'])
+
+        def sampler(size, rng):
+            return normal_gamma_draws(*posterior, size=size, rng=rng)
+        return exact_traces(sampler, ('mu', 'tau'), iter, burn, thin,
+                            chains=chains, seed=seed, dbdir=dbdir)
+
+    return fit_model(model, ('mu', 'tau'), iter=iter, burn=burn,
+                     thin=thin, chains=chains, seed=seed, dbdir=dbdir,
+                     target_ess=target_ess,
+                     warm_start=warm_start, warm_burn=warm_burn)
+
+
+def main():
+    from matplotlib import pyplot as plot
+
+    # For simplicity's sake, I will generate random data just like
+    # the R code in the book.
+
+    t_mean = 100
+    t_sd = 15
+    N = 20
+
+    # Generate N samples, no rounding.
+
+    y = np.random.normal(t_mean, t_sd, N)
+
+    # Create the model, generate initialization values and sample
+    # its posterior.
+
+    model = build_model(y)
+    trace = merge_chains(fit(model))
+
+    # Sample the posterior for the parameter estimates.
+
+    mu_sample = trace['mu']
+    tau_sample = trace['tau']
+
+    # Keeping the same idea as the book: convert the posterior samples to SD.
+
+    sigma_sample = 1 / np.sqrt(tau_sample)
+
+    # Plot the results.
+
+    plot.figure(figsize=(8.0, 8.0))
+
+    plot.subplot(211)
+    plot_post(mu_sample, title=r'$\mu$ posterior distribution')
+
+    plot.subplot(212)
+    plot_post(sigma_sample, title=r'$\sigma$ posterior distribution')
+
+    plot.subplots_adjust(wspace=0.2, hspace=0.2)
+    plot.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+'''Fit the same model to many independent datasets in one job.
+The datasets are sent to a pool of worker processes in groups. Each
+worker imports the model module once and keeps its model cache, so a
+dataset with an already seen shape only swaps the observed data of a
+built graph. Every fit is reduced to a row of summaries (mean, HDI and
+P(diff > 0)) and the rows are written to a CSV table.
+
+Usage:
+    segments = ((name, (a_outcomes, b_outcomes)) for name, ... in ...)
+    run_batch('BernTwoPyMC', segments, 'results.csv',
+              diffs=[('theta2', 'theta1')])
+
+'''
+from __future__ import division
+
+import csv
+import sys
+from importlib import import_module
+from itertools import islice
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import cpu_count
+
+from sampling import chain_seeds, merge_chains, trace_columns
+from short_hdi import batch_hdi
+
+# Differences summarized by default, for the models comparing groups.
+
+DIFFS = {
+    'BernTwoPyMC': [('theta2', 'theta1')],
+}
+
+
+def summary_row(trace, cred=0.95, diffs=()):
+    '''Summarize the pooled draws of one fit.
+
+    :Arguments:
+        trace: dictionary with the (draw, ...) sample of each variable.
+        cred: credible mass of the HDI (default: 95%).
+        diffs: sequence of pairs of scalar variables (a, b), whose
+               difference a - b is summarized as well.
+
+    Returns a dictionary with '<name>_mean', '<name>_hdi_low' and
+    '<name>_hdi_high' for every variable (vector variables get one set
+    per element, as 'a[0]'), and '<a>-<b>_mean', its HDI and
+    'P(<a>-<b>>0)' for every difference.
+
+    '''
+    columns = trace_columns(trace, diffs)
+    probabilities = {}
+    for label, diff in columns[len(columns) - len(diffs):]:
+        probabilities['P(%s>0)' % label] = float(
+            np.count_nonzero(diff > 0) / len(diff))
+
+    samples = np.column_stack([sample for _, sample in columns])
+    means = samples.mean(axis=0)
+    hdi_lim = batch_hdi(samples, cred)[0]
+
+    row = probabilities
+    for (label, _), mean, (low, high) in zip(columns, means, hdi_lim):
+        row[label + '_mean'] = float(mean)
+        row[label + '_hdi_low'] = float(low)
+        row[label + '_hdi_high'] = float(high)
+    return row
+
+
+def _fit_group(job):
+    '''Fit and summarize a group of datasets in a worker.'''
+    module_name, group, priors, fit_kwargs, cred, diffs = job
+    module = import_module(module_name)
+    rows = []
+    for key, data, seed in group:
+        row = dict(key=key)
+        try:
+            # Models with an exact posterior return a lazy model, whose
+            # graph is never built: they are fitted by 'conjugate'.
+            model = module.build_model(data, **priors)
+            trace = merge_chains(module.fit(model, seed=seed, **fit_kwargs))
+            row.update(summary_row(trace, cred, diffs))
+        except Exception as error:
+            # One bad dataset must not stop the whole batch.
+            row['error'] = '%s: %s' % (type(error).__name__, error)
+        rows.append(row)
+    return rows
+
+
+def fit_many(module_name, datasets, priors=None, fit_kwargs=None,
+             cred=0.95, diffs=None, seed=None, max_workers=None, group=16):
+    '''Fit a model to every dataset of a sequence or stream.
+
+    :Arguments:
+        module_name: name of the model module, such as 'BernTwoPyMC'.
+                     It must have the 'build_model' and 'fit' functions.
+        datasets: iterable of (key, data) pairs. It is consumed lazily,
+                  so it may be a generator over a large source.
+        priors: keyword arguments of 'build_model' (default: its own).
+        fit_kwargs: keyword arguments of 'fit', such as 'iter' and
+                    'burn' (default: its own).
+        cred: credible mass of the HDIs (default: 95%).
+        diffs: pairs of variables whose difference is summarized
+               (default: 'DIFFS' of the module, or none).
+        seed: master seed of the per-dataset seeds (default: None).
+        max_workers: number of worker processes (default: number of
+                     CPUs). Use 1 to fit in this process.
+        group: number of datasets sent to a worker at a time (default:
+               16). Larger groups have less overhead per dataset.
+
+    Yields one row dictionary per dataset (see 'summary_row'), with its
+    'key', in the order the groups finish. A dataset whose fit failed
+    has an 'error' instead of the summaries.
+
+    '''
+    if diffs is None:
+        diffs = DIFFS.get(module_name, [])
+    rng = np.random.RandomState(seed)
+    datasets = iter(datasets)
+
+    def jobs():
+        while True:
+            chunk = list(islice(datasets, group))
+            if not chunk:
+                return
+            seeds = chain_seeds(len(chunk), rng.randint(2**31 - 1))
+            yield (module_name,
+                   [(key, data, s) for (key, data), s in zip(chunk, seeds)],
+                   priors or {}, fit_kwargs or {}, cred, diffs)
+
+    if max_workers == 1:
+        for job in jobs():
+            for row in _fit_group(job):
+                yield row
+        return
+
+    max_workers = max_workers or cpu_count()
+    pending = set()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # Keep only a few groups per worker in flight, so that a stream
+        # of datasets is not read all at once.
+        for job in jobs():
+            pending.add(pool.submit(_fit_group, job))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for row in future.result():
+                        yield row
+        for future in pending:
+            for row in future.result():
+                yield row
+
+
+def _open_csv(path):
+    '''Open 'path' for the csv module, without newline translation.'''
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def write_table(rows, path, fields=None):
+    '''Write summary rows to a CSV file, as they arrive.
+
+    :Arguments:
+        rows: iterable of row dictionaries, such as 'fit_many' yields.
+        path: file name of the table.
+        fields: summary columns, besides 'key' and 'error' (default:
+                those of the first row without an error, which every fit
+                of one model shares).
+
+    Only the failed rows that come before the first fitted one are held
+    in memory. A row with a column outside 'fields' raises ValueError.
+    Returns the number of rows written.
+
+    '''
+    pending = []
+    writer = None
+    count = 0
+    with _open_csv(path) as output:
+        for row in rows:
+            if writer is None:
+                if fields is None and 'error' in row:
+                    pending.append(row)
+                    continue
+                if fields is None:
+                    fields = set(row) - set(['key', 'error'])
+                writer = csv.DictWriter(
+                    output, ['key'] + sorted(fields) + ['error'],
+                    restval='')
+                writer.writeheader()
+                writer.writerows(pending)
+                count += len(pending)
+                pending = []
+            extra = set(row) - set(writer.fieldnames)
+            if extra:
+                raise ValueError('row %r has columns %s that are not in the '
+                                 'table' % (row.get('key'),
+                                            ', '.join(sorted(extra))))
+            writer.writerow(row)
+            count += 1
+        if writer is None:
+            # Every fit failed: only the keys and errors are written.
+            writer = csv.DictWriter(output, ['key', 'error'], restval='')
+            writer.writeheader()
+            writer.writerows(pending)
+            count += len(pending)
+    return count
+
+
+def run_batch(module_name, datasets, path, **kwargs):
+    '''Fit a model to every dataset and write the summaries to 'path'.
+
+    Keyword arguments go to 'fit_many'. Returns the number of rows.
+
+    '''
+    return write_table(fit_many(module_name, datasets, **kwargs), path)
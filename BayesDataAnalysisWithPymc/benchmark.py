@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks for the HDI, plotting and conversion helpers and for every
+model, on synthetic data of several sizes.
+
+Each case runs in a fresh process, so that its peak resident memory is
+measured on its own. Results are written to a JSON file and can be
+compared against a stored baseline:
+
+    python benchmark.py --output results.json
+    python benchmark.py --save-baseline baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.25
+
+The last command exits with status 1 if any case got slower (or bigger)
+than the baseline by more than the tolerance. Any run also fails when a
+fresh worker process takes longer than '--cold-start-budget' to import
+the numeric or model modules, or when they import matplotlib or PyMC.
+Use '--quick' for smaller sizes and '--only' to select cases by name
+prefix.
+
+'''
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 'time.clock' was removed in Python 3.8.
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def _peak_rss_mb():
+    '''Peak resident memory of this process, in megabytes.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    if sys.platform == 'darwin':
+        return peak / 2**20
+    return peak / 2**10
+
+
+# Synthetic data for each model, following the book's examples.
+
+def _bern_two_data(rng, n):
+    return [list(rng.binomial(1, 0.6, n)), list(rng.binomial(1, 0.4, n))]
+
+
+def _bern_beta_data(rng, n, trials=10):
+    theta = rng.beta(5, 5, n)
+    return rng.binomial(trials, theta), trials
+
+
+def _ymetric_data(rng, n):
+    return rng.normal(100, 15, n)
+
+
+def _regression_data(rng, n):
+    x = rng.normal(10, 3, n)
+    y = 5 + 2 * x + rng.standard_t(4, n)
+    return x, y
+
+
+def _anova_data(rng, n, levels=5):
+    x = 1 + np.arange(n) % levels
+    y = 100 + rng.normal(0, 5, levels)[x - 1] + rng.normal(0, 4, n)
+    return x, y
+
+
+MODELS = {
+    'BernTwoPyMC': _bern_two_data,
+    'BernBetaMuKappaPyMC': _bern_beta_data,
+    'YmetricXsinglePyMC': _ymetric_data,
+    'SimpleLinearRegressionPyMC': _regression_data,
+    'ANOVAOnewayPyMC': _anova_data,
+}
+
+
+# Cold start of a worker process: the numeric helpers and the model
+# modules must import without the plotting and sampling libraries, which
+# are loaded when first used, and within a time budget (in seconds).
+
+NUMERIC_MODULES = ('short_hdi', 'normalize', 'online', 'diagnostics',
+                   'predictive', 'contrasts', 'conjugate', 'posterior_store',
+                   'trace_archive', 'batch', 'sampling', 'hmc')
+LAZY_MODULES = ('matplotlib', 'pymc', 'scipy')
+COLD_START_BUDGET = 0.5
+
+_COLD_START = '''
+import json, sys, time
+start = time.time()
+import %s
+print(json.dumps(dict(import_seconds=time.time() - start,
+                      lazy_loaded=[m for m in %r if m in sys.modules])))
+'''
+
+
+# Benchmark cases. Each one prepares its inputs and returns the function
+# to be timed, which returns a dictionary of extra metrics.
+
+def bench_short_hdi(draws):
+    from short_hdi import short_hdi
+
+    sample = np.random.RandomState(0).gamma(2.0, size=draws)
+
+    def timed():
+        short_hdi(sample)
+        return {}
+    return timed
+
+
+def bench_batch_hdi(draws, params=20):
+    from short_hdi import batch_hdi
+
+    sample = np.random.RandomState(0).gamma(2.0, size=(draws, params))
+
+    def timed():
+        batch_hdi(sample, (0.5, 0.9, 0.95))
+        return {}
+    return timed
+
+
+def bench_plot_post(draws):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from plot_post import plot_post
+
+    sample = np.random.RandomState(0).normal(size=draws)
+
+    def timed():
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        plot_post(sample, comp=0.0, ax=figure.add_subplot(111))
+        figure.canvas.draw()
+        return {}
+    return timed
+
+
+def bench_convert(draws, levels=5):
+    import normalize
+
+    rng = np.random.RandomState(0)
+    x, y = _regression_data(rng, 1000)
+    z0 = rng.normal(size=draws)
+    z1 = rng.normal(size=draws)
+    ztau = rng.gamma(2.0, size=draws)
+    a0 = rng.normal(size=draws)
+    a = rng.normal(size=(draws, levels))
+
+    def timed():
+        normalize.convert_intercept(x, y, z0, z1)
+        normalize.convert_slope(x, y, z1)
+        normalize.convert_tau_sigma(y, ztau)
+        normalize.convert_sigma(y, ztau)
+        normalize.convert_baseline(a0, a, levels, y)
+        normalize.convert_deflection(a0, a, levels, y)
+        return {}
+    return timed
+
+
+def bench_cold_start(modules):
+    code = _COLD_START % (', '.join(modules), LAZY_MODULES)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    # The timed wall time includes the start of the interpreter.
+    def timed():
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=here)
+        return json.loads(output.decode('utf-8'))
+    return timed
+
+
+def bench_model(name, n, iter, burn, fit_kwargs=None):
+    from importlib import import_module
+    from diagnostics import ess
+
+    module = import_module(name)
+    data = MODELS[name](np.random.RandomState(0), n)
+
+    # Building the graph is part of the end-to-end time.
+    def timed():
+        start = time.time()
+        model = module.build_model(data)
+        traces = module.fit(model, iter=iter, burn=burn, thin=1, seed=0,
+                            **(fit_kwargs or {}))
+        elapsed = time.time() - start
+        min_ess = min(np.min(ess(trace)) for trace in traces.values())
+        return dict(draws_per_sec=(iter - burn) / elapsed,
+                    ess_per_sec=min_ess / elapsed, min_ess=float(min_ess))
+    return timed
+
+
+def cases(quick=False):
+    '''List the (name, function, arguments, repeat) of every case.'''
+    draw_sizes = (10**4, 10**5) if quick else (10**4, 10**5, 10**6)
+    data_sizes = (20, 1000) if quick else (20, 1000, 100000)
+    iter, burn = (2000, 500) if quick else (10000, 2000)
+    nuts_iter, nuts_burn = (1000, 500) if quick else (2000, 1000)
+
+    result = [('cold_start/numeric', bench_cold_start, (NUMERIC_MODULES,), 3),
+              ('cold_start/models', bench_cold_start, (sorted(MODELS),), 3)]
+    for draws in draw_sizes:
+        result.append(('short_hdi/%i' % draws, bench_short_hdi, (draws,), 5))
+        result.append(('batch_hdi/%ix20' % draws, bench_batch_hdi, (draws,),
+                       5))
+        result.append(('plot_post/%i' % draws, bench_plot_post, (draws,), 5))
+        result.append(('convert/%i' % draws, bench_convert, (draws,), 5))
+    for name in sorted(MODELS):
+        for n in data_sizes:
+            result.append(('%s/N=%i' % (name, n), bench_model,
+                           (name, n, iter, burn), 1))
+    # The same models with the gradient-based sampler.
+    for name in ('ANOVAOnewayPyMC', 'SimpleLinearRegressionPyMC'):
+        for n in data_sizes:
+            result.append(('%s-nuts/N=%i' % (name, n), bench_model,
+                           (name, n, nuts_iter, nuts_burn,
+                            dict(sampler='nuts')), 1))
+    return result
+
+
+def _run_case(func, args, repeat):
+    '''Run one case, returning its best wall and CPU time, its metrics and
+    the peak memory of the process.'''
+    timed = func(*args)
+    best = None
+    for _ in range(repeat):
+        start_wall, start_cpu = time.time(), _cpu_time()
+        metrics = timed()
+        metrics.update(wall=time.time() - start_wall,
+                       cpu=_cpu_time() - start_cpu)
+        if best is None or metrics['wall'] < best['wall']:
+            best = metrics
+    best['peak_rss_mb'] = _peak_rss_mb()
+    return best
+
+
+def run(selected):
+    '''Run the cases, each in its own process.'''
+    results = {}
+    for name, func, args, repeat in selected:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            try:
+                results[name] = pool.submit(_run_case, func, args,
+                                            repeat).result()
+            except ImportError as error:
+                print('%-40s skipped (%s)' % (name, error))
+                continue
+        print('%-40s %8.3f s %8.1f MB' % (name, results[name]['wall'],
+                                          results[name]['peak_rss_mb']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''List the cases that regressed against the baseline.
+
+    A case regresses when its wall time or peak memory grew by more than
+    'tolerance' (a fraction), or its ESS per second dropped by more.
+
+    '''
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for key in ('wall', 'peak_rss_mb'):
+            if metrics[key] > base[key] * (1 + tolerance):
+                regressions.append((name, key, base[key], metrics[key]))
+        if 'ess_per_sec' in base and \
+                metrics['ess_per_sec'] < base['ess_per_sec'] * (1 - tolerance):
+            regressions.append((name, 'ess_per_sec', base['ess_per_sec'],
+                                metrics['ess_per_sec']))
+    return regressions
+
+
+def check_cold_start(results, budget):
+    '''List the cold start cases over the time budget, or importing one
+    of the lazily loaded libraries.'''
+    failures = []
+    for name, metrics in sorted(results.items()):
+        if not name.startswith('cold_start/'):
+            continue
+        if metrics['wall'] > budget:
+            failures.append('%s took %.3f s, over the budget of %.3f s' %
+                            (name, metrics['wall'], budget))
+        if metrics['lazy_loaded']:
+            failures.append('%s imported %s' %
+                            (name, ', '.join(metrics['lazy_loaded'])))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--save-baseline', help='also save the results as '
+                        'a baseline in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown (default: 0.25)')
+    parser.add_argument('--cold-start-budget', type=float,
+                        default=COLD_START_BUDGET,
+                        help='largest cold start time of a worker, in '
+                        'seconds (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='use smaller sizes')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run only cases starting with this prefix')
+    args = parser.parse_args(argv)
+
+    selected = [case for case in cases(args.quick)
+                if not args.only or
+                any(case[0].startswith(prefix) for prefix in args.only)]
+    results = run(selected)
+
+    report = dict(meta=dict(python=platform.python_version(),
+                            numpy=np.__version__,
+                            machine=platform.machine(),
+                            date=time.strftime('%Y-%m-%d %H:%M:%S')),
+                  results=results)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    failures = check_cold_start(results, args.cold_start_budget)
+    for failure in failures:
+        print('COLD START %s' % failure)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)['results'],
+                                  args.tolerance)
+        for name, key, before, after in regressions:
+            print('REGRESSION %s %s: %.4g -> %.4g' % (name, key, before,
+                                                      after))
+        if regressions:
+            return 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+'''Exact posteriors for the conjugate models, without MCMC.
+The two proportions model has Beta priors on Bernoulli rates, so each
+posterior is a Beta distribution. The single group metric model, with a
+flat normal prior on mu, is the limit of the Normal-Gamma conjugate
+model: tau is Gamma distributed and mu, given tau, is normal.
+Independent draws are sampled with vectorized NumPy, and the HDIs can be
+computed from the distributions themselves.
+
+'''
+from __future__ import division
+
+import numpy as np
+
+from profiling import timed
+from sampling import chain_seeds, save_traces
+
+
+def beta_posterior(outcomes, alpha, beta):
+    '''Parameters of the Beta posterior of a Bernoulli rate.
+
+    :Arguments:
+        outcomes: list of the 0/1 outcomes.
+        alpha, beta: constants of the Beta prior.
+
+    '''
+    outcomes = np.asarray(outcomes)
+    z = np.count_nonzero(outcomes)
+    return alpha + z, beta + len(outcomes) - z
+
+
+def normal_gamma_posterior(data, tau_shape, tau_rate):
+    '''Parameters of the posterior of a normal mean (flat prior) and
+    precision (Gamma prior).
+
+    :Arguments:
+        data: array of metric observations.
+        tau_shape, tau_rate: shape and rate of the Gamma prior for tau.
+
+    Returns the tuple (mean, n, shape, rate): tau is Gamma(shape, rate)
+    and mu, given tau, is normal with that mean and precision n * tau.
+
+    '''
+    data = np.asarray(data, dtype=float)
+    n = len(data)
+    mean = data.mean()
+    sum_squares = np.sum((data - mean)**2)
+    return mean, n, tau_shape + (n - 1) / 2, tau_rate + sum_squares / 2
+
+
+def is_flat(mu_tau, data, tol=1e-6):
+    '''Whether a normal prior of precision 'mu_tau' on the mean is flat
+    for 'data': its precision is negligible against that of the sample
+    mean.'''
+    data = np.asarray(data, dtype=float)
+    if len(data) < 2:
+        return False
+    return mu_tau * np.var(data) / len(data) < tol
+
+
+def beta_draws(a, b, size, rng):
+    return rng.beta(a, b, size)
+
+
+def normal_gamma_draws(mean, n, shape, rate, size, rng):
+    '''Joint draws of (mu, tau) from the Normal-Gamma posterior.'''
+    tau = rng.gamma(shape, 1.0 / rate, size)
+    mu = mean + rng.standard_normal(size) / np.sqrt(n * tau)
+    return mu, tau
+
+
+def _grid_quantile(x, density, probs):
+    '''Quantiles of an unnormalized density tabulated on the grid 'x',
+    by trapezoidal integration.'''
+    cdf = np.concatenate(([0.0], np.cumsum(np.diff(x) *
+                                           (density[1:] + density[:-1]) / 2)))
+    return np.interp(probs, cdf / cdf[-1], x)
+
+
+def beta_hdi(a, b, cred=0.95, grid=10001):
+    '''HDI of a Beta(a, b) distribution with a, b >= 1 (unimodal).
+
+    The density is integrated on a grid over its bulk (12 SD around the
+    mean), and the HDI is the narrowest of the intervals of mass 'cred'
+    between the quantiles p and p + cred.
+
+    '''
+    mean = a / (a + b)
+    sd = np.sqrt(a * b / ((a + b)**2 * (a + b + 1)))
+    x = np.linspace(max(mean - 12 * sd, 0.0), min(mean + 12 * sd, 1.0), grid)
+    log_density = np.zeros(grid)
+    with np.errstate(divide='ignore'):
+        if a != 1:
+            log_density += (a - 1) * np.log(x)
+        if b != 1:
+            log_density += (b - 1) * np.log1p(-x)
+    density = np.exp(log_density - log_density.max())
+    lower = np.linspace(0.0, 1.0 - cred, grid)
+    low = _grid_quantile(x, density, lower)
+    high = _grid_quantile(x, density, lower + cred)
+    best = np.argmin(high - low)
+    return low[best], high[best]
+
+
+def normal_gamma_mu_hdi(mean, n, shape, rate, cred=0.95, grid=20001):
+    '''HDI of mu under the Normal-Gamma posterior.
+
+    Its marginal is a Student's t with 2 * shape DoF, symmetric, so the
+    HDI is the central interval. The t density is integrated on a grid
+    of angles, t = tan(angle), which covers its whole support.
+
+    '''
+    df = 2 * shape
+    angle = np.linspace(-np.pi / 2, np.pi / 2, grid)[1:-1]
+    t = np.tan(angle)
+    density = (1 + t**2 / df)**(-(df + 1) / 2) * (1 + t**2)
+    half = np.tan(_grid_quantile(angle, density, 0.5 + cred / 2))
+    half *= np.sqrt(rate / (shape * n))
+    return mean - half, mean + half
+
+
+@timed('sample', sampler='exact')
+def exact_traces(sampler, names, iter, burn, thin, chains=1, seed=None,
+                 dbdir=None):
+    '''Independent posterior draws, shaped as the traces of 'fit'.
+
+    :Arguments:
+        sampler: function of (size, rng) returning a tuple with the draws
+                 of each variable in 'names'.
+        names: names of the variables.
+        iter, burn, thin: as in 'fit': each chain gets the same number of
+                          draws, (iter - burn) // thin, as MCMC would keep.
+        chains, seed: number of chains and master seed.
+        dbdir: directory where the traces are saved as '.npy' files
+               (default: None, kept in memory).
+
+    Returns a dictionary with an array of shape (chain, draw) for each
+    variable.
+
+    '''
+    size = (iter - burn) // thin
+    per_chain = [sampler(size, np.random.RandomState(s))
+                 for s in chain_seeds(chains, seed)]
+    traces = dict((name, np.array([draws[i] for draws in per_chain]))
+                  for i, name in enumerate(names))
+    if dbdir is not None:
+        return save_traces(traces, dbdir)
+    return traces
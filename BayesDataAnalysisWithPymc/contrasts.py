@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+'''Contrasts between the group effects of an ANOVA model.
+A contrast is a labelled vector of weights over the groups, and its
+posterior sample is the product of the (draws, levels) sample of the
+effects by those weights. All the contrasts are stacked in one matrix
+and computed by matrix products, a chunk of contrasts at a time, and
+their means, HDIs and tail probabilities are summarized in batch.
+
+Usage:
+    table = contrast_table(b_sample, pairwise(5))
+    write_table(table_rows(table), 'contrasts.csv')
+
+'''
+from __future__ import division
+
+from collections import OrderedDict
+
+import numpy as np
+
+from short_hdi import batch_hdi
+
+
+def pairwise(levels, names=None):
+    '''Every pairwise contrast 'i vs j' (effect of i minus effect of j)
+    between 'levels' groups, for i < j.
+
+    :Arguments:
+        levels: number of groups.
+        names: names of the groups, for the labels (default: '1' to
+               'levels', as in the group column of the data).
+
+    Returns an ordered dictionary from label to weights.
+
+    '''
+    if names is None:
+        names = [str(i + 1) for i in range(levels)]
+    contrasts = OrderedDict()
+    for i in range(levels):
+        for j in range(i + 1, levels):
+            weights = np.zeros(levels)
+            weights[i], weights[j] = 1, -1
+            contrasts['%s vs %s' % (names[i], names[j])] = weights
+    return contrasts
+
+
+def contrast_matrix(contrasts, levels=None):
+    '''Labels and (contrasts, levels) matrix of weights of 'contrasts'.
+
+    :Arguments:
+        contrasts: dictionary from label to weights (an ordered one keeps
+                   its order; other ones are sorted by label), or a 2-D
+                   array with one contrast per row, labelled by number.
+        levels: number of groups, checked against the weights.
+
+    '''
+    if isinstance(contrasts, dict):
+        labels = list(contrasts)
+        if not isinstance(contrasts, OrderedDict):
+            labels.sort()
+        matrix = np.array([contrasts[label] for label in labels], dtype=float)
+    else:
+        matrix = np.atleast_2d(np.asarray(contrasts, dtype=float))
+        labels = ['Contrast %i' % (i + 1) for i in range(len(matrix))]
+    matrix = matrix.reshape(len(labels), -1)
+    if levels is not None and matrix.shape[1] != levels:
+        raise ValueError('contrasts have %i weights, the model has %i '
+                         'groups' % (matrix.shape[1], levels))
+    return labels, matrix
+
+
+def contrast_samples(b_sample, contrasts, chunk=256):
+    '''Posterior samples of the contrasts, a chunk at a time.
+
+    :Arguments:
+        b_sample: (draws, levels) sample of the group effects.
+        contrasts: see 'contrast_matrix'.
+        chunk: number of contrasts computed at a time.
+
+    Yields the labels of a chunk and its (draws, chunk) sample, so that
+    only 'chunk' contrast samples are kept in memory.
+
+    '''
+    b_sample = np.asarray(b_sample)
+    labels, matrix = contrast_matrix(contrasts, b_sample.shape[1])
+    for start in range(0, len(labels), chunk):
+        yield (labels[start:start + chunk],
+               np.dot(b_sample, matrix[start:start + chunk].T))
+
+
+def contrast_table(b_sample, contrasts, cred=0.95, comp=0.0, chunk=256,
+                   bins=None):
+    '''Summarize the posterior of many contrasts.
+
+    :Arguments:
+        b_sample: (draws, levels) sample of the group effects.
+        contrasts: see 'contrast_matrix'.
+        cred: credible mass of the HDIs, a float or a sequence of floats.
+        comp: value the contrasts are compared to (default: 0).
+        chunk: number of contrasts computed at a time.
+        bins: number of histogram bins (default: None, no histograms).
+
+    Returns a dictionary of columns: 'label', 'mean', 'hdi' (shape
+    (contrasts, 2) for a float 'cred', (len(cred), contrasts, 2) for a
+    sequence), and the probabilities 'less' and 'more' than 'comp'.
+    With 'bins', the histogram 'density' and bin 'edges' of every
+    contrast too, so that it can be plotted from the table alone (see
+    'contrast_stats').
+
+    '''
+    b_sample = np.asarray(b_sample)
+    labels, matrix = contrast_matrix(contrasts, b_sample.shape[1])
+    creds = np.atleast_1d(cred)
+    n_draws = len(b_sample)
+
+    # The means are linear in the effects: one product with their means.
+    mean = np.dot(matrix, b_sample.mean(axis=0))
+    hdi = np.empty((len(creds), len(labels), 2))
+    less = np.empty(len(labels))
+    more = np.empty(len(labels))
+    if bins is not None:
+        density = np.empty((len(labels), bins))
+        edges = np.empty((len(labels), bins + 1))
+    start = 0
+    for chunk_labels, sample in contrast_samples(b_sample, contrasts, chunk):
+        end = start + len(chunk_labels)
+        hdi[:, start:end] = batch_hdi(sample, creds)
+        less[start:end] = np.sum(sample < comp, axis=0) / n_draws
+        more[start:end] = np.sum(sample > comp, axis=0) / n_draws
+        if bins is not None:
+            for j in range(len(chunk_labels)):
+                density[start + j], edges[start + j] = np.histogram(
+                    sample[:, j], bins=bins, density=True)
+        start = end
+
+    table = dict(label=labels, mean=mean,
+                 hdi=hdi if np.ndim(cred) else hdi[0], less=less, more=more)
+    if bins is not None:
+        table.update(density=density, edges=edges)
+    return table
+
+
+def contrast_stats(table, i):
+    '''Statistics of the contrast 'i' of a 'contrast_table' computed with
+    'bins', in the form of 'plot_post.post_stats', to plot it without its
+    sample. The HDI is that of the first credible mass.'''
+    hdi = table['hdi'] if table['hdi'].ndim == 2 else table['hdi'][0]
+    return dict(mean=table['mean'][i], hdi=tuple(hdi[i]),
+                density=table['density'][i], edges=table['edges'][i],
+                less=100 * table['less'][i], more=100 * table['more'][i])
+
+
+def table_rows(table):
+    '''Rows of a 'contrast_table', for 'batch.write_table'. The HDIs
+    are those of the first credible mass.'''
+    hdi = table['hdi'] if table['hdi'].ndim == 2 else table['hdi'][0]
+    for i, label in enumerate(table['label']):
+        yield dict(key=label, mean=table['mean'][i], hdi_low=hdi[i, 0],
+                   hdi_high=hdi[i, 1], less=table['less'][i],
+                   more=table['more'][i])
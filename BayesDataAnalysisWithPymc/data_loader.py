@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+'''Columnar loader for the CSV and whitespace-delimited data files.
+The file is parsed in chunks of lines, keeping only the selected columns,
+each converted to its own type. The parsed columns are cached next to the
+source, as '.npy' files in a '<source>.npycache' directory, and are read
+back memory-mapped while the source is unchanged.
+
+Usage:
+    data = load_columns('Data/McIntyre1994data.csv', ('Tar', 'Wt'))
+    y, x = data['Tar'], data['Wt']
+
+'''
+from __future__ import division
+
+import hashlib
+import json
+import os
+from itertools import islice
+
+import numpy as np
+
+from profiling import timed
+
+
+def file_hash(path, block=2**20):
+    '''SHA-1 hex digest of the content of a file.'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for data in iter(lambda: source.read(block), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _data_lines(source, comments):
+    '''Stripped, non-empty lines of a file, without the comment lines.'''
+    for line in source:
+        line = line.strip()
+        if line and not (comments and line.startswith(comments)):
+            yield line
+
+
+def _split(line, delimiter):
+    if delimiter is None:
+        return line.split()
+    return [field.strip() for field in line.split(delimiter)]
+
+
+def parse_columns(path, columns, delimiter=',', dtypes=None, comments='#',
+                  header=True, chunk=100000):
+    '''Parse the selected columns of a delimited text file.
+
+    :Arguments:
+        path: path of the data file.
+        columns: sequence of column names (from the header line) or
+                 zero-based indexes.
+        delimiter: field delimiter (default: ','). 'None' splits on any
+                   whitespace.
+        dtypes: dictionary with the type of some columns, such as
+                {'Site': str} (default: float for every column).
+        comments: prefix of the lines to skip (default: '#').
+        header: whether the first data line has the column names.
+        chunk: number of lines parsed at a time (default: 100000).
+
+    Returns a dictionary with one array per column, keyed as in 'columns'.
+
+    '''
+    dtypes = dtypes or {}
+    with open(path) as source:
+        lines = _data_lines(source, comments)
+        names = _split(next(lines), delimiter) if header else []
+        index = dict((c, names.index(c) if c in names else int(c))
+                     for c in columns)
+        # Fixed-size columns are parsed by 'np.loadtxt' with a structured
+        # type; text columns of unknown width are split in Python.
+        fixed = [c for c in columns
+                 if np.dtype(dtypes.get(c, float)).itemsize > 0]
+        text = [c for c in columns if c not in fixed]
+        row_type = [('f%i' % i, dtypes.get(c, float))
+                    for i, c in enumerate(fixed)]
+        parts = dict((c, []) for c in columns)
+        while True:
+            block = list(islice(lines, chunk))
+            if not block:
+                break
+            if fixed:
+                rows = np.loadtxt(block, delimiter=delimiter, comments=None,
+                                  usecols=[index[c] for c in fixed],
+                                  dtype=row_type, ndmin=1)
+                for i, c in enumerate(fixed):
+                    parts[c].append(rows['f%i' % i])
+            for c in text:
+                parts[c].append(np.array(
+                    [_split(line, delimiter)[index[c]] for line in block]
+                ).astype(dtypes[c]))
+    return dict((c, np.concatenate(parts[c]) if parts[c] else
+                 np.empty(0, dtype=dtypes.get(c, float)))
+                for c in columns)
+
+
+def _cache_dir(path):
+    return path + '.npycache'
+
+
+def _read_meta(cache):
+    try:
+        with open(os.path.join(cache, 'meta.json')) as source:
+            return json.load(source)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_meta(cache, meta):
+    temp = os.path.join(cache, 'meta.json.tmp')
+    with open(temp, 'w') as output:
+        json.dump(meta, output, indent=2, sort_keys=True)
+    os.rename(temp, os.path.join(cache, 'meta.json'))
+
+
+def _column_file(cache, column):
+    return os.path.join(cache, 'column_%s.npy' % column)
+
+
+@timed('load')
+def load_columns(path, columns, delimiter=',', dtypes=None, comments='#',
+                 header=True, chunk=100000, cache=True):
+    '''Load the selected columns of a delimited text file, using the
+    binary cache when it is up to date.
+
+    :Arguments:
+        path, columns, delimiter, dtypes, comments, header, chunk: see
+            'parse_columns'.
+        cache: whether to read and write the '.npycache' directory next
+               to the source (default: True).
+
+    The cache is valid while the source has the same size and
+    modification time, or, when only the time changed, the same hash.
+    It is also keyed on the absolute path of the source and on the
+    parsing options, so a cache copied or moved with another file is
+    rebuilt, and columns not cached yet are parsed and added to it. If the cache cannot be written, the
+    parsed columns are returned anyway.
+
+    Returns a dictionary with one array per column, keyed as in 'columns'.
+    Cached columns are read-only 'np.memmap' arrays.
+
+    '''
+    columns = list(columns)
+    if not cache:
+        return parse_columns(path, columns, delimiter, dtypes, comments,
+                             header, chunk)
+
+    dtypes = dtypes or {}
+    types = dict((str(c), np.dtype(dtypes.get(c, float)).str)
+                 for c in columns)
+    options = dict(delimiter=delimiter, comments=comments, header=header)
+    source = os.path.realpath(path)
+    stat = os.stat(path)
+    directory = _cache_dir(path)
+    meta = _read_meta(directory)
+    touched = False
+
+    if meta is not None and (meta.get('source') != source or
+                             meta['size'] != stat.st_size or
+                             meta['options'] != options):
+        meta = None
+    if meta is not None and meta['mtime'] != stat.st_mtime:
+        # Touched but maybe not changed: the hash decides.
+        if meta['sha1'] != file_hash(path):
+            meta = None
+        else:
+            meta['mtime'] = stat.st_mtime
+            touched = True
+
+    if meta is None:
+        meta = dict(source=source, size=stat.st_size, mtime=stat.st_mtime,
+                    sha1=file_hash(path), options=options, dtypes={})
+
+    missing = [c for c in columns
+               if meta['dtypes'].get(str(c)) != types[str(c)]]
+    try:
+        if missing:
+            parsed = parse_columns(path, missing, delimiter, dtypes,
+                                   comments, header, chunk)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for c in missing:
+                np.save(_column_file(directory, c), parsed[c])
+                meta['dtypes'][str(c)] = types[str(c)]
+        if missing or touched:
+            _write_meta(directory, meta)
+    except (IOError, OSError):
+        return parse_columns(path, columns, delimiter, dtypes, comments,
+                             header, chunk)
+
+    return dict((c, np.load(_column_file(directory, c), mmap_mode='r'))
+                for c in columns)
+
+
+def clear_cache(path):
+    '''Delete the binary cache of a data file, if there is one.'''
+    directory = _cache_dir(path)
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+'''Log-densities, with their analytic gradients, of the continuous
+models, for the gradient-based sampler in 'hmc'.
+Every parameter is mapped to the whole real line (log for positive
+ones, logit for bounded ones) and the log-density includes the Jacobian
+of that change of variables. The priors are the same as in the PyMC
+models, and so are the names and scales of the returned values.
+
+'''
+from __future__ import division
+
+from math import lgamma, log, pi
+
+import numpy as np
+
+
+def digamma(x):
+    '''Digamma function of a positive scalar, by recurrence up to
+    x >= 6 and the asymptotic series from there.'''
+    result = 0.0
+    while x < 6:
+        result -= 1 / x
+        x += 1
+    inv2 = 1 / x**2
+    return (result + log(x) - 0.5 / x -
+            inv2 * (1 / 12 - inv2 * (1 / 120 - inv2 * (1 / 252 - inv2 *
+                                      (1 / 240 - inv2 / 132)))))
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _log_sigmoid(x):
+    '''log(sigmoid(x)), without overflow. log(1 - sigmoid(x)) is
+    _log_sigmoid(-x).'''
+    return -np.logaddexp(0, -x)
+
+
+class RegressionDensity(object):
+    '''Robust linear regression of 'SimpleLinearRegressionPyMC'.
+
+    :Arguments:
+        zx, zy: normalized predictor and predicted data.
+        b_tau, tau_shape, tau_rate, tdf_gain: the priors of the model.
+
+    The unconstrained parameters are (b0, b1, log(tau), logit(udf)).
+
+    '''
+
+    names = ('b0', 'b1', 'tau', 'tdf')
+    size = 4
+
+    def __init__(self, zx, zy, b_tau=1.0e-10, tau_shape=0.01, tau_rate=0.01,
+                 tdf_gain=1):
+        self.zx = np.asarray(zx, dtype=float)
+        self.zy = np.asarray(zy, dtype=float)
+        self.b_tau = b_tau
+        self.tau_shape = tau_shape
+        self.tau_rate = tau_rate
+        self.tdf_gain = tdf_gain
+
+    def initial(self, rng):
+        '''A random starting point near the bulk of the posterior.'''
+        return np.array([0.0, 0.0, 0.0, 0.0]) + rng.uniform(-0.5, 0.5, 4)
+
+    def logp_grad(self, q, zx=None, zy=None, scale=1.0):
+        '''Log-density and its gradient at the unconstrained point 'q'.
+
+        With 'zx' and 'zy', a minibatch of the normalized data, the
+        likelihood is that of the minibatch times 'scale' (the data size
+        over the minibatch size), an unbiased estimate of the full one
+        for stochastic gradient methods.
+
+        '''
+        if zx is None:
+            x, y = self.zx, self.zy
+        else:
+            x, y = np.asarray(zx, dtype=float), np.asarray(zy, dtype=float)
+        b0, b1, log_tau, logit_udf = q
+        tau = np.exp(log_tau)
+        udf = _sigmoid(logit_udf)
+        nu = 1 - self.tdf_gain * _log_sigmoid(-logit_udf)
+
+        n = len(y)
+        r = y - b0 - b1 * x
+        w = 1 + tau * r**2 / nu
+        log_w = np.log(w)
+        like = (n * (lgamma((nu + 1) / 2) - lgamma(nu / 2) +
+                     0.5 * np.log(tau / (nu * pi))) -
+                (nu + 1) / 2 * np.sum(log_w))
+        g = (nu + 1) * tau * r / (nu * w)
+        d_nu = (n * (0.5 * digamma((nu + 1) / 2) - 0.5 * digamma(nu / 2) -
+                     0.5 / nu) -
+                0.5 * np.sum(log_w) +
+                (nu + 1) / 2 * np.sum(tau * r**2 / nu**2 / w))
+        d_tau = n / (2 * tau) - (nu + 1) / 2 * np.sum(r**2 / nu / w)
+
+        grad = scale * np.array([np.sum(g), np.sum(g * x), tau * d_tau,
+                                 d_nu * self.tdf_gain * udf])
+        logp = scale * like
+
+        # Priors, with the Jacobians of the log and logit transforms.
+        logp += (-0.5 * self.b_tau * (b0**2 + b1**2) +
+                 self.tau_shape * log_tau - self.tau_rate * tau +
+                 _log_sigmoid(logit_udf) + _log_sigmoid(-logit_udf))
+        grad += np.array([-self.b_tau * b0, -self.b_tau * b1,
+                          self.tau_shape - self.tau_rate * tau, 1 - 2 * udf])
+        return logp, grad
+
+    def constrain(self, q):
+        '''Values of the named variables at the unconstrained point 'q'.'''
+        b0, b1, log_tau, logit_udf = q
+        return dict(b0=b0, b1=b1, tau=np.exp(log_tau),
+                    tdf=1 - self.tdf_gain * _log_sigmoid(-logit_udf))
+
+
+class AnovaDensity(object):
+    '''Oneway ANOVA of 'ANOVAOnewayPyMC', in its non-centered form:
+    a = a_sd * eta, with standard normal 'eta', which removes the funnel
+    between 'a_sd' and 'a'.
+
+    :Arguments:
+        idx: zero-based group of each observation.
+        zy: normalized predicted data.
+        levels: number of groups.
+        a_sd_shape, a_sd_rate, a0_tau, sigma_upper: the priors of the model.
+
+    The likelihood only uses the count, sum and sum of squares of each
+    group, so its cost does not grow with the number of observations.
+    The unconstrained parameters are (a0, log(a_sd), logit(sigma /
+    sigma_upper), eta_1, ..., eta_levels).
+
+    '''
+
+    names = ('a0', 'a', 'sigma', 'a_sd')
+
+    def __init__(self, idx, zy, levels, a_sd_shape=1.01005, a_sd_rate=0.1005,
+                 a0_tau=0.001, sigma_upper=10):
+        idx = np.asarray(idx, dtype=int)
+        zy = np.asarray(zy, dtype=float)
+        self.levels = levels
+        self.size = 3 + levels
+        self.n = np.bincount(idx, minlength=levels).astype(float)
+        self.sum_y = np.bincount(idx, zy, minlength=levels)
+        self.sum_y2 = np.bincount(idx, zy**2, minlength=levels)
+        self.a_sd_shape = a_sd_shape
+        self.a_sd_rate = a_sd_rate
+        self.a0_tau = a0_tau
+        self.sigma_upper = sigma_upper
+
+    def initial(self, rng):
+        '''A random starting point near the bulk of the posterior.'''
+        q = rng.uniform(-0.5, 0.5, self.size)
+        q[2] += np.log(1 / (self.sigma_upper - 1))  # sigma near 1
+        return q
+
+    def logp_grad(self, q):
+        '''Log-density and its gradient at the unconstrained point 'q'.'''
+        a0, log_a_sd, logit_s, eta = q[0], q[1], q[2], q[3:]
+        a_sd = np.exp(log_a_sd)
+        u = _sigmoid(logit_s)
+        sigma = self.sigma_upper * u
+        m = a0 + a_sd * eta
+
+        # Sum of squared residuals of each group, from its statistics.
+        sq = np.sum(self.sum_y2 - 2 * m * self.sum_y + self.n * m**2)
+        n_total = np.sum(self.n)
+        d_m = (self.sum_y - self.n * m) / sigma**2
+        d_sigma = -n_total / sigma + sq / sigma**3
+
+        logp = (-n_total * np.log(sigma) - 0.5 * sq / sigma**2 -
+                0.5 * self.a0_tau * a0**2 - 0.5 * np.sum(eta**2) +
+                self.a_sd_shape * log_a_sd - self.a_sd_rate * a_sd +
+                _log_sigmoid(logit_s) + _log_sigmoid(-logit_s))
+        grad = np.empty(self.size)
+        grad[0] = np.sum(d_m) - self.a0_tau * a0
+        grad[1] = (a_sd * np.sum(d_m * eta) + self.a_sd_shape -
+                   self.a_sd_rate * a_sd)
+        grad[2] = d_sigma * sigma * (1 - u) + 1 - 2 * u
+        grad[3:] = a_sd * d_m - eta
+        return logp, grad
+
+    def constrain(self, q):
+        '''Values of the named variables at the unconstrained point 'q'.'''
+        a_sd = np.exp(q[1])
+        return dict(a0=q[0], a=a_sd * q[3:],
+                    sigma=self.sigma_upper * _sigmoid(q[2]), a_sd=a_sd)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''Convergence diagnostics for MCMC traces: the potential scale reduction
+factor (split R-hat) and the effective sample size (ESS), as described
+by Gelman et al. in "Bayesian Data Analysis", 3rd edition.
+
+Every function takes traces of shape (chain, draw, ...) and returns one
+value per parameter.
+
+'''
+from __future__ import division
+
+import numpy as np
+
+
+def _split_chains(trace):
+    '''Split every chain in two halves, dropping the middle draw if odd.'''
+    trace = np.asarray(trace, dtype=float)
+    half = trace.shape[1] // 2
+    return np.concatenate((trace[:, :half], trace[:, -half:]), axis=0)
+
+
+def _autocovariance(trace):
+    '''Autocovariance of each chain along the draws axis, via FFT.'''
+    n_draws = trace.shape[1]
+    centered = trace - trace.mean(axis=1, keepdims=True)
+    size = 2 ** int(np.ceil(np.log2(2 * n_draws)))
+    freq = np.fft.rfft(centered, n=size, axis=1)
+    acov = np.fft.irfft(freq * np.conjugate(freq), n=size, axis=1)
+    return acov[:, :n_draws] / n_draws
+
+
+def rhat(trace):
+    '''Split R-hat of each parameter.
+
+    :Arguments:
+        trace: array of shape (chain, draw, ...).
+
+    Values close to 1.0 (say, below 1.01) suggest that the chains have
+    mixed.
+
+    '''
+    split = _split_chains(trace)
+    n_draws = split.shape[1]
+    within = split.var(axis=1, ddof=1).mean(axis=0)
+    between = n_draws * split.mean(axis=1).var(axis=0, ddof=1)
+    var_plus = (n_draws - 1) / n_draws * within + between / n_draws
+    return np.sqrt(var_plus / within)
+
+
+def ess(trace):
+    '''Effective sample size of each parameter, pooling all chains.
+
+    :Arguments:
+        trace: array of shape (chain, draw, ...).
+
+    Uses Geyer's initial monotone sequence to truncate the sum of the
+    autocorrelations.
+
+    '''
+    split = _split_chains(trace)
+    n_chains, n_draws = split.shape[:2]
+
+    acov = _autocovariance(split)
+    chain_var = acov[:, 0] * n_draws / (n_draws - 1)
+    mean_var = chain_var.mean(axis=0)
+    var_plus = mean_var * (n_draws - 1) / n_draws
+    if n_chains > 1:
+        var_plus = var_plus + split.mean(axis=1).var(axis=0, ddof=1)
+    rho = 1 - (mean_var - acov.mean(axis=0)) / var_plus
+    rho[0] = 1.0
+
+    # Sum the autocorrelations in pairs, up to the first negative pair,
+    # forcing the pair sums to decrease monotonically.
+    n_pairs = n_draws // 2
+    pairs = rho[:2 * n_pairs:2] + rho[1:2 * n_pairs:2]
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, 0), axis=0)
+    tau = -1 + 2 * pairs.sum(axis=0)
+    tau = np.maximum(tau, 1 / np.log10(n_chains * n_draws))
+    return n_chains * n_draws / tau
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+'''No-U-Turn sampler (NUTS) for the densities in 'densities'.
+A NumPy implementation of the multinomial NUTS of Stan: the trajectory
+doubles until it turns back on itself, and the draw is taken from it
+with probability proportional to its density. During the burn-in, the
+step size is tuned by dual averaging and a diagonal mass matrix is
+estimated from the draws, in windows of growing size.
+The traces have the same names and layout as the PyMC ones.
+
+References:
+    Hoffman, M. D. and Gelman, A. (2014). The No-U-Turn Sampler. JMLR 15.
+    Betancourt, M. (2017). A Conceptual Introduction to Hamiltonian
+    Monte Carlo. arXiv:1701.02434.
+
+'''
+from __future__ import division
+
+import time
+
+import numpy as np
+
+import profiling
+from sampling import chain_seeds, save_traces
+
+
+class _Tree(object):
+    '''Subtree of a NUTS trajectory.'''
+
+    def __init__(self, q, p, grad, logp, log_weight, accept, diverging):
+        self.q_minus = self.q_plus = self.q_draw = q
+        self.p_minus = self.p_plus = self.rho = p
+        self.grad_minus = self.grad_plus = self.grad_draw = grad
+        self.logp_draw = logp
+        self.log_weight = log_weight
+        self.accept_sum = accept
+        self.steps = 1
+        self.turning = False
+        self.diverging = diverging
+
+
+class NUTS(object):
+    '''No-U-Turn sampler of one chain.
+
+    :Arguments:
+        density: object with 'logp_grad(q)', returning the log-density
+                 and its gradient at the unconstrained point 'q',
+                 'initial(rng)' and 'size'.
+        target_accept: target mean acceptance statistic of the step size
+                       adaptation (default: 0.8).
+        max_depth: largest tree depth, at most 2**max_depth leapfrog steps
+                   per draw (default: 10).
+        rng: 'np.random.RandomState' of the chain.
+
+    '''
+
+    def __init__(self, density, target_accept=0.8, max_depth=10, rng=None):
+        self.density = density
+        self.target_accept = target_accept
+        self.max_depth = max_depth
+        self.rng = rng or np.random.RandomState()
+        self.inv_mass = np.ones(density.size)
+        self.step_size = 1.0
+        self.divergences = 0
+
+    def _leapfrog(self, q, p, grad, step):
+        p = p + 0.5 * step * grad
+        q = q + step * self.inv_mass * p
+        logp, grad = self.density.logp_grad(q)
+        p = p + 0.5 * step * grad
+        return q, p, grad, logp
+
+    def _energy(self, logp, p):
+        return logp - 0.5 * np.dot(p, self.inv_mass * p)
+
+    def _uturn(self, rho, p_minus, p_plus):
+        return (np.dot(self.inv_mass * p_minus, rho) <= 0 or
+                np.dot(self.inv_mass * p_plus, rho) <= 0)
+
+    def _build(self, q, p, grad, direction, depth, h0):
+        '''Build a subtree of 2**depth steps from (q, p).'''
+        if depth == 0:
+            q, p, grad, logp = self._leapfrog(q, p, grad,
+                                              direction * self.step_size)
+            h = self._energy(logp, p)
+            if not np.isfinite(h):
+                h = -np.inf
+            diverging = h - h0 < -1000
+            return _Tree(q, p, grad, logp, h - h0,
+                         min(1.0, np.exp(min(h - h0, 0.0))), diverging)
+
+        tree = self._build(q, p, grad, direction, depth - 1, h0)
+        if tree.turning or tree.diverging:
+            return tree
+        if direction > 0:
+            other = self._build(tree.q_plus, tree.p_plus, tree.grad_plus,
+                                direction, depth - 1, h0)
+        else:
+            other = self._build(tree.q_minus, tree.p_minus, tree.grad_minus,
+                                direction, depth - 1, h0)
+        self._merge(tree, other, direction, biased=False)
+        return tree
+
+    def _merge(self, tree, other, direction, biased):
+        '''Join 'other' to 'tree' in place, picking the draw of the joint
+        tree: in proportion to the weights inside a subtree, or biased to
+        the new subtree for the whole trajectory.'''
+        log_weight = np.logaddexp(tree.log_weight, other.log_weight)
+        if biased:
+            accept = np.exp(min(other.log_weight - tree.log_weight, 0.0))
+        else:
+            accept = np.exp(other.log_weight - log_weight)
+        if not other.diverging and self.rng.uniform() < accept:
+            tree.q_draw = other.q_draw
+            tree.grad_draw = other.grad_draw
+            tree.logp_draw = other.logp_draw
+        if direction > 0:
+            tree.q_plus, tree.p_plus = other.q_plus, other.p_plus
+            tree.grad_plus = other.grad_plus
+        else:
+            tree.q_minus, tree.p_minus = other.q_minus, other.p_minus
+            tree.grad_minus = other.grad_minus
+        tree.log_weight = log_weight
+        tree.rho = tree.rho + other.rho
+        tree.accept_sum += other.accept_sum
+        tree.steps += other.steps
+        tree.diverging = other.diverging
+        tree.turning = other.turning or self._uturn(tree.rho, tree.p_minus,
+                                                    tree.p_plus)
+
+    def step(self, q, logp, grad):
+        '''One NUTS transition from 'q'.
+
+        Returns the new (q, logp, grad) and the mean acceptance statistic
+        of the trajectory.
+
+        '''
+        p = self.rng.standard_normal(len(q)) / np.sqrt(self.inv_mass)
+        h0 = self._energy(logp, p)
+        tree = _Tree(q, p, grad, logp, 0.0, 0.0, False)
+        accept_sum, steps = 0.0, 0
+        for depth in range(self.max_depth):
+            direction = 1 if self.rng.uniform() < 0.5 else -1
+            if direction > 0:
+                other = self._build(tree.q_plus, tree.p_plus, tree.grad_plus,
+                                    direction, depth, h0)
+            else:
+                other = self._build(tree.q_minus, tree.p_minus,
+                                    tree.grad_minus, direction, depth, h0)
+            accept_sum += other.accept_sum
+            steps += other.steps
+            if other.diverging:
+                self.divergences += 1
+            if other.turning or other.diverging:
+                break
+            self._merge(tree, other, direction, biased=True)
+            if tree.turning:
+                break
+        return (tree.q_draw, tree.logp_draw, tree.grad_draw,
+                accept_sum / steps)
+
+    def _initial_step_size(self, q, logp, grad):
+        '''Double or halve the step size until one leapfrog step crosses
+        an acceptance probability of one half.'''
+        step = 1.0
+        p = self.rng.standard_normal(len(q)) / np.sqrt(self.inv_mass)
+        h0 = self._energy(logp, p)
+
+        def log_accept(step):
+            _, p1, _, logp1 = self._leapfrog(q, p, grad, step)
+            h = self._energy(logp1, p1)
+            return h - h0 if np.isfinite(h) else -np.inf
+
+        direction = 1 if log_accept(step) > np.log(0.5) else -1
+        for _ in range(50):
+            if (log_accept(step) > np.log(0.5)) != (direction > 0):
+                break
+            step *= 2.0**direction
+        return step
+
+    def sample(self, iter, burn=0, thin=1, q=None):
+        '''Sample the chain.
+
+        :Arguments:
+            iter, burn, thin: same as in 'pymc.MCMC.sample'. The step size
+                              and mass matrix are adapted during 'burn'.
+            q: starting point (default: 'density.initial').
+
+        Returns an array of shape (draws, size) of unconstrained draws.
+
+        '''
+        # Divergent trajectories overflow; their energy is not finite
+        # and they are rejected.
+        with np.errstate(all='ignore'):
+            return self._sample(iter, burn, thin, q)
+
+    def _sample(self, iter, burn, thin, q):
+        if q is None:
+            q = self.density.initial(self.rng)
+        logp, grad = self.density.logp_grad(q)
+        windows = _adaptation_windows(burn)
+
+        self.step_size = self._initial_step_size(q, logp, grad)
+        adapt = _DualAveraging(self.step_size, self.target_accept)
+        window_draws = []
+
+        draws = []
+        for i in range(iter):
+            q, logp, grad, accept = self.step(q, logp, grad)
+            if i < burn:
+                self.step_size = adapt.update(accept)
+                if windows and windows[0][0] <= i < windows[0][1]:
+                    window_draws.append(q)
+                if windows and i == windows[0][1] - 1:
+                    # End of a window: new mass matrix, restart the step.
+                    self.inv_mass = _regularized_var(np.array(window_draws))
+                    window_draws = []
+                    windows.pop(0)
+                    self.step_size = self._initial_step_size(q, logp, grad)
+                    adapt = _DualAveraging(self.step_size,
+                                           self.target_accept)
+                if i == burn - 1:
+                    self.step_size = adapt.final()
+            elif (i - burn) % thin == 0:
+                draws.append(q)
+        return np.array(draws).reshape(-1, self.density.size)
+
+
+class _DualAveraging(object):
+    '''Step size adaptation of Hoffman and Gelman (2014).'''
+
+    def __init__(self, step_size, target, gamma=0.05, t0=10, kappa=0.75):
+        self.mu = np.log(10 * step_size)
+        self.target = target
+        self.gamma, self.t0, self.kappa = gamma, t0, kappa
+        self.count = 0
+        self.error_sum = 0.0
+        self.log_step_avg = 0.0
+
+    def update(self, accept):
+        self.count += 1
+        eta = 1 / (self.count + self.t0)
+        self.error_sum = ((1 - eta) * self.error_sum +
+                          eta * (self.target - accept))
+        log_step = (self.mu - np.sqrt(self.count) / self.gamma *
+                    self.error_sum)
+        weight = self.count**-self.kappa
+        self.log_step_avg = (weight * log_step +
+                             (1 - weight) * self.log_step_avg)
+        return np.exp(log_step)
+
+    def final(self):
+        return np.exp(self.log_step_avg)
+
+
+def _adaptation_windows(burn, initial=75, final=50, base=25):
+    '''(start, end) of the mass matrix windows of Stan: after an initial
+    buffer, windows doubling in size, and a final buffer with only the
+    step size adapted. Short burn-ins only adapt the step size.'''
+    if burn < initial + final + base:
+        return []
+    windows = []
+    start, size = initial, base
+    end_slow = burn - final
+    while start < end_slow:
+        end = start + size
+        # The last window takes what is left, if the next would not fit.
+        if end + 2 * size > end_slow:
+            end = end_slow
+        windows.append((start, end))
+        start, size = end, 2 * size
+    return windows
+
+
+def _regularized_var(draws):
+    '''Variance of the window draws, shrunk towards 1e-3, as in Stan.'''
+    n = len(draws)
+    return (n / (n + 5)) * np.var(draws, axis=0) + 1e-3 * (5 / (n + 5))
+
+
+def sample_chain(density, iter, burn=0, thin=1, seed=None,
+                 target_accept=0.8, max_depth=10):
+    '''Sample one NUTS chain and return its named, constrained traces.'''
+    sampler = NUTS(density, target_accept, max_depth,
+                   np.random.RandomState(seed))
+    draws = sampler.sample(iter, burn, thin)
+    values = [density.constrain(q) for q in draws]
+    return dict((name, np.array([v[name] for v in values]))
+                for name in density.names)
+
+
+def fit(density, iter=2000, burn=1000, thin=1, chains=1, seed=None,
+        max_workers=None, dbdir=None, target_accept=0.8, max_depth=10):
+    '''Sample independent NUTS chains of a density.
+
+    :Arguments:
+        density: one of the 'densities' objects.
+        iter, burn, thin: same as in 'pymc.MCMC.sample', per chain.
+        chains: number of chains (default: 1), sampled in a process pool
+                when more than one.
+        seed: master seed from which the chain seeds are drawn.
+        max_workers: size of the process pool (default: 'chains').
+        dbdir: directory where the traces are saved as '.npy' files
+               (default: None, kept in memory).
+        target_accept, max_depth: see 'NUTS'.
+
+    Returns a dictionary with an array of shape (chain, draw, ...) for
+    each variable of 'density.names'.
+
+    '''
+    seeds = chain_seeds(chains, seed)
+    args = (iter, burn, thin)
+    label = type(density).__name__
+    start = time.time()
+    if chains == 1:
+        with profiling.phase('sample', model=label, sampler='nuts'):
+            results = [sample_chain(density, *args, seed=seeds[0],
+                                    target_accept=target_accept,
+                                    max_depth=max_depth)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with profiling.phase('chains', model=label, sampler='nuts'), \
+                ProcessPoolExecutor(max_workers=max_workers or chains) as pool:
+            futures = [pool.submit(sample_chain, density, *args, seed=s,
+                                   target_accept=target_accept,
+                                   max_depth=max_depth)
+                       for s in seeds]
+            results = [future.result() for future in futures]
+    profiling.record_throughput(chains * iter, time.time() - start,
+                                model=label, sampler='nuts')
+    traces = dict((name, np.array([r[name] for r in results]))
+                  for name in density.names)
+    if dbdir is not None:
+        return save_traces(traces, dbdir)
+    return traces
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''Least-recently-used cache of built PyMC models.
+Building a model creates one PyMC node per variable, which is slow for
+large models. Models with the same data shape and priors share their
+graph: a cached model only has its observed data swapped. A 'LazyModel'
+delays the build until a sampler needs the graph.
+
+'''
+from __future__ import division
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ModelCache(object):
+    '''Keep the most recently used models, keyed by data shape and priors.
+
+    :Arguments:
+        maxsize: maximum number of models kept (default: 8).
+
+    '''
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+
+    def get(self, key, build, set_data):
+        '''Return the model cached under 'key', building it if needed.
+
+        :Arguments:
+            key: hashable key, usually from 'model_key'.
+            build: function without arguments that builds a new model.
+            set_data: function that swaps the observed data of a cached
+                      model. It is only called on cache hits.
+
+        '''
+        try:
+            model = self._models.pop(key)
+        except KeyError:
+            model = build()
+        else:
+            set_data(model)
+        self._models[key] = model
+        while len(self._models) > self.maxsize:
+            self._models.popitem(last=False)
+        return model
+
+    def clear(self):
+        '''Drop every cached model.'''
+        self._models.clear()
+
+    def __len__(self):
+        return len(self._models)
+
+
+class LazyModel(object):
+    '''Handle of a model, whose PyMC graph is only built (or bound to
+    the data of this handle) when a sampler needs it.
+
+    Cached graphs are shared by every dataset of the same shape, so the
+    handle, not the graph, holds the recipe and the data of one model.
+    Models with an exact posterior are fitted from their 'recipe' alone,
+    so they do not need PyMC. 'graph()' builds (or fetches from the
+    cache) the PyMC model, and its attributes, such as 'nodes', are
+    reachable through the handle.
+
+    :Arguments:
+        recipe: tuple (build_model, args, priors) rebuilding the model.
+        get: function without arguments returning the PyMC model with
+             the data of this handle, such as a call of 'ModelCache.get'.
+        attributes: more attributes of the handle, such as 'scaling'.
+
+    '''
+
+    def __init__(self, recipe, get, **attributes):
+        self.recipe = recipe
+        self._get = get
+        self.__dict__.update(attributes)
+
+    def graph(self):
+        '''Return the PyMC model, with the data of this handle. It goes
+        through the cache every time, so that a graph shared with other
+        data gets this model's back: call it just before sampling.'''
+        model = self._get()
+        model.recipe = self.recipe
+        return model
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.graph(), name)
+
+
+def graph(model):
+    '''PyMC model of 'model', building the graph of a 'LazyModel'.'''
+    if isinstance(model, LazyModel):
+        return model.graph()
+    return model
+
+
+def model_key(shapes, priors):
+    '''Build a cache key from the data shapes and the prior settings.
+
+    :Arguments:
+        shapes: sequence of data arrays or shape tuples.
+        priors: dictionary of prior constants.
+
+    '''
+    shapes = tuple(s if isinstance(s, tuple) else np.shape(s)
+                   for s in shapes)
+    return shapes, tuple(sorted(priors.items()))
+
+
+def find_node(model, name):
+    '''Return the node of 'model' named 'name'.'''
+    for node in model.nodes:
+        if node.__name__ == name:
+            return node
+    raise KeyError(name)
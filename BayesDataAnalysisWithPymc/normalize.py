@@ -1,25 +1,86 @@
 # -*- coding: utf-8 -*-
 '''Function to normalize data and convert parameter back to original scale.
+The 'Standardizer' class computes the data moments once and keeps them,
+so that they can be reused (or saved) for every conversion.
 Python (PyMC) adaptation of the R code from "Doing Bayesian Data Analysis",
 by John K. Krushcke.
 More info: http://doingbayesiandataanalysis.blogspot.com.br/
 
 '''
 from __future__ import division
+
+import hashlib
+import json
+from collections import OrderedDict
+
 import numpy as np
 
+from online import RunningMoments
+
+
+# Standardizers of the data last passed to the 'convert_*' functions, so
+# that converting several parameters of one fit computes the moments once.
+# To reuse the moments explicitly, keep a 'Standardizer' instead.
+
+_STANDARDIZERS = OrderedDict()
+_MAX_STANDARDIZERS = 4
+
+
+def _data_key(values):
+    '''Shape, type and hash of the contents of an array.'''
+    values = np.ascontiguousarray(values)
+    return (values.shape, values.dtype.str,
+            hashlib.sha1(values.tobytes()).hexdigest())
+
+
+def _standardizer(**data):
+    '''Standardizer of 'data', reused while data with the same contents
+    are passed again, so that data modified in place get new moments.'''
+    key = tuple(sorted((name, _data_key(values))
+                       for name, values in data.items()))
+    try:
+        standardizer = _STANDARDIZERS.pop(key)
+    except KeyError:
+        standardizer = Standardizer(**data)
+    _STANDARDIZERS[key] = standardizer
+    while len(_STANDARDIZERS) > _MAX_STANDARDIZERS:
+        _STANDARDIZERS.popitem(last=False)
+    return standardizer
+
 
 def normalize(data):
     '''Normalizes a set of data.
 
     '''
 
-    mean = np.mean(data)
-    sd = np.sqrt(np.var(data))
-    z_data = (data - mean) / sd
+    z_data = Standardizer(data=data).transform('data', data)
     return z_data
 
 
+def convert_chunked(convert, samples, out=None, chunk=100000):
+    '''Apply a conversion to the samples, a chunk of draws at a time.
+
+    :Arguments:
+        convert: function of one chunk of each sample, such as
+                 'lambda z1: convert_slope(x, y, z1)'.
+        samples: sequence of sample arrays with the same number of draws,
+                 usually memory-mapped traces.
+        out: array receiving the result, such as an 'np.memmap'
+             (default: None, a new array in memory).
+        chunk: number of draws read at a time (default: 100000).
+
+    Only one chunk of each sample is loaded in memory at once.
+
+    '''
+    n_draws = len(samples[0])
+    for start in range(0, n_draws, chunk):
+        result = convert(*[s[start:start + chunk] for s in samples])
+        if out is None:
+            out = np.empty((n_draws,) + result.shape[1:], dtype=result.dtype)
+        out[start:start + chunk] = result
+    return out
+
+
 def convert_slope(x_data, y_data, zb1_sample):
     '''Converts normalized b1 sample back to original scale.
 
@@ -30,9 +91,7 @@ def convert_slope(x_data, y_data, zb1_sample):
 
     '''
 
-    y_sd = np.sqrt(np.var(y_data))
-    x_sd = np.sqrt(np.var(x_data))
-    b1 = zb1_sample * (y_sd / x_sd)
+    b1 = _standardizer(x=x_data, y=y_data).slope(zb1_sample)
     return b1
 
 
@@ -47,13 +106,7 @@ def convert_intercept(x_data, y_data, zb0_sample, zb1_sample):
 
     '''
 
-    y_sd = np.sqrt(np.var(y_data))
-    y_mean = np.mean(y_data)
-
-    x_sd = np.sqrt(np.var(x_data))
-    x_mean = np.mean(x_data)
-
-    b0 = zb0_sample * y_sd + y_mean - zb1_sample * (y_sd * x_mean) / x_sd
+    b0 = _standardizer(x=x_data, y=y_data).intercept(zb0_sample, zb1_sample)
     return b0
 
 
@@ -65,9 +118,7 @@ def convert_tau_sigma(y_data, ztau_sample):
     ztau_sample: normalized tau parameter samples.
 
     '''
-    z_sigma = 1 / np.sqrt(ztau_sample)
-    y_sd = np.sqrt(np.var(y_data))
-    sigma = z_sigma * y_sd
+    sigma = _standardizer(y=y_data).tau_sigma(ztau_sample)
     return sigma
 
 def convert_sigma(y_data, zsigma_sample):
@@ -78,11 +129,52 @@ def convert_sigma(y_data, zsigma_sample):
     ztau_sample: normalized sigma parameter samples.
 
     '''
-    y_sd = np.sqrt(np.var(y_data))
-    sigma = zsigma_sample * y_sd
+    sigma = _standardizer(y=y_data).sigma(zsigma_sample)
     return sigma
 
 
+def convert_anova(a0_sample, a_sample, y_sd, y_mean, b0_out=None,
+                  b_out=None, chunk=None):
+    '''Convert normalized ANOVA baseline and deflections back to original
+    scale, in a single pass over the samples.
+
+    :Arguments:
+    a0_sample: normalized baseline samples, shape (draws,).
+    a_sample: normalized deflection samples, shape (draws, levels).
+    y_sd: standard deviation of the original predicted data.
+    y_mean: mean of the original predicted data.
+    b0_out: optional array of shape (draws,) receiving the baseline.
+    b_out: optional array of shape (draws, levels) receiving the
+           deflections. It may be 'a_sample' itself, to convert in place.
+    chunk: number of draws converted at a time (default: None, all of
+           them). Bounds the temporaries for memory-mapped samples.
+
+    Returns the tuple (b0_sample, b_sample).
+
+    '''
+    n_draws = len(a0_sample)
+    dtype = np.result_type(a_sample, float)
+    if b0_out is None:
+        b0_out = np.empty(n_draws, dtype=dtype)
+    if b_out is None:
+        b_out = np.empty(np.shape(a_sample), dtype=dtype)
+
+    step = chunk or max(n_draws, 1)
+    for start in range(0, n_draws, step):
+        rows = slice(start, start + step)
+        m_sample = b_out[rows]
+        b0_sample = b0_out[rows]
+        # Cell means, then their mean is the baseline and the
+        # deflections are the distances from it.
+        np.add(a_sample[rows], a0_sample[rows, np.newaxis], out=m_sample)
+        np.mean(m_sample, axis=1, out=b0_sample)
+        m_sample -= b0_sample[:, np.newaxis]
+        m_sample *= y_sd
+        b0_sample *= y_sd
+        b0_sample += y_mean
+    return b0_out, b_out
+
+
 def convert_baseline(a0_sample, a_sample, x_levels, y_data):
     '''Convert normalized ANOVA baseline back to original scale.
 
@@ -93,10 +185,7 @@ def convert_baseline(a0_sample, a_sample, x_levels, y_data):
     y_data: original predicted data list.
 
     '''
-    m_sample = a0_sample.repeat(x_levels).reshape(len(a0_sample), x_levels) \
-    + a_sample
-    b0_sample = m_sample.mean(axis=1)
-    b0_sample = b0_sample * np.sqrt(np.var(y_data) + np.mean(y_data))
+    b0_sample, _ = _standardizer(y=y_data).anova(a0_sample, a_sample)
     return b0_sample
 
 
@@ -110,10 +199,127 @@ def convert_deflection(a0_sample, a_sample, x_levels, y_data):
     y_data: original predicted data list.
 
     '''
-    m_sample = a0_sample.repeat(x_levels).reshape(len(a0_sample), x_levels) \
-    + a_sample
-    b0_sample = m_sample.mean(axis=1)
-    b_sample = (m_sample -
-                b0_sample.repeat(x_levels).reshape(len(b0_sample), x_levels))
-    b_sample = b_sample * np.sqrt(np.var(y_data))
+    _, b_sample = _standardizer(y=y_data).anova(a0_sample, a_sample)
     return b_sample
+
+
+class Standardizer(object):
+    '''Mean and SD of named data variables, with the conversions between
+    their original and normalized scales.
+
+    :Arguments:
+    data: keyword arguments with the data of each variable, such as
+          'Standardizer(x=x_data, y=y_data)'. More data, or data too big
+          for memory, can be added chunk by chunk with 'partial_fit'.
+
+    The moments are computed once, in a single pass over the data. The
+    parameter conversions default to the variable names 'x' (predictor)
+    and 'y' (predicted), and the 'z_*' methods map parameters the other
+    way, from the original scale to the normalized one. Use 'save' and
+    'load' to reuse the scaling of a fitted model without the raw data.
+
+    '''
+
+    def __init__(self, **data):
+        self.moments = {}
+        for name, values in data.items():
+            self.partial_fit(name, values)
+
+    def partial_fit(self, name, chunk):
+        '''Add a chunk of the data of variable 'name'.'''
+        self.moments.setdefault(name, RunningMoments()).update(
+            np.ravel(chunk))
+        return self
+
+    def mean(self, name):
+        return float(self.moments[name].mean)
+
+    def sd(self, name):
+        return float(self.moments[name].sd)
+
+    def transform(self, name, data):
+        '''Normalize data of variable 'name'.'''
+        return (np.asarray(data) - self.mean(name)) / self.sd(name)
+
+    def inverse_transform(self, name, z_data):
+        '''Convert normalized data of variable 'name' back to its scale.'''
+        return np.asarray(z_data) * self.sd(name) + self.mean(name)
+
+    def slope(self, zb1_sample, x='x', y='y'):
+        '''Convert normalized slope samples back to original scale.'''
+        return zb1_sample * (self.sd(y) / self.sd(x))
+
+    def intercept(self, zb0_sample, zb1_sample, x='x', y='y'):
+        '''Convert normalized intercept samples back to original scale.'''
+        y_sd = self.sd(y)
+        return (zb0_sample * y_sd + self.mean(y) -
+                zb1_sample * (y_sd * self.mean(x)) / self.sd(x))
+
+    def tau_sigma(self, ztau_sample, y='y'):
+        '''Convert normalized precision samples to original scale SD.'''
+        return self.sd(y) / np.sqrt(ztau_sample)
+
+    def sigma(self, zsigma_sample, y='y'):
+        '''Convert normalized SD samples back to original scale.'''
+        return zsigma_sample * self.sd(y)
+
+    def anova(self, a0_sample, a_sample, y='y', **kwargs):
+        '''Convert normalized ANOVA baseline and deflections back to
+        original scale. Keyword arguments go to 'convert_anova'.'''
+        return convert_anova(a0_sample, a_sample, self.sd(y), self.mean(y),
+                             **kwargs)
+
+    def z_slope(self, b1, x='x', y='y'):
+        '''Convert slopes on the original scale to the normalized one.'''
+        return np.asarray(b1) * (self.sd(x) / self.sd(y))
+
+    def z_intercept(self, b0, b1, x='x', y='y'):
+        '''Convert intercepts (with their slopes) on the original scale to
+        the normalized one.'''
+        return ((np.asarray(b0) - self.mean(y) +
+                 np.asarray(b1) * self.mean(x)) / self.sd(y))
+
+    def z_tau(self, sigma, y='y'):
+        '''Convert SDs on the original scale to normalized precisions.'''
+        return (self.sd(y) / np.asarray(sigma))**2
+
+    def z_sigma(self, sigma, y='y'):
+        '''Convert SDs on the original scale to the normalized one.'''
+        return np.asarray(sigma) / self.sd(y)
+
+    def z_anova(self, b0, b, y='y'):
+        '''Convert an ANOVA baseline and deflections on the original scale
+        to the normalized one. The normalized deflections sum to zero, as
+        those returned by 'anova', which maps them back.'''
+        b = np.asarray(b)
+        return ((np.asarray(b0) - self.mean(y)) / self.sd(y),
+                b / self.sd(y))
+
+    def to_dict(self):
+        '''Moments of every variable, as a JSON-serializable dictionary.'''
+        return dict((name, dict(count=int(m.count), mean=float(m.mean),
+                                var=float(m.var)))
+                    for name, m in self.moments.items())
+
+    @classmethod
+    def from_dict(cls, moments):
+        '''Rebuild a Standardizer from the result of 'to_dict'.'''
+        standardizer = cls()
+        for name, values in moments.items():
+            running = RunningMoments()
+            running.count = values['count']
+            running.mean = values['mean']
+            running._m2 = values['var'] * values['count']
+            standardizer.moments[name] = running
+        return standardizer
+
+    def save(self, path):
+        '''Write the moments to a JSON file.'''
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        '''Read a Standardizer saved with 'save'.'''
+        with open(path) as source:
+            return cls.from_dict(json.load(source))
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+'''Streaming posterior summaries, updated as the draws arrive.
+Mean and variance use Welford's method (in the batched form of Chan et
+al.), quantiles and the HDI come from a merging t-digest sketch, and the
+mass on each side of a comparison value is counted exactly. Memory does
+not grow with the number of draws.
+
+'''
+from __future__ import division
+
+import numpy as np
+
+
+class RunningMoments(object):
+    '''Running mean and variance of arrays of draws.'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, draws):
+        '''Add a batch of draws, an array of shape (draws, ...).'''
+        draws = np.asarray(draws, dtype=float)
+        n_new = len(draws)
+        if n_new == 0:
+            return
+        new_mean = draws.mean(axis=0)
+        new_m2 = ((draws - new_mean)**2).sum(axis=0)
+        if self.count == 0:
+            self.count, self.mean, self._m2 = n_new, new_mean, new_m2
+            return
+        total = self.count + n_new
+        delta = new_mean - self.mean
+        self.mean = self.mean + delta * n_new / total
+        self._m2 = self._m2 + new_m2 + delta**2 * self.count * n_new / total
+        self.count = total
+
+    @property
+    def var(self):
+        '''Population variance, as 'np.var'.'''
+        return self._m2 / self.count
+
+    @property
+    def sd(self):
+        return np.sqrt(self.var)
+
+
+class QuantileSketch(object):
+    '''Merging t-digest of a scalar parameter.
+
+    :Arguments:
+        compression: bound on the number of centroids (default: 200).
+                     Larger values give more accurate tails.
+        buffer_size: draws buffered between merges (default: 4096).
+
+    '''
+
+    def __init__(self, compression=200, buffer_size=4096):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self._means = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer = []
+        self._buffered = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, draws):
+        '''Add a batch of draws of the parameter.'''
+        draws = np.ravel(np.asarray(draws, dtype=float))
+        if len(draws) == 0:
+            return
+        self.min = min(self.min, draws.min())
+        self.max = max(self.max, draws.max())
+        self._buffer.append(draws)
+        self._buffered += len(draws)
+        if self._buffered >= self.buffer_size:
+            self._merge()
+
+    def _merge(self):
+        if not self._buffered:
+            return
+        values = np.concatenate([self._means] + self._buffer)
+        weights = np.concatenate((self._weights,
+                                  np.ones(self._buffered)))
+        self._buffer = []
+        self._buffered = 0
+
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+        weights = weights[order]
+        cum_weight = np.cumsum(weights)
+        q_mid = (cum_weight - weights / 2) / cum_weight[-1]
+
+        # Points in the same unit interval of the k1 scale function share
+        # a centroid, so centroids are small near the tails.
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_mid - 1)
+        cluster = np.floor(k - k.min()).astype(int)
+        sums = np.bincount(cluster, weights * values)
+        counts = np.bincount(cluster, weights)
+        used = counts > 0
+        self._means = sums[used] / counts[used]
+        self._weights = counts[used]
+
+    @property
+    def count(self):
+        return self._weights.sum() + self._buffered
+
+    def quantile(self, q):
+        '''Approximate quantiles at the probabilities 'q'.'''
+        self._merge()
+        cum_weight = np.cumsum(self._weights)
+        position = (cum_weight - self._weights / 2) / cum_weight[-1]
+        position = np.concatenate(([0.0], position, [1.0]))
+        means = np.concatenate(([self.min], self._means, [self.max]))
+        return np.interp(q, position, means)
+
+    def cdf(self, x):
+        '''Approximate fraction of the draws below the values 'x'.'''
+        self._merge()
+        cum_weight = np.cumsum(self._weights)
+        position = (cum_weight - self._weights / 2) / cum_weight[-1]
+        position = np.concatenate(([0.0], position, [1.0]))
+        means = np.concatenate(([self.min], self._means, [self.max]))
+        return np.interp(x, means, position)
+
+    def hdi(self, cred=0.95, grid=1000):
+        '''Approximate shortest interval holding 'cred' of the mass.
+
+        The interval is searched among the quantiles at 'grid' + 1 evenly
+        spaced probabilities.
+
+        '''
+        quantiles = self.quantile(np.linspace(0.0, 1.0, grid + 1))
+        span = int(round(cred * grid))
+        width = quantiles[span:] - quantiles[:grid + 1 - span]
+        start = width.argmin()
+        return quantiles[start], quantiles[start + span]
+
+
+class OnlineSummary(object):
+    '''Posterior summary of a parameter, updated batch by batch.
+
+    :Arguments:
+        comp: value (or sequence of values) for comparison. The number of
+              draws on each side is counted exactly (default: None).
+        compression: compression of the quantile sketches (default: 200).
+
+    A vector parameter gets one quantile sketch per element.
+
+    '''
+
+    def __init__(self, comp=None, compression=200):
+        self.comp = None if comp is None else np.atleast_1d(comp)
+        self.compression = compression
+        self.moments = RunningMoments()
+        self.sketches = None
+        self._less = 0
+        self._more = 0
+
+    def update(self, draws):
+        '''Add a batch of draws, an array of shape (draws, ...).'''
+        draws = np.asarray(draws, dtype=float)
+        if self.sketches is None:
+            self.shape = draws.shape[1:]
+            self.sketches = [QuantileSketch(self.compression)
+                             for _ in range(int(np.prod(self.shape)))]
+        self.moments.update(draws)
+        columns = draws.reshape(len(draws), -1)
+        for i, sketch in enumerate(self.sketches):
+            sketch.update(columns[:, i])
+        if self.comp is not None:
+            # One row per comparison value.
+            comp = self.comp.reshape((-1,) + (1,) * draws.ndim)
+            self._less = self._less + (draws < comp).sum(axis=1)
+            self._more = self._more + (draws > comp).sum(axis=1)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    @property
+    def mean(self):
+        return self.moments.mean
+
+    @property
+    def sd(self):
+        return self.moments.sd
+
+    def _per_element(self, func):
+        values = np.array([func(sketch) for sketch in self.sketches])
+        return values.reshape(self.shape + values.shape[1:])
+
+    def quantile(self, q):
+        '''Approximate quantiles, with shape param_shape + shape of 'q'.'''
+        return self._per_element(lambda sketch: sketch.quantile(q))
+
+    def hdi(self, cred=0.95):
+        '''Approximate HDI limits, with shape param_shape + (2,).'''
+        return self._per_element(lambda sketch: sketch.hdi(cred))
+
+    def tail(self):
+        '''Fraction of the draws below and above each comparison value.
+
+        Returns two arrays of shape (len(comp),) + param_shape.
+
+        '''
+        return self._less / self.count, self._more / self.count
+
+    def summary(self, cred=0.95):
+        '''Dictionary with the current count, mean, SD, HDI and tails.'''
+        result = dict(count=self.count, mean=self.mean, sd=self.sd,
+                      hdi=self.hdi(cred))
+        if self.comp is not None:
+            result['less'], result['more'] = self.tail()
+        return result
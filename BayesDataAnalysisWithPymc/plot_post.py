@@ -14,12 +14,59 @@ Probabilistic-Programming-and-Bayesian-Methods-for-Hackers
 
 from __future__ import division
 
+import numpy as np
+
+from profiling import timed
 from short_hdi import short_hdi
-from matplotlib import pyplot as plot
 
 
-def plot_post(sample, title='Posterior',
-              cred=0.95, comp=None, *args, **kwargs):
+def post_stats(sample, cred=0.95, comp=None, bins=25, hdi=None):
+    '''Compute everything 'plot_post' draws, without plotting.
+
+    :Arguments:
+        sample: array of sample values.
+        cred: credible interval (default: 95%)
+        comp: value for comparison (default: None)
+        bins: number of histogram bins (default: 25).
+        hdi: precomputed HDI limits (default: None, computed here).
+
+    Returns a dictionary with the 'mean', the 'hdi', the histogram
+    'density' and bin 'edges' and, with 'comp', the percentage of the
+    sample 'less' and 'more' than it. It is small enough to be cached or
+    sent to another process instead of the sample.
+
+    '''
+    sample = np.ravel(sample)
+    if hdi is None:
+        hdi = short_hdi(sample, cred)
+    density, edges = np.histogram(sample, bins=bins, density=True)
+    stats = dict(mean=sample.mean(), hdi=hdi, density=density, edges=edges)
+    if comp is not None:
+        stats['less'], stats['more'] = _tails(sample, comp)
+    return stats
+
+
+def _check_tails(stats, sample, comp):
+    '''Raise ValueError when the tails of 'comp' can not be drawn: they are
+    neither in 'stats' nor computable from a 'sample'.'''
+    if comp is not None and sample is None and stats is not None and \
+            'less' not in stats:
+        raise ValueError("stats without 'less' and 'more' can not be "
+                         "compared to comp=%r: compute them with "
+                         "post_stats(sample, comp=comp)" % (comp,))
+
+
+def _tails(sample, comp):
+    '''Percentage of the sample less and more than 'comp'.'''
+    sample = np.ravel(sample)
+    less = 100 * np.count_nonzero(sample < comp) / len(sample)
+    more = 100 * np.count_nonzero(sample > comp) / len(sample)
+    return less, more
+
+
+@timed('plot')
+def plot_post(sample, title='Posterior', cred=0.95, comp=None, stats=None,
+              ax=None, *args, **kwargs):
     '''Plot the histogram of the posterior distribution sample,
     with the mean and the HDI.
 
@@ -28,52 +75,122 @@ def plot_post(sample, title='Posterior',
         cred: credible interval (default: 95%)
         comp: value for comparison (default: None)
         title: String value for graph title.
+        stats: result of 'post_stats' for this sample (default: None,
+               computed here). With it, 'sample' may be None, as long as
+               'stats' has the tails of 'comp'.
+        ax: matplotlib axes to draw on (default: the current axes).
 
     '''
-    # First we compute the shortest HDI using Krushcke's algorithm.
-
-    sample_hdi = short_hdi(sample)
+    _check_tails(stats, sample, comp)
+    if ax is None:
+        from matplotlib import pyplot as plot
+        ax = plot.gca()
+
+    # First we compute the shortest HDI using Krushcke's algorithm,
+    # and the histogram of the sample.
+
+    if stats is None:
+        stats = post_stats(sample, cred, comp)
+    sample_hdi = stats['hdi']
+    density = stats['density']
+    edges = stats['edges']
+    mean = stats['mean']
+    max_density = density.max()
 
     # Then we plot the histogram of the sample.
-    ax = plot.hist(sample,
-                   bins=25,
-                   alpha=0.85,
-                   label='',
-                   normed=True)
+    ax.bar(edges[:-1], density, width=np.diff(edges), align='edge',
+           alpha=0.85)
 
     # Force the y-axis to be limited to 1.1 times the max probability density.
-    maxy = 1.1 * max(ax[0])
-    plot.ylim(0.0, maxy)
+    maxy = 1.1 * max_density
+    ax.set_ylim(0.0, maxy)
 
     # No y-axis label, they are not important here.
-    plot.yticks([])
+    ax.set_yticks([])
 
     # Should we plot a vertical line on the mean?
-    #plot.vlines(sample.mean(), 0, maxy, linestyle='--',
-    #       label=r'Mean (%0.3f)' % sample.mean())
+    #ax.vlines(mean, 0, maxy, linestyle='--',
+    #       label=r'Mean (%0.3f)' % mean)
     # But we keep the mean value in its right place.
 
-    plot.text(sample.mean(), 0.9 * max(ax[0]), 'Mean: %0.3f' % sample.mean())
+    ax.text(mean, 0.9 * max_density, 'Mean: %0.3f' % mean)
 
-    #plot.legend(loc='upper right') #Legends are cumbersome!
-    plot.title(title)
+    #ax.legend(loc='upper right') #Legends are cumbersome!
+    ax.set_title(title)
 
     # Plot the HDI as a vertical line with their respective values.
-    plot.hlines(y=0, xmin=sample_hdi[0], xmax=sample_hdi[1], linewidth=6)
-    plot.text(sample_hdi[0], max(ax[0]) / 20, '%0.3f' % sample_hdi[0],
-          horizontalalignment='center')
-    plot.text(sample_hdi[1], max(ax[0]) / 20, '%0.3f' % sample_hdi[1],
-          horizontalalignment='center')
+    ax.hlines(y=0, xmin=sample_hdi[0], xmax=sample_hdi[1], linewidth=6)
+    ax.text(sample_hdi[0], max_density / 20, '%0.3f' % sample_hdi[0],
+            horizontalalignment='center')
+    ax.text(sample_hdi[1], max_density / 20, '%0.3f' % sample_hdi[1],
+            horizontalalignment='center')
 
     # In case there is a comparison value, plot it and
     # compute how much of the posterior falls at each side.
-    if comp != None:
-        loc = max(ax[0]) / 2.0
-        plot.vlines(comp, 0, loc, color='green', linestyle='--')
-        less = 100 * (sum(sample < comp)) / len(sample)
-        more = 100 * (sum(sample > comp)) / len(sample)
-        print less, more
-        plot.text(comp, loc, '%0.1f%% < %0.1f < %0.1f%%' % (less, comp, more),
-                  color='green', horizontalalignment='center')
-
-    #return ax  # I thought the function should return something. It's not needed.
+    if comp is not None:
+        loc = max_density / 2.0
+        ax.vlines(comp, 0, loc, color='green', linestyle='--')
+        if 'less' in stats:
+            less, more = stats['less'], stats['more']
+        else:
+            less, more = _tails(sample, comp)
+        ax.text(comp, loc, '%0.1f%% < %0.1f < %0.1f%%' % (less, comp, more),
+                color='green', horizontalalignment='center')
+
+
+def _render_panel(job):
+    '''Draw one panel on its own Agg figure and save it.'''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    path, title, comp, stats, figsize, dpi = job
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    plot_post(None, title=title, comp=comp, stats=stats,
+              ax=figure.add_subplot(111))
+    figure.savefig(path)
+    return path
+
+
+def render_panels(panels, max_workers=None, figsize=(4.0, 3.0), dpi=100):
+    '''Render many posterior panels to image files, without a display.
+
+    :Arguments:
+        panels: sequence of dictionaries, one per panel, with the 'path'
+                of the image (its extension sets the format, such as
+                '.png' or '.svg'), the 'sample' or its precomputed
+                'stats', and optionally 'title', 'cred' and 'comp'. With
+                'comp', 'stats' must have its tails (see 'post_stats'),
+                or the 'sample' must be given too.
+        max_workers: number of rendering processes (default: number of
+                     CPUs). Use 1 to render in this process.
+        figsize, dpi: size and resolution of every figure.
+
+    The statistics are computed here, so only them (not the samples) are
+    sent to the workers, which draw on the Agg backend without 'pyplot'.
+
+    Returns the list of written paths.
+
+    '''
+    jobs = []
+    for panel in panels:
+        comp = panel.get('comp')
+        stats = panel.get('stats')
+        if stats is None:
+            stats = post_stats(panel['sample'], panel.get('cred', 0.95),
+                               comp)
+        elif 'less' not in stats and panel.get('sample') is not None:
+            stats = dict(stats)
+            stats['less'], stats['more'] = _tails(panel['sample'], comp)
+        # Fail here, not in a worker, when the tails are missing.
+        _check_tails(stats, None, comp)
+        jobs.append((panel['path'], panel.get('title', 'Posterior'), comp,
+                     stats, figsize, dpi))
+
+    if max_workers == 1:
+        return [_render_panel(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_render_panel, jobs))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''Indexed store of posterior draws, for fast repeated queries.
+The draws of every parameter are sorted once, so a quantile is an index
+into them and a CDF or tail probability is a binary search, O(log n),
+instead of a scan of the whole sample. The HDIs on a grid of credible
+masses are computed when the store is built. A store can be saved to a
+directory and loaded back memory-mapped, and served over HTTP to local
+dashboards.
+
+Usage:
+    store = PosteriorStore(merge_chains(trace),
+                           diffs=[('theta2', 'theta1')])
+    store.more('theta2-theta1', 0.0)     # P(theta2 - theta1 > 0)
+    store.hdi('theta1', 0.9)
+    store.save('posterior')
+    serve(PosteriorStore.load('posterior'), port=8000)
+
+    curl 'localhost:8000/more?name=theta2-theta1&x=0'
+
+'''
+from __future__ import division
+
+import json
+import os
+
+import numpy as np
+
+from sampling import trace_columns
+from short_hdi import sorted_hdi
+
+# Credible masses whose HDIs are precomputed: 0.50, 0.51, ..., 0.99.
+HDI_GRID = np.round(np.arange(50, 100) / 100, 2)
+
+
+class PosteriorStore(object):
+    '''Sorted posterior draws with precomputed HDIs.
+
+    :Arguments:
+        trace: dictionary with the pooled (draw, ...) sample of each
+               variable, such as the result of 'merge_chains'.
+        diffs: sequence of pairs of scalar variables (a, b), whose
+               difference is stored as 'a-b' (default: none).
+        grid: credible masses whose HDIs are precomputed (default:
+              0.50 to 0.99 by 0.01).
+
+    '''
+
+    def __init__(self, trace=None, diffs=(), grid=HDI_GRID):
+        self.sorted = {}
+        self.grid = np.asarray(grid, dtype=float)
+        self.hdi_grid = {}
+        if trace is not None:
+            for name, sample in trace_columns(trace, diffs):
+                self.add(name, sample)
+
+    @property
+    def names(self):
+        return sorted(self.sorted)
+
+    def add(self, name, sample):
+        '''Store the draws of one more quantity, such as a derived one.'''
+        draws = np.sort(np.ravel(sample))
+        self.sorted[name] = draws
+        self.hdi_grid[name] = sorted_hdi(draws[:, np.newaxis],
+                                         self.grid)[:, 0]
+
+    def _draws(self, name):
+        try:
+            return self.sorted[name]
+        except KeyError:
+            raise KeyError('no parameter %r in the store' % name)
+
+    def quantile(self, name, p):
+        '''Quantiles of 'name' at the probabilities 'p', interpolated
+        between the draws as in 'np.percentile'.'''
+        draws = self._draws(name)
+        p = np.asarray(p, dtype=float)
+        if not np.all((p >= 0) & (p <= 1)):
+            raise ValueError('probabilities must be between 0 and 1')
+        position = p * (len(draws) - 1)
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, len(draws) - 1)
+        weight = position - low
+        return draws[low] * (1 - weight) + draws[high] * weight
+
+    def cdf(self, name, x):
+        '''Fraction of the draws of 'name' less than or equal to 'x'.'''
+        draws = self._draws(name)
+        return np.searchsorted(draws, x, side='right') / len(draws)
+
+    def less(self, name, x):
+        '''Fraction of the draws of 'name' less than 'x'.'''
+        draws = self._draws(name)
+        return np.searchsorted(draws, x, side='left') / len(draws)
+
+    def more(self, name, x):
+        '''Fraction of the draws of 'name' greater than 'x'.'''
+        return 1 - self.cdf(name, x)
+
+    def hdi(self, name, cred=0.95):
+        '''HDI of 'name'. Masses on the grid are looked up, in O(1).
+        Other ones are computed from the sorted draws, which scans them
+        all, O(n): add the masses queried often to the 'grid' of the
+        store.'''
+        if not 0 < cred < 1:
+            raise ValueError('the credible mass must be between 0 and 1')
+        k = np.searchsorted(self.grid, cred)
+        for i in (k - 1, k):
+            if 0 <= i < len(self.grid) and abs(self.grid[i] - cred) < 1e-9:
+                return tuple(self.hdi_grid[name][i])
+        return tuple(sorted_hdi(self._draws(name)[:, np.newaxis],
+                                cred)[0, 0])
+
+    def save(self, directory):
+        '''Save the store in 'directory': one '.npy' file of sorted
+        draws per parameter, the HDI grid and an index of the names.'''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        names = self.names
+        for i, name in enumerate(names):
+            np.save(os.path.join(directory, 'draws_%i.npy' % i),
+                    self.sorted[name])
+        np.save(os.path.join(directory, 'hdi.npy'),
+                np.array([self.hdi_grid[name] for name in names]))
+        with open(os.path.join(directory, 'index.json'), 'w') as output:
+            json.dump(dict(names=names, grid=self.grid.tolist()), output,
+                      indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        '''Load a saved store. The draws are memory-mapped by default, so
+        a query only reads the pages its binary search touches.'''
+        with open(os.path.join(directory, 'index.json')) as source:
+            index = json.load(source)
+        store = cls(grid=index['grid'])
+        hdi = np.load(os.path.join(directory, 'hdi.npy'))
+        for i, name in enumerate(index['names']):
+            store.sorted[name] = np.load(
+                os.path.join(directory, 'draws_%i.npy' % i),
+                mmap_mode=mmap_mode)
+            store.hdi_grid[name] = hdi[i]
+        return store
+
+
+# Queries of the HTTP endpoint, with the name of their value argument.
+
+_QUERIES = dict(quantile='p', cdf='x', less='x', more='x', hdi='cred')
+
+
+def make_handler(store):
+    '''HTTP request handler class answering queries on 'store'.
+
+    GET /names lists the parameters. GET /<query>?name=...&<arg>=...
+    answers 'quantile' (p), 'cdf', 'less', 'more' (x) and 'hdi' (cred),
+    with a JSON object. Several values of the argument may be given.
+
+    '''
+    # The server modules are only needed to serve, not to query.
+    try:
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+    except ImportError:  # Python 2
+        from BaseHTTPServer import BaseHTTPRequestHandler
+        from urlparse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            route = url.path.strip('/')
+            try:
+                if route == 'names':
+                    result = dict(names=store.names)
+                elif route in _QUERIES:
+                    name = query['name'][0]
+                    values = [float(v) for v in query.get(_QUERIES[route],
+                                                          [])]
+                    if route == 'hdi':
+                        answers = [store.hdi(name, v)
+                                   for v in values or [0.95]]
+                    else:
+                        answers = getattr(store, route)(name, values)
+                    result = dict(name=name, query=route, values=values,
+                                  result=np.asarray(answers).tolist())
+                else:
+                    return self._reply(404, dict(error='unknown query'))
+            except (KeyError, ValueError) as error:
+                return self._reply(400, dict(error=str(error.args[0])))
+            self._reply(200, result)
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(store, host='127.0.0.1', port=8000):
+    '''Answer queries on 'store' over HTTP until interrupted.'''
+    try:
+        from http.server import HTTPServer
+    except ImportError:  # Python 2
+        from BaseHTTPServer import HTTPServer
+
+    server = HTTPServer((host, port), make_handler(store))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+'''Posterior predictive simulation for the regression and ANOVA models.
+Every draw of the posterior is evaluated at every new point in one
+(draws, points) array operation, a chunk of points at a time, so that
+large grids of new values never need the whole matrix in memory.
+
+The parameter samples are in the original scale of the data, as
+converted by 'normalize.Standardizer'.
+
+'''
+from __future__ import division
+
+import numpy as np
+
+from short_hdi import batch_hdi
+
+
+def _simulate(mean, scale, df, rng):
+    '''Add noise to a (draws, points) array of means, in place. 'scale'
+    and 'df' are (draws,) arrays; 'df' is None for normal noise.'''
+    if df is None:
+        noise = rng.standard_normal(mean.shape)
+    else:
+        noise = rng.standard_t(df[:, np.newaxis], size=mean.shape)
+    noise *= scale[:, np.newaxis]
+    mean += noise
+    return mean
+
+
+def regression_draws(b0_sample, b1_sample, x_new, sigma_sample=None,
+                     tdf_sample=None, rng=None):
+    '''Predictions of the linear regression at the points 'x_new'.
+
+    :Arguments:
+        b0_sample, b1_sample: intercept and slope samples, shape (draws,).
+        x_new: array of new predictor values, shape (points,).
+        sigma_sample: scale samples of the Student's t noise (default:
+                      None, no noise: the credible regression lines).
+        tdf_sample: degrees of freedom samples of the noise (default:
+                    None, normal noise).
+        rng: 'np.random.RandomState' for the noise.
+
+    Returns an array of shape (draws, points).
+
+    '''
+    b0_sample = np.asarray(b0_sample)
+    mean = np.multiply.outer(np.asarray(b1_sample), np.asarray(x_new,
+                                                               dtype=float))
+    mean += b0_sample[:, np.newaxis]
+    if sigma_sample is None:
+        return mean
+    if rng is None:
+        rng = np.random.RandomState()
+    return _simulate(mean, np.asarray(sigma_sample),
+                     None if tdf_sample is None else np.asarray(tdf_sample),
+                     rng)
+
+
+def anova_draws(b0_sample, b_sample, groups, sigma_sample=None, rng=None):
+    '''Predictions of the oneway ANOVA for the group labels 'groups'.
+
+    :Arguments:
+        b0_sample: baseline samples, shape (draws,).
+        b_sample: deflection samples, shape (draws, levels).
+        groups: array of group labels, integers from 1 to the number of
+                levels, as the 'x' data of the model.
+        sigma_sample: cell SD samples of the normal noise (default: None,
+                      no noise: the group means).
+        rng: 'np.random.RandomState' for the noise.
+
+    Returns an array of shape (draws, points).
+
+    '''
+    idx = np.asarray(groups, dtype=int) - 1
+    mean = np.take(b_sample, idx, axis=1)
+    mean += np.asarray(b0_sample)[:, np.newaxis]
+    if sigma_sample is None:
+        return mean
+    if rng is None:
+        rng = np.random.RandomState()
+    return _simulate(mean, np.asarray(sigma_sample), None, rng)
+
+
+def _chunked(draw, points, n_draws, chunk, out):
+    '''Evaluate 'draw(points_chunk)' a chunk of points at a time.'''
+    if out is None:
+        out = np.empty((n_draws, len(points)))
+    for start in range(0, len(points), chunk):
+        out[:, start:start + chunk] = draw(points[start:start + chunk])
+    return out
+
+
+def _intervals(draw, points, cred, chunk):
+    '''HDI of 'draw(points_chunk)' at every point, a chunk at a time.'''
+    creds = np.atleast_1d(cred)
+    hdi_lim = np.empty((len(creds), len(points), 2))
+    for start in range(0, len(points), chunk):
+        hdi_lim[:, start:start + chunk] = batch_hdi(
+            draw(points[start:start + chunk]), creds)
+    return hdi_lim[0] if np.ndim(cred) == 0 else hdi_lim
+
+
+def regression_predictive(b0_sample, b1_sample, sigma_sample, tdf_sample,
+                          x_new, noise=True, chunk=1000, seed=None,
+                          out=None):
+    '''Posterior predictive sample of the robust linear regression.
+
+    :Arguments:
+        b0_sample, b1_sample, sigma_sample, tdf_sample: original scale
+            samples of intercept, slope, noise scale and t DoF.
+        x_new: array of new predictor values, shape (points,).
+        noise: whether to add the Student's t noise (default: True).
+               Without it, the result are the credible regression lines.
+        chunk: number of points computed at a time (default: 1000).
+        seed: seed of the noise generator (default: None).
+        out: array of shape (draws, points) receiving the result, such
+             as an 'np.memmap' (default: None, a new array).
+
+    Returns an array of shape (draws, points).
+
+    '''
+    rng = np.random.RandomState(seed)
+    if not noise:
+        sigma_sample = None
+
+    def draw(x):
+        return regression_draws(b0_sample, b1_sample, x, sigma_sample,
+                                tdf_sample, rng)
+    return _chunked(draw, np.asarray(x_new, dtype=float), len(b0_sample),
+                    chunk, out)
+
+
+def regression_interval(b0_sample, b1_sample, sigma_sample, tdf_sample,
+                        x_new, cred=0.95, noise=True, chunk=1000, seed=None):
+    '''Posterior predictive HDI of the robust linear regression.
+
+    :Arguments: as 'regression_predictive', and 'cred', a float or a
+        sequence of floats from 0.0 to 1.0.
+
+    Only a chunk of points of the predictive sample is kept in memory.
+    Returns an array of shape (points, 2) for a single 'cred', or of
+    shape (len(cred), points, 2).
+
+    '''
+    rng = np.random.RandomState(seed)
+    if not noise:
+        sigma_sample = None
+
+    def draw(x):
+        return regression_draws(b0_sample, b1_sample, x, sigma_sample,
+                                tdf_sample, rng)
+    return _intervals(draw, np.asarray(x_new, dtype=float), cred, chunk)
+
+
+def anova_predictive(b0_sample, b_sample, sigma_sample, groups, noise=True,
+                     chunk=1000, seed=None, out=None):
+    '''Posterior predictive sample of the oneway ANOVA.
+
+    :Arguments:
+        b0_sample, b_sample, sigma_sample: original scale samples of the
+            baseline, the deflections and the cell SD.
+        groups: array of group labels (from 1), shape (points,).
+        noise: whether to add the normal noise (default: True). Without
+               it, the result are the group means.
+        chunk, seed, out: as in 'regression_predictive'.
+
+    Returns an array of shape (draws, points).
+
+    '''
+    rng = np.random.RandomState(seed)
+    if not noise:
+        sigma_sample = None
+
+    def draw(g):
+        return anova_draws(b0_sample, b_sample, g, sigma_sample, rng)
+    return _chunked(draw, np.asarray(groups, dtype=int), len(b0_sample),
+                    chunk, out)
+
+
+def anova_interval(b0_sample, b_sample, sigma_sample, groups, cred=0.95,
+                   noise=True, chunk=1000, seed=None):
+    '''Posterior predictive HDI of the oneway ANOVA.
+
+    :Arguments: as 'anova_predictive', and 'cred', a float or a sequence
+        of floats from 0.0 to 1.0.
+
+    Returns an array of shape (points, 2) for a single 'cred', or of
+    shape (len(cred), points, 2).
+
+    '''
+    rng = np.random.RandomState(seed)
+    if not noise:
+        sigma_sample = None
+
+    def draw(g):
+        return anova_draws(b0_sample, b_sample, g, sigma_sample, rng)
+    return _intervals(draw, np.asarray(groups, dtype=int), cred, chunk)
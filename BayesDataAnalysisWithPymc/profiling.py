@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+'''Per-phase timing and sampler statistics of the model runs.
+Phases (data load, graph build, MAP, sampling, trace extraction,
+conversion, plotting) are timed with the 'phase' context manager or the
+'timed' decorator, and the samplers record their throughput and the
+acceptance rate of every step method. The registry can be written as
+JSON or as a Prometheus text file.
+
+Profiling is off by default, and then every hook costs one attribute
+check. Turn it on with 'enable()', or for a whole script run with the
+environment variable BAYES_PROFILE set to the report path:
+
+    BAYES_PROFILE=run.prom python SimpleLinearRegressionPyMC.py
+
+The report is written when the program exits, as Prometheus text if the
+path ends with '.prom', and as JSON otherwise. Phases that run in worker
+processes are not recorded; the parent records the time of the whole
+pool instead.
+
+'''
+from __future__ import division
+
+import atexit
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# 'time.clock' was removed in Python 3.8.
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+class _Phase(object):
+    '''Timer of one run of a phase.'''
+
+    __slots__ = ('registry', 'key', 'wall', 'cpu')
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.wall, self.cpu = time.time(), _cpu_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.add_time(self.key, time.time() - self.wall,
+                               _cpu_time() - self.cpu)
+        return False
+
+
+class _NullPhase(object):
+    '''Phase timer of a disabled registry, doing nothing.'''
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Registry(object):
+    '''Timings and values recorded during a run.
+
+    'phases' maps (name, labels) to the number of runs and their total
+    and largest wall time and total CPU time. 'values' maps (name,
+    labels) to the last value recorded, such as iterations per second.
+
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = OrderedDict()
+        self.values = OrderedDict()
+
+    def phase(self, name, **labels):
+        '''Context manager timing one run of the phase 'name'.'''
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, _key(name, labels))
+
+    def add_time(self, key, wall, cpu):
+        stats = self.phases.get(key)
+        if stats is None:
+            stats = self.phases[key] = dict(count=0, wall=0.0, cpu=0.0,
+                                            max_wall=0.0)
+        stats['count'] += 1
+        stats['wall'] += wall
+        stats['cpu'] += cpu
+        stats['max_wall'] = max(stats['max_wall'], wall)
+
+    def record(self, name, value, **labels):
+        '''Record the value of a statistic.'''
+        if self.enabled:
+            self.values[_key(name, labels)] = float(value)
+
+    def reset(self):
+        self.phases.clear()
+        self.values.clear()
+
+    def to_dict(self):
+        '''The registry as a JSON-serializable dictionary.'''
+        return dict(
+            phases=[dict(stats, name=name, labels=dict(labels))
+                    for (name, labels), stats in self.phases.items()],
+            values=[dict(name=name, labels=dict(labels), value=value)
+                    for (name, labels), value in self.values.items()])
+
+    def to_prometheus(self, prefix='bayes'):
+        '''The registry in the Prometheus text exposition format.'''
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, str(v).replace(
+                    '\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+                lines.append('%s_%s{%s} %r' % (prefix, name, label_text,
+                                               value))
+
+        phases = [(((('phase', name),) + labels), stats)
+                  for (name, labels), stats in self.phases.items()]
+        metric('phase_calls_total', 'counter', 'Runs of each phase.',
+               [(labels, stats['count']) for labels, stats in phases])
+        metric('phase_wall_seconds_total', 'counter',
+               'Wall time spent in each phase.',
+               [(labels, stats['wall']) for labels, stats in phases])
+        metric('phase_cpu_seconds_total', 'counter',
+               'CPU time spent in each phase.',
+               [(labels, stats['cpu']) for labels, stats in phases])
+        names = []
+        for name, _ in self.values:
+            if name not in names:
+                names.append(name)
+        for name in names:
+            metric(name, 'gauge', 'Last recorded %s.' % name.replace(
+                '_', ' '), [(labels, value)
+                            for (n, labels), value in self.values.items()
+                            if n == name])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Write the registry to 'path', as Prometheus text if it ends
+        with '.prom' and as JSON otherwise.'''
+        with open(path, 'w') as output:
+            if path.endswith('.prom'):
+                output.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), output, indent=2, sort_keys=True)
+
+
+# The registry shared by all the modules.
+
+registry = Registry()
+
+
+def enable(path=None):
+    '''Turn profiling on. With 'path', the report is written there when
+    the program exits.'''
+    registry.enabled = True
+    if path:
+        atexit.register(registry.write, path)
+
+
+def disable():
+    registry.enabled = False
+
+
+def phase(name, **labels):
+    '''Context manager timing the phase 'name' in the shared registry.
+
+    Usage:
+        with phase('plot', model='ANOVAOnewayPyMC'):
+            plot_post(...)
+
+    '''
+    return registry.phase(name, **labels)
+
+
+def timed(name, **labels):
+    '''Decorator timing every call of a function as the phase 'name'.'''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            with registry.phase(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, value, **labels):
+    '''Record a statistic in the shared registry.'''
+    registry.record(name, value, **labels)
+
+
+def record_throughput(iterations, wall, **labels):
+    '''Record the iterations per second of a sampler run.'''
+    if registry.enabled and wall > 0:
+        registry.record('iterations_per_second', iterations / wall, **labels)
+
+
+def record_sampler(mcmc, iterations, wall, **labels):
+    '''Record the throughput of a finished 'pymc.MCMC' run and the
+    acceptance rate of each of its step methods.'''
+    if not registry.enabled:
+        return
+    record_throughput(iterations, wall, **labels)
+    for step_method in mcmc.step_methods:
+        accepted = getattr(step_method, 'accepted', None)
+        rejected = getattr(step_method, 'rejected', None)
+        if accepted is None or rejected is None or accepted + rejected == 0:
+            continue
+        registry.record('acceptance_rate',
+                        accepted / (accepted + rejected),
+                        step_method=step_method._id, **labels)
+
+
+def model_name(model):
+    '''Name of the script that built 'model', for the labels.'''
+    recipe = getattr(model, 'recipe', None)
+    if recipe is None:
+        return 'unknown'
+    module = recipe[0].__module__
+    if module == '__main__':
+        import __main__
+        module = os.path.splitext(os.path.basename(
+            getattr(__main__, '__file__', module)))[0]
+    return module
+
+
+if os.environ.get('BAYES_PROFILE'):
+    enable(os.environ['BAYES_PROFILE'])
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+'''Run several independent MCMC chains of a PyMC model in parallel.
+Each chain is sampled in its own process, with its own random seed,
+and the traces are merged into arrays with a leading chain axis.
+Chains can also be sampled in batches until they converge.
+
+'''
+from __future__ import division
+
+import os
+import time
+
+import numpy as np
+
+import profiling
+from diagnostics import rhat, ess
+from model_cache import graph
+
+
+def chain_seeds(chains, seed=None):
+    '''Draw one independent integer seed for each chain.
+
+    :Arguments:
+        chains: integer, number of chains.
+        seed: master seed (default: None, seeds from the OS entropy).
+
+    '''
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 2**31 - 1, size=chains)
+
+
+def sample_chain(build, names, args=(), kwargs=None, iter=10000, burn=0,
+                 thin=1, seed=None, use_map=True, dbdir=None):
+    '''Build a model, sample a single chain and return its traces.
+
+    :Arguments:
+        build: picklable function returning a PyMC model (or a list of
+               its nodes). It is called with 'args' and 'kwargs'.
+        names: names of the variables whose traces are returned.
+        iter, burn, thin: same as in 'pymc.MCMC.sample'.
+        seed: seed of the chain's random number generator.
+        use_map: start the chain from the MAP estimate (default: True).
+        dbdir: directory of a 'trace_store.MemmapDatabase' (default: None,
+               keeps the trace in memory).
+
+    Returns a dictionary with the trace array of each variable or, when
+    'dbdir' is given, the directory holding the trace files.
+
+    '''
+    if seed is not None:
+        np.random.seed(seed)
+    model = build(*args, **(kwargs or {}))
+    trace, _ = _sample(model, names, iter, burn, thin, use_map, dbdir)
+    if dbdir is not None:
+        # Do not pickle the memory-mapped draws back to the parent.
+        return os.path.join(dbdir, 'chain0')
+    return trace
+
+
+def sample_batch(build, names, args=(), kwargs=None, iter=1000, burn=0,
+                 thin=1, seed=None, use_map=True, state=None):
+    '''Build a model and sample one batch of a chain, resuming from 'state'.
+
+    :Arguments:
+        build, names, args, kwargs: same as in 'sample_chain'.
+        iter, burn, thin: same as in 'pymc.MCMC.sample', for this batch.
+        seed: seed of the chain's random number generator.
+        use_map: start from the MAP estimate when there is no 'state'.
+        state: state returned by the previous batch of the same chain
+               (default: None, starts a new chain).
+
+    Returns the traces of the batch and the state of the chain at its end.
+
+    '''
+    if seed is not None:
+        np.random.seed(seed)
+    model = build(*args, **(kwargs or {}))
+    trace, mcmc = _sample(model, names, iter, burn, thin,
+                          use_map and state is None, state=state)
+    return trace, _get_state(mcmc)
+
+
+def _sample(model, names, iter, burn, thin, use_map, dbdir=None,
+            state=None):
+    '''Sample a single chain of an already built model.
+
+    Returns the traces and the 'pymc.MCMC' sampler.
+
+    '''
+    import pymc
+
+    model = graph(model)
+    label = profiling.model_name(model)
+    if use_map:
+        with profiling.phase('map', model=label):
+            map_ = pymc.MAP(model)
+            map_.fit()
+    if dbdir is None:
+        mcmc = pymc.MCMC(model)
+    else:
+        from trace_store import MemmapDatabase
+        mcmc = pymc.MCMC(model, db=MemmapDatabase(dbdir))
+    if state is not None:
+        _set_state(mcmc, state)
+    start = time.time()
+    with profiling.phase('sample', model=label):
+        mcmc.sample(iter=iter, burn=burn, thin=thin, progress_bar=False)
+    profiling.record_sampler(mcmc, iter, time.time() - start, model=label)
+    with profiling.phase('extract', model=label):
+        trace = dict((name, mcmc.trace(name)[:]) for name in names)
+    return trace, mcmc
+
+
+def _get_state(mcmc):
+    '''Values of the stochastics and state of the step methods.'''
+    state = mcmc.get_state()
+    return dict(stochastics=state['stochastics'],
+                step_methods=state['step_methods'])
+
+
+def _set_state(mcmc, state):
+    '''Resume 'mcmc' from a state returned by '_get_state'.'''
+    for stochastic in mcmc.stochastics:
+        value = state['stochastics'].get(stochastic.__name__)
+        if value is not None and \
+                np.shape(value) == np.shape(stochastic.value):
+            stochastic.value = value
+    # Tuned proposal scales are restored into the step methods. Values
+    # whose shape changed (the data grew) are left as they are.
+    mcmc.assign_step_methods()
+    for step_method in mcmc.step_methods:
+        saved = state['step_methods'].get(step_method._id, {})
+        step_method.__dict__.update(
+            (key, value) for key, value in saved.items()
+            if np.shape(value) == np.shape(getattr(step_method, key, value)))
+
+
+def run_chains(build, names, args=(), kwargs=None, chains=None, iter=10000,
+               burn=0, thin=1, seed=None, use_map=True, max_workers=None,
+               dbdir=None):
+    '''Sample independent chains of the same model in a process pool.
+
+    :Arguments:
+        build: picklable function returning a PyMC model. It must be
+               defined at module level so that workers can import it.
+        names: names of the variables whose traces are returned.
+        args, kwargs: arguments passed to 'build' in every worker.
+        chains: number of chains (default: number of CPUs).
+        iter, burn, thin: same as in 'pymc.MCMC.sample', per chain.
+        seed: master seed from which the chain seeds are drawn.
+        use_map: start each chain from the MAP estimate (default: True).
+        max_workers: size of the process pool (default: 'chains').
+        dbdir: directory where the traces are written as memory-mapped
+               '.npy' files (default: None, keeps them in memory).
+
+    Returns a dictionary with an array of shape (chain, draw, ...) for
+    each variable. Use 'merge_chains' to pool the draws of all chains.
+    With 'dbdir', the arrays are read-only 'np.memmap' views of
+    'dbdir/name.npy'.
+
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import cpu_count
+
+    if chains is None:
+        chains = cpu_count()
+    seeds = chain_seeds(chains, seed)
+    if dbdir is None:
+        chain_dirs = [None] * chains
+    else:
+        chain_dirs = [os.path.join(dbdir, 'chain-%i' % c)
+                      for c in range(chains)]
+
+    with ProcessPoolExecutor(max_workers=max_workers or chains) as pool:
+        futures = [pool.submit(sample_chain, build, names, args, kwargs,
+                               iter, burn, thin, int(s), use_map, d)
+                   for s, d in zip(seeds, chain_dirs)]
+        results = [f.result() for f in futures]
+
+    if dbdir is not None:
+        from trace_store import open_traces, stack_chains, remove_chain_dirs
+        traces = stack_chains([open_traces(r, names) for r in results],
+                              dbdir)
+        remove_chain_dirs(chain_dirs)
+        return traces
+
+    return dict((name, np.array([r[name] for r in results]))
+                for name in names)
+
+
+def run_until(build, names, args=(), kwargs=None, chains=4, batch=1000,
+              burn=1000, thin=1, target_ess=400, max_rhat=1.01,
+              max_iter=100000, seed=None, use_map=True, max_workers=None):
+    '''Sample chains in batches until they converge.
+
+    :Arguments:
+        build, names, args, kwargs: same as in 'run_chains'.
+        chains: number of chains (default: 4).
+        batch: iterations per chain between convergence checks, rounded
+               up to a multiple of 'thin' (default: 1000).
+        burn: burn-in iterations of the first batch (default: 1000).
+        thin: keep one draw every 'thin' iterations (default: 1).
+        target_ess: effective sample size every parameter must reach
+                    (default: 400).
+        max_rhat: largest split R-hat accepted (default: 1.01).
+        max_iter: limit of iterations per chain, burn-in included, after
+                  which sampling stops even without convergence.
+        seed: master seed from which the seeds of every batch are drawn.
+        use_map: start each chain from the MAP estimate (default: True).
+        max_workers: size of the process pool (default: 'chains').
+
+    Every batch resumes each chain from the values and the tuned step
+    methods left by the previous one, so compute grows with how hard the
+    posterior is to sample instead of a fixed number of iterations.
+
+    Returns a dictionary with an array of shape (chain, draw, ...) for
+    each variable.
+
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+
+    rng = np.random.RandomState(seed)
+    batch = int(np.ceil(batch / thin)) * thin
+    states = [None] * chains
+    traces = None
+    n_iter = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers or chains) as pool:
+        while True:
+            skip = burn if traces is None else 0
+            size = min(batch, max(max_iter - n_iter - skip, thin))
+            seeds = rng.randint(0, 2**31 - 1, size=chains)
+            futures = [pool.submit(sample_batch, build, names, args, kwargs,
+                                   skip + size, skip, thin, int(s), use_map,
+                                   state)
+                       for s, state in zip(seeds, states)]
+            results = [f.result() for f in futures]
+            states = [state for _, state in results]
+            n_iter += skip + size
+
+            new = dict((name, np.array([trace[name] for trace, _ in results]))
+                       for name in names)
+            if traces is None:
+                traces = new
+            else:
+                traces = dict((name, np.concatenate((traces[name], new[name]),
+                                                    axis=1))
+                              for name in names)
+
+            if (n_iter >= max_iter or
+                    converged(traces, target_ess, max_rhat)):
+                return traces
+
+
+def converged(traces, target_ess=400, max_rhat=1.01):
+    '''Check whether every parameter reached the target ESS and R-hat.
+
+    :Arguments:
+        traces: dictionary of arrays with shape (chain, draw, ...).
+        target_ess: effective sample size every parameter must reach.
+        max_rhat: largest split R-hat accepted.
+
+    '''
+    for trace in traces.values():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trace_rhat = rhat(trace)
+            trace_ess = ess(trace)
+        # Constant traces have no defined diagnostics, so they are skipped.
+        defined = np.isfinite(trace_rhat) & np.isfinite(trace_ess)
+        if (np.any(trace_rhat[defined] > max_rhat) or
+                np.any(trace_ess[defined] < target_ess)):
+            return False
+    return True
+
+
+def fit(model, names, iter=10000, burn=0, thin=1, chains=1, seed=None,
+        use_map=True, max_workers=None, dbdir=None, target_ess=None,
+        max_rhat=1.01, batch=None, warm_start=None, warm_burn=None):
+    '''Sample a model built by one of the 'build_model' functions.
+
+    :Arguments:
+        model: model returned by a 'build_model' function.
+        names: names of the variables whose traces are returned.
+        iter, burn, thin: same as in 'pymc.MCMC.sample', per chain.
+        chains: number of chains (default: 1). A single chain is sampled
+                in this process, reusing 'model'. More chains are sampled
+                in a process pool, each worker rebuilding the model from
+                the recipe 'build_model' attached to it.
+        seed: master seed from which the chain seeds are drawn.
+        use_map: start each chain from the MAP estimate (default: True).
+        max_workers: size of the process pool (default: 'chains').
+        dbdir: directory where the traces are written as memory-mapped
+               '.npy' files (default: None, keeps them in memory). Each
+               variable is one 'dbdir/name.npy' file of shape (chain,
+               draw, ...), whatever the number of chains.
+        target_ess: when given, sample in batches after the burn-in, until
+                    every parameter reaches this effective sample size and
+                    'max_rhat', with 'iter' as the limit (see 'run_until').
+        max_rhat: largest split R-hat accepted with 'target_ess'.
+        batch: iterations per batch with 'target_ess' (default: one
+               twentieth of the draws after burn-in).
+        warm_start: 'state_cache.StateCache' (or True, for the default
+                    one) where the final state of every chain is saved.
+                    When it has the states of a previous fit of the same
+                    model and data, or of a prefix of the data, the
+                    chains start from them, with their tuned proposals
+                    and without the MAP estimate.
+        warm_burn: burn-in of a warm-started fit, which replaces 'burn'
+                   keeping the same number of draws (default: burn / 10).
+
+    Returns a dictionary with an array of shape (chain, draw, ...) for
+    each variable.
+
+    '''
+    if warm_start is not None:
+        if target_ess is not None or dbdir is not None:
+            raise ValueError('warm_start can not be used with target_ess '
+                             'or dbdir')
+        return _fit_warm(model, names, iter, burn, thin, chains, seed,
+                         use_map, max_workers, warm_start, warm_burn)
+
+    if target_ess is not None:
+        if dbdir is not None:
+            raise ValueError('target_ess keeps the batches in memory, '
+                             'it can not be used with dbdir')
+        build, args, kwargs = model.recipe
+        with profiling.phase('chains', model=profiling.model_name(model)):
+            return run_until(build, names, args, kwargs, chains=chains,
+                             batch=batch or max((iter - burn) // 20, thin),
+                             burn=burn, thin=thin, target_ess=target_ess,
+                             max_rhat=max_rhat, max_iter=iter, seed=seed,
+                             use_map=use_map, max_workers=max_workers)
+
+    if chains == 1:
+        if seed is not None:
+            np.random.seed(chain_seeds(1, seed)[0])
+        if dbdir is None:
+            trace, _ = _sample(model, names, iter, burn, thin, use_map)
+            return dict((name, trace[name][np.newaxis]) for name in names)
+        # Same layout as several chains: 'dbdir/name.npy', with a leading
+        # chain axis.
+        from trace_store import open_traces, stack_chains, remove_chain_dirs
+        chain_dir = os.path.join(dbdir, 'chain-0')
+        _sample(model, names, iter, burn, thin, use_map, chain_dir)
+        traces = stack_chains([open_traces(os.path.join(chain_dir, 'chain0'),
+                                           names)], dbdir)
+        remove_chain_dirs([chain_dir])
+        return traces
+
+    build, args, kwargs = model.recipe
+    label = profiling.model_name(model)
+    start = time.time()
+    with profiling.phase('chains', model=label):
+        traces = run_chains(build, names, args, kwargs, chains=chains,
+                            iter=iter, burn=burn, thin=thin, seed=seed,
+                            use_map=use_map, max_workers=max_workers,
+                            dbdir=dbdir)
+    profiling.record_throughput(chains * iter, time.time() - start,
+                                model=label)
+    return traces
+
+
+def _fit_warm(model, names, iter, burn, thin, chains, seed, use_map,
+              max_workers, cache, warm_burn):
+    '''Sample chains starting from the cached states, and cache theirs.'''
+    if cache is True:
+        from state_cache import StateCache
+        cache = StateCache()
+
+    states, _ = cache.lookup(model.recipe)
+    if states is None:
+        states = [None] * chains
+    else:
+        if warm_burn is None:
+            warm_burn = burn // 10
+        iter, burn = iter - burn + warm_burn, warm_burn
+        states = [states[c % len(states)] for c in range(chains)]
+
+    seeds = chain_seeds(chains, seed)
+    if chains == 1:
+        if seed is not None:
+            np.random.seed(seeds[0])
+        trace, mcmc = _sample(model, names, iter, burn, thin,
+                              use_map and states[0] is None,
+                              state=states[0])
+        results = [(trace, _get_state(mcmc))]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        build, args, kwargs = model.recipe
+        label = profiling.model_name(model)
+        start = time.time()
+        with profiling.phase('chains', model=label), \
+                ProcessPoolExecutor(max_workers=max_workers or chains) as pool:
+            futures = [pool.submit(sample_batch, build, names, args, kwargs,
+                                   iter, burn, thin, int(s), use_map, state)
+                       for s, state in zip(seeds, states)]
+            results = [f.result() for f in futures]
+        profiling.record_throughput(chains * iter, time.time() - start,
+                                    model=label)
+
+    cache.store(model.recipe, [state for _, state in results])
+    return dict((name, np.array([trace[name] for trace, _ in results]))
+                for name in names)
+
+
+def summarize(model, iter=10000, burn=0, thin=1, use_map=True, comp=None,
+              db=None):
+    '''Sample a single chain, keeping only streaming summaries of the draws.
+
+    :Arguments:
+        model: PyMC model, such as one returned by a 'build_model'.
+        iter, burn, thin: same as in 'pymc.MCMC.sample'.
+        use_map: start the chain from the MAP estimate (default: True).
+        comp: dictionary with comparison values for some variables.
+        db: 'trace_store.SummaryDatabase' to fill (default: a new one).
+            Pass your own to read its summaries while sampling runs.
+
+    Returns a dictionary with the 'online.OnlineSummary' of each variable.
+    Memory does not grow with the number of draws.
+
+    '''
+    import pymc
+    from trace_store import SummaryDatabase
+
+    model = graph(model)
+    if db is None:
+        db = SummaryDatabase(comp=comp)
+    if use_map:
+        map_ = pymc.MAP(model)
+        map_.fit()
+    mcmc = pymc.MCMC(model, db=db)
+    mcmc.sample(iter=iter, burn=burn, thin=thin, progress_bar=False)
+    return db.summaries
+
+
+def save_traces(traces, dbdir):
+    '''Save in-memory (chain, draw, ...) traces as '.npy' files, one per
+    variable, in 'dbdir', and return them as read-only 'np.memmap' arrays.
+    The layout is the same as that of 'run_chains'.'''
+    for name, trace in traces.items():
+        if np.ndim(trace) < 2:
+            raise ValueError('trace %r is not shaped (chain, draw, ...)'
+                             % name)
+    if not os.path.isdir(dbdir):
+        os.makedirs(dbdir)
+    for name, trace in traces.items():
+        np.save(os.path.join(dbdir, name + '.npy'), trace)
+        # A complete file needs no record of its written draws; drop the
+        # one of a previous, interrupted run in the same directory.
+        rows = os.path.join(dbdir, name + '.rows')
+        if os.path.exists(rows):
+            os.remove(rows)
+    return dict((name, np.load(os.path.join(dbdir, name + '.npy'),
+                               mmap_mode='r'))
+                for name in traces)
+
+
+def merge_chains(traces):
+    '''Pool the draws of all chains.
+
+    :Arguments:
+        traces: dictionary of arrays with shape (chain, draw, ...), or a
+                single such array.
+
+    Returns arrays with shape (chain * draw, ...), the same layout as
+    'mcmc.trace(name)[:]', ready for 'normalize' and 'plot_post'.
+
+    '''
+    if isinstance(traces, dict):
+        return dict((name, merge_chains(trace))
+                    for name, trace in traces.items())
+    traces = np.asarray(traces)
+    return traces.reshape((-1,) + traces.shape[2:])
+
+
+def trace_columns(trace, diffs=()):
+    '''Split pooled traces into named 1-D samples, for summary tables.
+
+    :Arguments:
+        trace: dictionary with the (draw, ...) sample of each variable,
+               such as the result of 'merge_chains'.
+        diffs: sequence of pairs of scalar variables (a, b), whose
+               difference is added as 'a-b' (default: none).
+
+    Returns a list of (label, sample) pairs, sorted by variable name.
+    Vector variables get one sample per element, labelled 'a[0]',
+    'a[1]'..., and the differences come last.
+
+    '''
+    columns = []
+    for name in sorted(trace):
+        sample = np.asarray(trace[name])
+        if sample.ndim == 1:
+            columns.append((name, sample))
+        else:
+            flat = sample.reshape(len(sample), -1)
+            columns.extend(('%s[%i]' % (name, i), flat[:, i])
+                           for i in range(flat.shape[1]))
+    for a, b in diffs:
+        columns.append(('%s-%s' % (a, b),
+                        np.asarray(trace[a]) - np.asarray(trace[b])))
+    return columns
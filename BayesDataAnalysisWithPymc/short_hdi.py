@@ -5,6 +5,62 @@ by John K. Krushcke.
 More info: http://doingbayesiandataanalysis.blogspot.com.br/
 
 '''
+from __future__ import division
+
+import numpy as np
+
+
+def batch_hdi(samples, cred=(0.95,), chunk=None):
+    '''Calculate the shortest HDI of many parameters at many credible
+    masses at once.
+
+    :Arguments:
+        samples: array of posterior samples. A 1-D array is a single
+                parameter; a 2-D array has shape (draws, params).
+        cred: a float or a sequence of floats from 0.0 to 1.0.
+        chunk: number of parameters sorted at a time (default: None, all
+               of them). Use it with memory-mapped traces, so that only
+               'chunk' columns are loaded in memory at once.
+
+    Returns an array of shape (len(cred), params, 2) with the lower and
+    upper limits of each HDI. The sample is sorted only once, along the
+    draws axis, and every credible mass reuses that sort.
+
+    '''
+    samples = np.asarray(samples)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    creds = np.atleast_1d(cred)
+
+    if chunk is not None and chunk < samples.shape[1]:
+        hdi_lim = np.empty((len(creds), samples.shape[1], 2),
+                           dtype=samples.dtype)
+        for start in range(0, samples.shape[1], chunk):
+            hdi_lim[:, start:start + chunk] = batch_hdi(
+                samples[:, start:start + chunk], creds)
+        return hdi_lim
+
+    return sorted_hdi(np.sort(samples, axis=0), creds)
+
+
+def sorted_hdi(sorted_sample, cred=(0.95,)):
+    '''Same as 'batch_hdi', for a (draws, params) sample already sorted
+    along the draws axis.'''
+    sorted_sample = np.asarray(sorted_sample)
+    creds = np.atleast_1d(cred)
+    n_draws, n_params = sorted_sample.shape
+    columns = np.arange(n_params)
+
+    hdi_lim = np.empty((len(creds), n_params, 2), dtype=sorted_sample.dtype)
+    for k, mass in enumerate(creds):
+        ci_index = int(mass * n_draws)  # Uses 'int()' for R's 'floor()'
+        num_ci = n_draws - ci_index
+        ci_width = (sorted_sample[ci_index:ci_index + num_ci] -
+                    sorted_sample[:num_ci])
+        hdi_start = ci_width.argmin(axis=0)
+        hdi_lim[k, :, 0] = sorted_sample[hdi_start, columns]
+        hdi_lim[k, :, 1] = sorted_sample[hdi_start + ci_index, columns]
+    return hdi_lim
 
 
 def short_hdi(sample, cred=0.95):
@@ -21,16 +77,6 @@ def short_hdi(sample, cred=0.95):
     PyMC has a 95% HDI algorithm, but it uses quantiles.
 
     '''
-    sorted_sample = sorted(sample)
-    ci_index = int(cred * len(sorted_sample))  # Uses 'int()' for R's 'floor()'
-    num_ci = len(sorted_sample) - ci_index
-
-    ci_width = []
-    for i in range(num_ci):
-        width = sorted_sample[i + ci_index] - sorted_sample[i]
-        ci_width.append(width)
-
-    hdi_min = sorted_sample[ci_width.index(min(ci_width))]
-    hdi_max = sorted_sample[ci_width.index(min(ci_width)) + ci_index]
+    hdi_min, hdi_max = batch_hdi(np.ravel(sample), cred)[0, 0]
     hdi_lim = (hdi_min, hdi_max)
     return hdi_lim
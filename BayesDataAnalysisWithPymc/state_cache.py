@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+'''Persistent cache of sampler states, for warm-starting the chains.
+After a fit, the values of the stochastics and the tuned proposal scales
+of the step methods of every chain are saved to disk, keyed by the
+model, its prior settings and a hash of its data. The next fit of the
+same model and data, or of the same data with rows appended, starts
+from them instead of the MAP estimate and needs a much shorter burn-in.
+
+Usage:
+    cache = StateCache()
+    trace = fit(model, warm_start=cache)
+
+'''
+from __future__ import division
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+
+def default_directory():
+    '''Cache directory used when none is given.'''
+    return os.path.join(os.path.expanduser('~'), '.cache',
+                        'BayesDataAnalysisWithPymc', 'states')
+
+
+def _leaves(data):
+    '''Flatten the data of a model into a list of arrays. Sequences of
+    scalars are arrays; other sequences are flattened recursively.'''
+    if isinstance(data, (list, tuple)) and \
+            any(np.ndim(item) > 0 for item in data):
+        return [leaf for item in data for leaf in _leaves(item)]
+    return [np.asarray(data, dtype=float)]
+
+
+def _hash(array):
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def fingerprint(data):
+    '''Length (None for scalars) and hash of every array of the data.'''
+    leaves = _leaves(data)
+    return ([len(leaf) if leaf.ndim else None for leaf in leaves],
+            [_hash(leaf) for leaf in leaves])
+
+
+class StateCache(object):
+    '''On-disk cache of the chain states of fitted models.
+
+    :Arguments:
+        directory: where the states are saved (default: a directory in
+                   '~/.cache').
+
+    States are looked up by the 'recipe' that every 'build_model'
+    attaches to its model: the build function, the data and the priors.
+    Every model directory has an index of the data lengths and hashes of
+    its entries, so a lookup unpickles at most one entry.
+
+    '''
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_directory()
+
+    def _model_dir(self, recipe):
+        build, _, priors = recipe
+        priors_hash = hashlib.sha1(
+            repr(sorted(priors.items())).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.%s-%s' % (
+            build.__module__, build.__name__, priors_hash[:16]))
+
+    def _path(self, model_dir, hashes):
+        return os.path.join(model_dir, _hash(np.array(hashes)) + '.pkl')
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as source:
+                return pickle.load(source)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _index_path(self, model_dir):
+        return os.path.join(model_dir, 'index.json')
+
+    def _index(self, model_dir):
+        '''Lengths and hashes of the data of every entry of 'model_dir',
+        by file name. A missing index is rebuilt from the entries.'''
+        try:
+            with open(self._index_path(model_dir)) as source:
+                return json.load(source)
+        except (IOError, OSError, ValueError):
+            pass
+        if not os.path.isdir(model_dir):
+            return {}
+        index = {}
+        for name in os.listdir(model_dir):
+            if name.endswith('.pkl'):
+                entry = self._load(os.path.join(model_dir, name))
+                if entry is not None:
+                    index[name] = dict(lengths=entry['lengths'],
+                                       hashes=entry['hashes'])
+        self._write_index(model_dir, index)
+        return index
+
+    def _write_index(self, model_dir, index):
+        path = self._index_path(model_dir)
+        temp = path + '.%i.tmp' % os.getpid()
+        with open(temp, 'w') as output:
+            json.dump(index, output)
+        os.rename(temp, path)
+
+    def lookup(self, recipe):
+        '''Find the cached states of the model of 'recipe'.
+
+        Returns a tuple (states, exact). 'states' is the list of saved
+        chain states, or None on a miss. 'exact' is True when the data
+        are the same, and False for a near hit: a previous fit of a
+        prefix of the data, such as before new rows were appended.
+
+        '''
+        _, (data,), _ = recipe
+        lengths, hashes = fingerprint(data)
+        model_dir = self._model_dir(recipe)
+        entry = self._load(self._path(model_dir, hashes))
+        if entry is not None and entry['hashes'] == hashes:
+            return entry['states'], True
+
+        # Near hits are searched in the index, so only the chosen entry
+        # is unpickled.
+        leaves = _leaves(data)
+        best, best_size = None, -1
+        for name, entry in self._index(model_dir).items():
+            if len(entry['lengths']) != len(lengths):
+                continue
+            prefix = True
+            for leaf, length, hash_ in zip(leaves, entry['lengths'],
+                                           entry['hashes']):
+                if length is None or leaf.ndim == 0:
+                    prefix = length is None and leaf.ndim == 0 and \
+                        hash_ == _hash(leaf)
+                elif length == len(leaf):
+                    prefix = hash_ == _hash(leaf)
+                else:
+                    prefix = length < len(leaf) and \
+                        hash_ == _hash(leaf[:length])
+                if not prefix:
+                    break
+            size = sum(length or 0 for length in entry['lengths'])
+            if prefix and size > best_size:
+                best, best_size = name, size
+        if best is None:
+            return None, False
+        entry = self._load(os.path.join(model_dir, best))
+        if entry is None:
+            return None, False
+        return entry['states'], False
+
+    def store(self, recipe, states):
+        '''Save the chain states of the model of 'recipe'.'''
+        _, (data,), _ = recipe
+        lengths, hashes = fingerprint(data)
+        model_dir = self._model_dir(recipe)
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+        path = self._path(model_dir, hashes)
+        temp = path + '.%i.tmp' % os.getpid()
+        with open(temp, 'wb') as output:
+            pickle.dump(dict(lengths=lengths, hashes=hashes, states=states),
+                        output, protocol=2)
+        os.rename(temp, path)
+        index = self._index(model_dir)
+        index[os.path.basename(path)] = dict(lengths=lengths, hashes=hashes)
+        self._write_index(model_dir, index)
+
+    def clear(self):
+        '''Delete every cached state.'''
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+'''Stochastic variational inference (SVI) for the densities in
+'densities', for data too large for MCMC.
+A normal distribution with diagonal covariance on the unconstrained
+parameters is fitted by maximizing the evidence lower bound (ELBO) with
+stochastic gradients: every step uses one minibatch of the data, whose
+likelihood is scaled up to the whole data, and reparameterized draws of
+the approximation. The data are read a chunk at a time, so they can be
+streamed from memory-mapped columns on disk. The steps are taken by
+Adam, and the result averages the iterates of the last steps.
+The approximation is then sampled into traces with the same names and
+layout as the MCMC ones.
+
+References:
+    Hoffman, M. D., Blei, D. M., Wang, C. and Paisley, J. (2013).
+    Stochastic Variational Inference. JMLR 14.
+    Kucukelbir, A., Tran, D., Ranganath, R., Gelman, A. and Blei, D. M.
+    (2017). Automatic Differentiation Variational Inference. JMLR 18.
+
+'''
+from __future__ import division
+
+import numpy as np
+
+
+def chunks(columns, chunk=100000):
+    '''Yield tuples with 'chunk' rows of each array of 'columns', such as
+    memory-mapped data columns, which are read one chunk at a time.'''
+    size = len(columns[0])
+    for start in range(0, size, chunk):
+        yield tuple(np.asarray(column[start:start + chunk])
+                    for column in columns)
+
+
+def minibatches(stream, batch, rng):
+    '''Endless minibatches of the chunks of 'stream', a function
+    returning a new iterator over the chunks at every pass. The rows of
+    every chunk are shuffled before it is split.'''
+    while True:
+        empty = True
+        for chunk in stream():
+            order = rng.permutation(len(chunk[0]))
+            for start in range(0, len(order), batch):
+                rows = order[start:start + batch]
+                empty = False
+                yield tuple(column[rows] for column in chunk)
+        if empty:
+            raise ValueError('the data stream is empty')
+
+
+class _Adam(object):
+    '''Adam update of a parameter vector, for gradient ascent.'''
+
+    def __init__(self, size, learning_rate, beta1=0.9, beta2=0.999,
+                 eps=1e-8):
+        self.learning_rate = learning_rate
+        self.beta1, self.beta2, self.eps = beta1, beta2, eps
+        self.m = np.zeros(size)
+        self.v = np.zeros(size)
+        self.count = 0
+
+    def step(self, grad):
+        self.count += 1
+        self.m = self.beta1 * self.m + (1 - self.beta1) * grad
+        self.v = self.beta2 * self.v + (1 - self.beta2) * grad**2
+        m_hat = self.m / (1 - self.beta1**self.count)
+        v_hat = self.v / (1 - self.beta2**self.count)
+        return self.learning_rate * m_hat / (np.sqrt(v_hat) + self.eps)
+
+
+class MeanField(object):
+    '''Normal approximation, with diagonal covariance, of a density on
+    its unconstrained parameters.
+
+    :Arguments:
+        mean: mean of every parameter.
+        log_sd: log of the SD of every parameter.
+
+    'history' has the ELBO estimates of the fit, every 100 steps.
+
+    '''
+
+    def __init__(self, mean, log_sd):
+        self.mean = np.asarray(mean, dtype=float)
+        self.log_sd = np.asarray(log_sd, dtype=float)
+        self.history = []
+
+    @property
+    def sd(self):
+        return np.exp(self.log_sd)
+
+    def sample(self, size, rng):
+        '''Array of shape (size, parameters) of unconstrained draws.'''
+        return self.mean + self.sd * rng.standard_normal((size,
+                                                          len(self.mean)))
+
+
+def fit(density, stream, size, iter=20000, batch=1000, samples=1,
+        learning_rate=0.01, average=0.5, seed=None):
+    '''Fit a 'MeanField' approximation to a density by SVI.
+
+    :Arguments:
+        density: density object whose 'logp_grad(q, zx, zy, scale)' takes
+                 a minibatch of data, such as 'RegressionDensity'.
+        stream: function returning a new iterator over chunks of the
+                (normalized) data at every pass, such as
+                'lambda: chunks((zx, zy))'.
+        size: total number of rows of the data.
+        iter: number of stochastic gradient steps.
+        batch: rows per minibatch.
+        samples: draws of the approximation per step.
+        learning_rate: step size of Adam.
+        average: fraction of the last steps whose iterates are averaged
+                 into the result (default: 0.5), which removes most of
+                 the noise of the minibatches.
+        seed: seed of the random number generator.
+
+    Returns the 'MeanField' approximation.
+
+    '''
+    rng = np.random.RandomState(seed)
+    params = np.concatenate((density.initial(rng),
+                             np.full(density.size, -1.0)))
+    adam = _Adam(len(params), learning_rate)
+    start_average = int(iter * (1 - average))
+    total = np.zeros_like(params)
+    history = []
+    elbo = 0.0
+
+    data = minibatches(stream, batch, rng)
+    with np.errstate(over='ignore'):
+        for i in range(iter):
+            mean, log_sd = params[:density.size], params[density.size:]
+            sd = np.exp(log_sd)
+            minibatch = next(data)
+            scale = size / len(minibatch[0])
+
+            grad = np.zeros_like(params)
+            for _ in range(samples):
+                eps = rng.standard_normal(density.size)
+                logp, g = density.logp_grad(mean + sd * eps, *minibatch,
+                                            scale=scale)
+                grad[:density.size] += g
+                grad[density.size:] += g * eps * sd
+                elbo += logp
+            # The entropy of the normal adds 1 to every log SD gradient.
+            grad = grad / samples
+            grad[density.size:] += 1
+            elbo += samples * np.sum(log_sd)
+
+            params = params + adam.step(grad)
+            if i >= start_average:
+                total += params
+            if (i + 1) % 100 == 0:
+                history.append(elbo / (100 * samples))
+                elbo = 0.0
+
+    params = total / (iter - start_average)
+    approx = MeanField(params[:density.size], params[density.size:])
+    approx.history = history
+    return approx
+
+
+def sample_traces(density, approx, draws=10000, chains=1, seed=None):
+    '''Independent draws of the approximation, shaped as the named,
+    constrained (chain, draw) traces of 'hmc.fit'.'''
+    rng = np.random.RandomState(seed)
+    values = [density.constrain(q)
+              for q in approx.sample(chains * draws, rng)]
+    return dict((name, np.array([v[name] for v in values]).reshape(
+        (chains, draws) + np.shape(values[0][name])))
+        for name in density.names)
+
+
+def compare(approx_trace, mcmc_trace):
+    '''Compare the draws of an approximation with those of MCMC.
+
+    Returns a dictionary with, for every variable, the means and SDs of
+    both samples, 'z', the difference of the means in MCMC SDs, and
+    'sd_ratio', the SD of the approximation over that of MCMC. Mean-field
+    approximations tend to understate the SDs (sd_ratio < 1).
+
+    '''
+    report = {}
+    for name in sorted(mcmc_trace):
+        approx_sample = np.ravel(approx_trace[name])
+        mcmc_sample = np.ravel(mcmc_trace[name])
+        mcmc_sd = mcmc_sample.std()
+        report[name] = dict(approx_mean=float(approx_sample.mean()),
+                            mcmc_mean=float(mcmc_sample.mean()),
+                            approx_sd=float(approx_sample.std()),
+                            mcmc_sd=float(mcmc_sd),
+                            z=float((approx_sample.mean() -
+                                     mcmc_sample.mean()) / mcmc_sd),
+                            sd_ratio=float(approx_sample.std() / mcmc_sd))
+    return report
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''Tests of the summary rows and tables of 'batch'.'''
+from __future__ import division
+
+import csv
+import os
+
+import numpy as np
+
+from batch import summary_row, write_table
+from posterior_store import PosteriorStore
+
+
+def _trace():
+    rng = np.random.RandomState(0)
+    return dict(theta1=rng.beta(3, 5, 5000), theta2=rng.beta(5, 3, 5000),
+                a=rng.normal(size=(5000, 2)))
+
+
+def test_summary_row_and_store_share_the_columns():
+    trace = _trace()
+    diffs = [('theta2', 'theta1')]
+    row = summary_row(trace, diffs=diffs)
+    store = PosteriorStore(trace, diffs=diffs)
+    assert sorted(key[:-len('_mean')] for key in row
+                  if key.endswith('_mean')) == store.names
+    for name in store.names:
+        assert np.isclose(row[name + '_mean'],
+                          store.quantile(name, 0.5), atol=0.1)
+    diff = trace['theta2'] - trace['theta1']
+    assert np.isclose(row['P(theta2-theta1>0)'], np.mean(diff > 0))
+    assert np.isclose(row['P(theta2-theta1>0)'],
+                      store.more('theta2-theta1', 0.0))
+
+
+def test_write_table_streams_rows(tmpdir):
+    path = os.path.join(str(tmpdir), 'table.csv')
+    rows = iter([dict(key='bad', error='ValueError: no data'),
+                 dict(key='a', m=1.0), dict(key='b', m=2.0)])
+    assert write_table(rows, path) == 3
+    with open(path) as source:
+        table = list(csv.DictReader(source))
+    assert [r['key'] for r in table] == ['bad', 'a', 'b']
+    assert table[0]['error'] == 'ValueError: no data'
+    assert table[2]['m'] == '2.0'
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''Tests of the binary cache of 'data_loader'.'''
+from __future__ import division
+
+import os
+import shutil
+
+import numpy as np
+
+from data_loader import load_columns
+
+
+def _write(path, values):
+    with open(path, 'w') as output:
+        output.write('Group,Size\n')
+        for group, size in values:
+            output.write('%i,%r\n' % (group, size))
+
+
+def test_cached_columns_match_the_source(tmpdir):
+    path = os.path.join(str(tmpdir), 'data.csv')
+    _write(path, [(1, 2.5), (2, 3.5), (2, 4.0)])
+    for _ in range(2):
+        data = load_columns(path, ('Group', 'Size'), dtypes={'Group': int})
+        assert np.array_equal(data['Group'], [1, 2, 2])
+        assert np.allclose(data['Size'], [2.5, 3.5, 4.0])
+    assert os.path.isdir(path + '.npycache')
+
+
+def test_same_name_and_time_in_another_directory(tmpdir):
+    first = os.path.join(str(tmpdir), 'a', 'data.csv')
+    second = os.path.join(str(tmpdir), 'b', 'data.csv')
+    os.makedirs(os.path.dirname(first))
+    os.makedirs(os.path.dirname(second))
+    _write(first, [(1, 2.5), (2, 3.5)])
+    _write(second, [(1, 7.5), (2, 8.5)])
+    stat = os.stat(first)
+    os.utime(second, (stat.st_atime, stat.st_mtime))
+
+    assert np.allclose(load_columns(first, ('Size',))['Size'], [2.5, 3.5])
+    # A cache copied along with a file of the same name, size and time
+    # belongs to another source, and is rebuilt.
+    shutil.copytree(first + '.npycache', second + '.npycache')
+    assert np.allclose(load_columns(second, ('Size',))['Size'], [7.5, 8.5])
+    assert np.allclose(load_columns(first, ('Size',))['Size'], [2.5, 3.5])
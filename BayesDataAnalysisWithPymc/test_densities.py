@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''Tests of the analytic gradients of 'densities' against finite
+differences.'''
+from __future__ import division
+
+from math import lgamma
+
+import numpy as np
+import pytest
+
+from densities import digamma, RegressionDensity, AnovaDensity
+
+
+def _numeric_grad(f, q, h=1e-6):
+    '''Central finite differences of the scalar function 'f' at 'q'.'''
+    grad = np.empty(len(q))
+    for i in range(len(q)):
+        step = np.zeros(len(q))
+        step[i] = h
+        grad[i] = (f(q + step) - f(q - step)) / (2 * h)
+    return grad
+
+
+def _regression():
+    rng = np.random.RandomState(0)
+    zx = rng.normal(size=200)
+    zy = 0.6 * zx + 0.5 * rng.standard_t(4, size=200)
+    return RegressionDensity(zx, zy)
+
+
+@pytest.mark.parametrize('x', [0.3, 1.0, 2.5, 6.0, 40.0])
+def test_digamma_is_derivative_of_lgamma(x):
+    h = 1e-5
+    assert np.isclose(digamma(x), (lgamma(x + h) - lgamma(x - h)) / (2 * h),
+                      rtol=1e-6)
+
+
+def test_regression_gradient():
+    density = _regression()
+    rng = np.random.RandomState(1)
+    for _ in range(5):
+        q = density.initial(rng) + rng.normal(scale=0.5, size=4)
+        _, grad = density.logp_grad(q)
+        numeric = _numeric_grad(lambda p: density.logp_grad(p)[0], q)
+        assert np.allclose(grad, numeric, rtol=1e-5, atol=1e-5)
+
+
+def test_regression_minibatch_gradient():
+    density = _regression()
+    zx, zy = density.zx[:50], density.zy[:50]
+    q = np.array([0.1, 0.5, 0.3, -0.2])
+    _, grad = density.logp_grad(q, zx, zy, scale=4.0)
+    numeric = _numeric_grad(
+        lambda p: density.logp_grad(p, zx, zy, scale=4.0)[0], q)
+    assert np.allclose(grad, numeric, rtol=1e-5, atol=1e-5)
+
+
+def test_regression_full_minibatch_is_the_full_density():
+    density = _regression()
+    q = np.array([0.1, 0.5, 0.3, -0.2])
+    logp, grad = density.logp_grad(q)
+    batch_logp, batch_grad = density.logp_grad(q, density.zx, density.zy)
+    assert np.isclose(logp, batch_logp)
+    assert np.allclose(grad, batch_grad)
+
+
+def test_anova_gradient():
+    rng = np.random.RandomState(0)
+    idx = rng.randint(0, 4, size=100)
+    zy = rng.normal(size=100) + 0.5 * idx
+    density = AnovaDensity(idx, zy, 4)
+    for _ in range(5):
+        q = density.initial(rng)
+        _, grad = density.logp_grad(q)
+        numeric = _numeric_grad(lambda p: density.logp_grad(p)[0], q)
+        assert np.allclose(grad, numeric, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''Tests of the model handles of 'model_cache': models of different data
+with the same shape share a cached graph, but each fit uses its own
+data.'''
+from __future__ import division
+
+import numpy as np
+
+import SimpleLinearRegressionPyMC as regression
+from model_cache import ModelCache, LazyModel, model_key, graph
+
+
+class _Graph(object):
+    '''Stand-in of a PyMC model, holding its observed data.'''
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _handle(cache, data):
+    def build():
+        return _Graph(data)
+
+    def set_data(model):
+        model.data = data
+
+    return LazyModel(('build', (data,), {}),
+                     lambda: cache.get(model_key([data], {}), build,
+                                       set_data))
+
+
+def test_handles_bind_their_own_data_to_the_shared_graph():
+    cache = ModelCache()
+    d1, d2 = np.zeros(5), np.ones(5)
+    m1, m2 = _handle(cache, d1), _handle(cache, d2)
+    assert m1 is not m2
+
+    # Both graphs are the same cached object, bound to the data of the
+    # handle asking for it.
+    g1 = graph(m1)
+    g2 = graph(m2)
+    assert g1 is g2
+    assert len(cache) == 1
+    assert graph(m1).data is d1
+    assert graph(m2).data is d2
+    assert graph(m1).recipe == m1.recipe
+
+
+def _line(intercept, slope, seed):
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(0, 10, 100)
+    return x, intercept + slope * x + rng.normal(0, 1, 100)
+
+
+def test_same_shape_models_fit_their_own_data():
+    d1, d2 = _line(5.0, 2.0, 0), _line(-30.0, -1.0, 1)
+    m1 = regression.build_model(d1)
+    m2 = regression.build_model(d2)
+    assert m1 is not m2
+    assert np.isclose(m1.scaling.mean('y'), np.mean(d1[1]))
+    assert np.isclose(m2.scaling.mean('y'), np.mean(d2[1]))
+
+    for model, (intercept, slope) in ((m1, (5.0, 2.0)), (m2, (-30.0, -1.0))):
+        trace = regression.fit(model, iter=600, burn=300, thin=1, seed=0,
+                               sampler='nuts')
+        b0 = model.scaling.intercept(trace['b0'], trace['b1'])
+        b1 = model.scaling.slope(trace['b1'])
+        assert abs(np.mean(b0) - intercept) < 1.0
+        assert abs(np.mean(b1) - slope) < 0.2
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''Tests of the scale conversions of 'normalize'.'''
+from __future__ import division
+
+import numpy as np
+
+import normalize
+from normalize import Standardizer
+
+
+def _data():
+    rng = np.random.RandomState(0)
+    return rng.normal(3.0, 2.0, 100), rng.normal(-1.0, 5.0, 100)
+
+
+def test_parameter_maps_round_trip():
+    x, y = _data()
+    scaling = Standardizer(x=x, y=y)
+    rng = np.random.RandomState(1)
+    z0, z1, zsigma = rng.normal(size=(3, 10))
+    ztau = rng.gamma(2.0, size=10)
+
+    b1 = scaling.slope(z1)
+    assert np.allclose(scaling.z_slope(b1), z1)
+    assert np.allclose(scaling.z_intercept(scaling.intercept(z0, z1), b1),
+                       z0)
+    assert np.allclose(scaling.z_tau(scaling.tau_sigma(ztau)), ztau)
+    assert np.allclose(scaling.z_sigma(scaling.sigma(zsigma)), zsigma)
+
+    a0 = rng.normal(size=10)
+    a = rng.normal(size=(10, 4))
+    a -= a.mean(axis=1)[:, np.newaxis]
+    za0, za = scaling.z_anova(*scaling.anova(a0, a))
+    assert np.allclose(za0, a0)
+    assert np.allclose(za, a)
+
+
+def test_convert_functions_see_data_modified_in_place():
+    _, y = _data()
+    zsigma = np.ones(3)
+    before = normalize.convert_sigma(y, zsigma)
+    y *= 3
+    after = normalize.convert_sigma(y, zsigma)
+    assert np.allclose(after, 3 * before)
+    assert np.allclose(after, y.std())
+
+
+def test_convert_functions_match_standardizer():
+    x, y = _data()
+    scaling = Standardizer(x=x, y=y)
+    z0, z1 = np.random.RandomState(2).normal(size=(2, 10))
+    assert np.allclose(normalize.convert_slope(x, y, z1), scaling.slope(z1))
+    assert np.allclose(normalize.convert_intercept(x, y, z0, z1),
+                       scaling.intercept(z0, z1))
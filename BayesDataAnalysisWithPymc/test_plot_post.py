@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''Tests of the precomputed statistics of 'plot_post'.'''
+from __future__ import division
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+
+import matplotlib
+matplotlib.use('Agg')
+
+from plot_post import plot_post, post_stats, render_panels
+
+
+def _sample():
+    return np.random.RandomState(0).normal(0.5, 1.0, size=2000)
+
+
+def test_stats_without_tails_and_comp_raise():
+    with pytest.raises(ValueError):
+        plot_post(None, comp=0.0, stats=post_stats(_sample()))
+
+
+def test_render_panels_checks_tails_before_the_workers(tmpdir):
+    panel = dict(path=os.path.join(str(tmpdir), 'a.png'),
+                 stats=post_stats(_sample()), comp=0.0)
+    with pytest.raises(ValueError):
+        render_panels([panel], max_workers=1)
+
+
+def test_render_panels_with_tails(tmpdir):
+    sample = _sample()
+    paths = [os.path.join(str(tmpdir), name) for name in ('a.png', 'b.png')]
+    panels = [dict(path=paths[0], stats=post_stats(sample, comp=0.0),
+                   comp=0.0),
+              dict(path=paths[1], stats=post_stats(sample), sample=sample,
+                   comp=0.0)]
+    assert render_panels(panels, max_workers=1) == paths
+    assert all(os.path.getsize(path) > 0 for path in paths)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''Tests of the queries of 'posterior_store'.'''
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from posterior_store import PosteriorStore
+from short_hdi import short_hdi
+
+
+def _store():
+    rng = np.random.RandomState(0)
+    trace = dict(a=rng.normal(size=20001), b=rng.gamma(2.0, size=20001))
+    return trace, PosteriorStore(trace, diffs=[('a', 'b')])
+
+
+def test_quantile_matches_percentile():
+    trace, store = _store()
+    p = np.array([0.0, 0.025, 0.5, 0.9, 1.0])
+    assert np.allclose(store.quantile('a', p),
+                       np.percentile(trace['a'], 100 * p))
+
+
+def test_tail_probabilities():
+    trace, store = _store()
+    diff = trace['a'] - trace['b']
+    assert np.isclose(store.more('a-b', 0.0), np.mean(diff > 0))
+    assert np.isclose(store.less('a-b', 0.0), np.mean(diff < 0))
+    assert np.isclose(store.cdf('b', 1.5), np.mean(trace['b'] <= 1.5))
+
+
+def test_hdi_on_and_off_grid():
+    trace, store = _store()
+    for cred in (0.9, 0.95, 0.955):
+        assert np.allclose(store.hdi('b', cred), short_hdi(trace['b'], cred))
+
+
+def test_saved_store_answers_the_same(tmpdir):
+    _, store = _store()
+    store.save(str(tmpdir))
+    loaded = PosteriorStore.load(str(tmpdir))
+    assert loaded.names == store.names
+    assert np.allclose(loaded.quantile('a-b', 0.3),
+                       store.quantile('a-b', 0.3))
+    assert np.allclose(loaded.hdi('a', 0.8), store.hdi('a', 0.8))
+
+
+@pytest.mark.parametrize('p', [-0.5, 1.5, [0.5, 2.0], float('nan')])
+def test_quantile_rejects_probabilities_out_of_bounds(p):
+    _, store = _store()
+    with pytest.raises(ValueError):
+        store.quantile('a', p)
+
+
+@pytest.mark.parametrize('cred', [0.0, 1.0, 1.5, -0.1])
+def test_hdi_rejects_masses_out_of_bounds(cred):
+    _, store = _store()
+    with pytest.raises(ValueError):
+        store.hdi('a', cred)
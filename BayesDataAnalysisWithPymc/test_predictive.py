@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''Tests of the posterior predictive draws of 'predictive' on fixed
+traces, whose predictive distribution is known.'''
+from __future__ import division
+
+import numpy as np
+
+from predictive import (regression_predictive, regression_interval,
+                        anova_predictive)
+
+DRAWS = 40000
+
+
+def _fixed(value):
+    return np.full(DRAWS, value, dtype=float)
+
+
+def test_regression_t_noise_mean_and_spread():
+    x_new = np.array([0.0, 1.0, 3.0])
+    draws = regression_predictive(_fixed(1.0), _fixed(2.0), _fixed(0.5),
+                                  _fixed(5.0), x_new, chunk=2, seed=0)
+    assert draws.shape == (DRAWS, 3)
+    assert np.allclose(draws.mean(axis=0), 1.0 + 2.0 * x_new, atol=0.02)
+    # SD of a Student's t with 5 DoF, scaled by 0.5.
+    assert np.allclose(draws.std(axis=0), 0.5 * np.sqrt(5 / 3), rtol=0.05)
+
+
+def test_regression_lines_without_noise():
+    rng = np.random.RandomState(0)
+    b0, b1 = rng.normal(size=(2, 100))
+    x_new = np.linspace(-1, 1, 7)
+    lines = regression_predictive(b0, b1, None, None, x_new, noise=False)
+    assert np.allclose(lines, b0[:, np.newaxis] + np.outer(b1, x_new))
+
+
+def test_regression_interval_of_normal_noise():
+    hdi = regression_interval(_fixed(1.0), _fixed(0.0), _fixed(2.0), None,
+                              [0.0, 5.0], cred=0.95, seed=0)
+    assert hdi.shape == (2, 2)
+    assert np.allclose(hdi, [[1 - 1.96 * 2, 1 + 1.96 * 2]] * 2, atol=0.1)
+
+
+def test_anova_draws_per_group():
+    b = np.tile([1.0, -1.0, 0.0], (DRAWS, 1))
+    groups = np.array([1, 2, 3, 1])
+    draws = anova_predictive(_fixed(10.0), b, _fixed(1.5), groups, seed=0)
+    assert draws.shape == (DRAWS, 4)
+    assert np.allclose(draws.mean(axis=0), [11.0, 9.0, 10.0, 11.0],
+                       atol=0.03)
+    assert np.allclose(draws.std(axis=0), 1.5, rtol=0.03)
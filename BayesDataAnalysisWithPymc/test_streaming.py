@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+'''Tests of 'BernTwoPyMC.StreamingModel' against the exact conjugate
+Beta posterior of all the outcomes.'''
+from __future__ import division
+
+import numpy as np
+
+from BernTwoPyMC import StreamingModel
+from conjugate import beta_posterior, beta_hdi
+
+
+class _BetaPrior(object):
+    '''The Beta(3, 3) priors, given as a general prior of the particles.'''
+
+    def draws(self, size, rng):
+        return rng.beta(3.0, 3.0, size), rng.beta(3.0, 3.0, size)
+
+    def logp(self, theta1, theta2):
+        return 2 * (np.log(theta1) + np.log1p(-theta1) +
+                    np.log(theta2) + np.log1p(-theta2))
+
+
+def _batches(count=20, size=50, seed=0):
+    rng = np.random.RandomState(seed)
+    return [((rng.uniform(size=size) < 0.3).astype(int),
+             (rng.uniform(size=size) < 0.6).astype(int))
+            for _ in range(count)]
+
+
+def _exact(batches):
+    return [beta_posterior(np.concatenate([b[g] for b in batches]), 3.0, 3.0)
+            for g in (0, 1)]
+
+
+def test_beta_stream_is_the_conjugate_posterior():
+    batches = _batches()
+    stream = StreamingModel(3.0, 3.0, seed=0)
+    for outcomes1, outcomes2 in batches:
+        stream.update(outcomes1, outcomes2)
+    assert np.allclose(stream.posterior(), _exact(batches))
+    row = stream.summary(size=1000)
+    assert row['n1'] == row['n2'] == 1000
+    for name, (a, b) in zip(('theta1', 'theta2'), _exact(batches)):
+        assert np.isclose(row[name + '_mean'], a / (a + b))
+        assert np.allclose((row[name + '_hdi_low'], row[name + '_hdi_high']),
+                           beta_hdi(a, b))
+
+
+def test_particles_match_the_conjugate_posterior():
+    batches = _batches()
+    stream = StreamingModel(prior=_BetaPrior(), particles=20000, seed=1)
+    resampled = 0
+    for outcomes1, outcomes2 in batches:
+        before = stream.theta
+        stream.update(outcomes1, outcomes2)
+        resampled += stream.theta is not before
+    # The weights degenerate as the data grow: the particles must have
+    # been resampled and moved, not only reweighted.
+    assert resampled > 0
+
+    row = stream.summary(size=100000)
+    for name, (a, b) in zip(('theta1', 'theta2'), _exact(batches)):
+        assert abs(row[name + '_mean'] - a / (a + b)) < 0.005
+        low, high = beta_hdi(a, b)
+        assert abs(row[name + '_hdi_low'] - low) < 0.01
+        assert abs(row[name + '_hdi_high'] - high) < 0.01
+    assert row['P(theta2-theta1>0)'] > 0.99
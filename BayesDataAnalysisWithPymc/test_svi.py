@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+'''Tests of the SVI approximation of 'svi' against NUTS.'''
+from __future__ import division
+
+import numpy as np
+import pytest
+
+import hmc
+import svi
+from densities import RegressionDensity
+
+
+def _data(n=2000):
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=n)
+    y = 0.6 * x + 0.5 * rng.standard_t(5, size=n)
+    return (x - x.mean()) / x.std(), (y - y.mean()) / y.std()
+
+
+def test_minibatches_cover_every_row():
+    rng = np.random.RandomState(0)
+    column = np.arange(250)
+    batches = svi.minibatches(lambda: svi.chunks((column,), chunk=100), 30,
+                              rng)
+    # One pass: 4 + 4 + 2 batches of the chunks of 100, 100 and 50 rows.
+    rows = np.concatenate([next(batches)[0] for _ in range(10)])
+    assert np.array_equal(np.sort(rows), column)
+
+
+def test_empty_stream_raises():
+    batches = svi.minibatches(lambda: iter([]), 10, np.random.RandomState(0))
+    with pytest.raises(ValueError):
+        next(batches)
+
+
+def test_svi_matches_nuts():
+    zx, zy = _data()
+    density = RegressionDensity(zx, zy)
+    mcmc = hmc.fit(density, iter=1500, burn=500, seed=1)
+    approx = svi.fit(density, lambda: svi.chunks((zx, zy), chunk=1000),
+                     len(zx), iter=10000, batch=200, seed=2)
+    report = svi.compare(svi.sample_traces(density, approx, draws=4000,
+                                           seed=3), mcmc)
+    for name in density.names:
+        assert abs(report[name]['z']) < 0.25
+        assert 0.5 < report[name]['sd_ratio'] < 1.5
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''Tests of the round trip of traces through 'trace_archive'.'''
+from __future__ import division
+
+import os
+
+import numpy as np
+import pytest
+
+from trace_archive import write_archive, TraceArchive
+
+
+def _traces():
+    rng = np.random.RandomState(0)
+    return dict(b0=rng.normal(10.0, 2.0, size=(2, 2500)),
+                b=rng.normal(size=(2, 2500, 3)),
+                tdf=rng.gamma(2.0, 10.0, size=(2, 2500)))
+
+
+def test_raw_round_trip(tmpdir):
+    traces = _traces()
+    path = os.path.join(str(tmpdir), 'fit.zip')
+    write_archive(path, traces, chunk=1000, info=dict(model='test'))
+    with TraceArchive(path) as archive:
+        assert archive.names == sorted(traces)
+        assert archive.info == dict(model='test')
+        for name, trace in traces.items():
+            read = archive.read(name)
+            assert read.dtype == trace.dtype
+            assert np.array_equal(read, trace)
+
+
+def test_quantized_and_float32_within_tolerance(tmpdir):
+    traces = _traces()
+    path = os.path.join(str(tmpdir), 'fit.zip')
+    write_archive(path, traces, dtype='float32',
+                  tolerance=dict(tdf=0.01, b0=0.001), chunk=1000)
+    with TraceArchive(path) as archive:
+        read = archive.read_traces()
+    assert np.max(np.abs(read['tdf'] - traces['tdf'])) <= 0.01 + 1e-9
+    assert np.max(np.abs(read['b0'] - traces['b0'])) <= 0.001 + 1e-9
+    assert read['b'].dtype == np.float32
+    assert np.allclose(read['b'], traces['b'], rtol=1e-6, atol=1e-6)
+
+
+def test_partial_reads(tmpdir):
+    traces = _traces()
+    path = os.path.join(str(tmpdir), 'fit.zip')
+    write_archive(path, traces, chunk=1000)
+    with TraceArchive(path) as archive:
+        assert np.array_equal(archive.read('b', draws=slice(900, 2100)),
+                              traces['b'][:, 900:2100])
+        assert np.array_equal(archive.read('b0', draws=slice(5, 50, 5),
+                                           chains=1),
+                              traces['b0'][1, 5:50:5])
+        assert archive.read('tdf', draws=slice(10, 10)).shape == (2, 0)
+
+
+@pytest.mark.parametrize('tolerance', [0, -0.1])
+def test_rejects_tolerance_not_positive(tmpdir, tolerance):
+    path = os.path.join(str(tmpdir), 'fit.zip')
+    with pytest.raises(ValueError):
+        write_archive(path, _traces(), tolerance=tolerance)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''Tests of the record of written draws of the 'trace_store' files.'''
+from __future__ import division
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pymc')
+
+from trace_store import (MemmapDatabase, MemmapTrace, open_traces,
+                         stack_chains)
+
+
+def _trace(directory, length):
+    db = MemmapDatabase(directory, chunk=10)
+    db.chains = 1
+    values = iter(range(10**6))
+    trace = MemmapTrace('x', getfunc=lambda: float(next(values)), db=db)
+    db._traces = dict(x=trace)
+    trace._initialize(0, length)
+    return db, trace
+
+
+def test_interrupted_trace_raises(tmpdir):
+    _, trace = _trace(str(tmpdir), 100)
+    for _ in range(35):
+        trace.tally(0)
+    with pytest.raises(ValueError):
+        open_traces(os.path.join(str(tmpdir), 'chain0'), ['x'])
+
+
+def test_halted_trace_reads_only_written_draws(tmpdir):
+    db, trace = _trace(str(tmpdir), 100)
+    for _ in range(35):
+        trace.tally(0)
+    trace.truncate(35, 0)
+    trace._finalize(0)
+    db.close()
+    x = open_traces(os.path.join(str(tmpdir), 'chain0'), ['x'])['x']
+    assert len(x) == 35
+    assert np.all(x > 0)
+
+
+def test_stacked_chains_keep_their_record(tmpdir):
+    db, trace = _trace(str(tmpdir), 20)
+    for _ in range(20):
+        trace.tally(0)
+    trace._finalize(0)
+    chain = open_traces(os.path.join(str(tmpdir), 'chain0'), ['x'])
+    out = os.path.join(str(tmpdir), 'out')
+    stacked = stack_chains([chain, chain], out)
+    assert stacked['x'].shape == (2, 20)
+    assert open_traces(out, ['x'])['x'].shape == (2, 20)
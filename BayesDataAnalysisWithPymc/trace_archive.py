@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+'''Compact archive of the traces of a fit.
+The traces returned by the 'fit' functions, (chain, draw, ...) arrays,
+are saved in a single zip file. Every variable is split in chunks of
+draws, each one a compressed '.npy' member, and a JSON manifest records
+the shapes, encodings and metadata. The draws can be downcast to
+float32 or quantized to integers with a bounded absolute error, which
+shrinks them far more than compression alone. Reading one variable, or
+a range of draws, only decompresses the chunks it needs.
+
+Usage:
+    write_archive('fit.zip', trace, dtype='float32',
+                  tolerance={'tdf': 0.01}, info=dict(model='regression'))
+    with TraceArchive('fit.zip') as archive:
+        b1 = archive.read('b1', draws=slice(0, 1000))
+
+'''
+from __future__ import division
+
+import io
+import json
+import zipfile
+
+import numpy as np
+
+ARCHIVE_VERSION = 1
+
+COMPRESSION = dict(stored=zipfile.ZIP_STORED, deflate=zipfile.ZIP_DEFLATED,
+                   bzip2=getattr(zipfile, 'ZIP_BZIP2', None),
+                   lzma=getattr(zipfile, 'ZIP_LZMA', None))
+
+
+def _option(value, name):
+    '''Value of a per-variable option, given once or as a dictionary.'''
+    if isinstance(value, dict):
+        return value.get(name)
+    return value
+
+
+def _member(name, k):
+    return '%s/%i.npy' % (name, k)
+
+
+def _quantize(trace, tolerance):
+    '''Integers q and (offset, scale) with |offset + scale * q - trace|
+    <= tolerance, in the smallest unsigned type that holds them.'''
+    if not tolerance > 0:
+        raise ValueError('the tolerance must be positive, not %r'
+                         % tolerance)
+    if not np.all(np.isfinite(trace)):
+        raise ValueError('only finite traces can be quantized')
+    offset = float(trace.min()) if trace.size else 0.0
+    scale = 2.0 * tolerance
+    q = np.round((trace - offset) / scale)
+    top = q.max() if q.size else 0
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if top <= np.iinfo(dtype).max:
+            break
+    return q.astype(dtype), offset, scale
+
+
+def write_archive(path, traces, dtype=None, tolerance=None,
+                  compression='deflate', chunk=10000, metadata=None,
+                  info=None):
+    '''Save traces to a zip archive.
+
+    :Arguments:
+        path: file name of the archive.
+        traces: dictionary with the (chain, draw, ...) array of each
+                variable, as returned by the 'fit' functions.
+        dtype: type the draws are stored as, such as 'float32' (default:
+               None, their own type).
+        tolerance: largest absolute error of quantized draws, a positive
+                   number (default: None, not quantized). Quantized
+                   draws are stored as the smallest unsigned integers
+                   that hold them.
+        compression: 'deflate', 'bzip2', 'lzma' or 'stored'.
+        chunk: number of draws per chunk.
+        metadata: dictionary of JSON-serializable values describing each
+                  variable, such as its units or scale.
+        info: dictionary of JSON-serializable values describing the fit.
+
+    'dtype', 'tolerance' and 'compression' may be dictionaries with a
+    value for some variables; the others get the default.
+    Returns the manifest.
+
+    '''
+    columns = {}
+    with zipfile.ZipFile(path, 'w', allowZip64=True) as archive:
+        for name in sorted(traces):
+            trace = np.asarray(traces[name])
+            if trace.ndim < 2:
+                raise ValueError('trace %r is not shaped (chain, draw, ...)'
+                                 % name)
+            method = _option(compression, name) or 'deflate'
+            if COMPRESSION.get(method) is None:
+                raise ValueError('compression %r is not available' % method)
+            column = dict(shape=list(trace.shape), dtype=trace.dtype.str,
+                          chunk=chunk, compression=method,
+                          metadata=_option(metadata, name) or {})
+
+            step = _option(tolerance, name)
+            if step is not None:
+                stored, offset, scale = _quantize(trace, step)
+                column.update(encoding='quantized', offset=offset,
+                              scale=scale, tolerance=step)
+            else:
+                cast = _option(dtype, name)
+                stored = trace if cast is None else trace.astype(cast)
+                column.update(encoding='raw')
+            column['stored_dtype'] = stored.dtype.str
+
+            draws = trace.shape[1]
+            column['chunks'] = (draws + chunk - 1) // chunk
+            for k in range(column['chunks']):
+                buffer = io.BytesIO()
+                np.save(buffer, np.ascontiguousarray(
+                    stored[:, k * chunk:(k + 1) * chunk]))
+                archive.writestr(_member(name, k), buffer.getvalue(),
+                                 compress_type=COMPRESSION[method])
+            columns[name] = column
+
+        manifest = dict(version=ARCHIVE_VERSION, columns=columns,
+                        info=info or {})
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2,
+                                                     sort_keys=True))
+    return manifest
+
+
+class TraceArchive(object):
+    '''Reader of an archive written by 'write_archive'.
+
+    :Arguments:
+        path: file name of the archive.
+
+    'names' lists the variables, 'info' describes the fit and
+    'metadata(name)' describes one variable.
+
+    '''
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, 'r')
+        self.manifest = json.loads(
+            self.archive.read('manifest.json').decode('utf-8'))
+        if self.manifest['version'] > ARCHIVE_VERSION:
+            raise ValueError('archive version %i is not supported' %
+                             self.manifest['version'])
+        self.columns = self.manifest['columns']
+        self.info = self.manifest['info']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.archive.close()
+
+    @property
+    def names(self):
+        return sorted(self.columns)
+
+    def metadata(self, name):
+        return self.columns[name]['metadata']
+
+    def shape(self, name):
+        return tuple(self.columns[name]['shape'])
+
+    def read(self, name, draws=None, chains=None):
+        '''Read the trace of one variable.
+
+        :Arguments:
+            name: name of the variable.
+            draws: slice of the draws to read (default: all of them).
+                   Only the chunks it covers are decompressed.
+            chains: index or slice of the chains (default: all).
+
+        Returns a (chain, draw, ...) array, or (draw, ...) for an integer
+        'chains', in the original type (or in float32, if it was stored
+        so). Quantized draws are within the tolerance of the original.
+
+        '''
+        column = self.columns[name]
+        size, chunk = column['shape'][1], column['chunk']
+        start, stop, step = (draws or slice(None)).indices(size)
+        if step < 0:
+            raise ValueError('draws must be read in increasing order')
+        stop = max(start, stop)
+        first, last = start // chunk, (stop + chunk - 1) // chunk
+
+        parts = [np.load(io.BytesIO(self.archive.read(_member(name, k))))
+                 for k in range(first, last)]
+        if parts:
+            stored = np.concatenate(parts, axis=1)
+        else:
+            shape = list(column['shape'])
+            shape[1] = 0
+            stored = np.empty(shape, dtype=column['stored_dtype'])
+        stored = stored[:, start - first * chunk:stop - first * chunk:step]
+        if chains is not None:
+            stored = stored[chains]
+
+        if column['encoding'] == 'quantized':
+            return (column['offset'] + column['scale'] * stored).astype(
+                column['dtype'])
+        return stored
+
+    def read_traces(self, names=None, draws=None, chains=None):
+        '''Read several variables (default: all) into a dictionary, in the
+        layout of the 'fit' functions.'''
+        return dict((name, self.read(name, draws, chains))
+                    for name in (names or self.names))
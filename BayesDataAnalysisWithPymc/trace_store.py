@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+'''Out-of-core trace storage for long MCMC runs.
+A PyMC database backend that writes each tallied draw straight into a
+memory-mapped '.npy' file per variable, so the trace never has to fit
+in memory. Traces are handed back as lazy, read-only 'np.memmap' views.
+The number of draws written is kept next to every file, and updated
+after each flush, so that the unwritten rows of a preallocated file are
+never read back as draws, and an interrupted run is reported as such.
+Another backend keeps no draws at all, only streaming summaries.
+
+Usage:
+    db = MemmapDatabase('traces_dir')
+    mcmc = pymc.MCMC(model, db=db)
+
+'''
+from __future__ import division
+
+import json
+import os
+import shutil
+
+import numpy as np
+from pymc.database import base
+
+from online import OnlineSummary
+
+
+def _rows_path(path):
+    return os.path.splitext(path)[0] + '.rows'
+
+
+def write_rows(path, rows, axis=0, complete=False):
+    '''Record that 'rows' draws, along 'axis', of the '.npy' file 'path'
+    are written, and whether the writer is done. Call it after the draws
+    are flushed.'''
+    rows_path = _rows_path(path)
+    temp = rows_path + '.%i.tmp' % os.getpid()
+    with open(temp, 'w') as output:
+        json.dump(dict(rows=int(rows), axis=axis, complete=complete), output)
+    if os.path.exists(rows_path):
+        os.remove(rows_path)
+    os.rename(temp, rows_path)
+
+
+def load_trace(path, mmap_mode='r'):
+    '''Open a '.npy' trace file, checking its record of written draws.
+
+    Returns only the written draws of a finished trace, such as one whose
+    sampler was halted early. Raises ValueError for a trace whose writer
+    did not finish, as after a crash, or a file shorter than its record.
+    Files without a record, such as those written by 'np.save', are read
+    as they are.
+
+    '''
+    trace = np.load(path, mmap_mode=mmap_mode)
+    try:
+        with open(_rows_path(path)) as source:
+            record = json.load(source)
+    except (IOError, OSError):
+        return trace
+    rows, axis = record['rows'], record['axis']
+    if not record['complete']:
+        raise ValueError('%s is incomplete: its writer stopped after %i '
+                         'draws' % (path, rows))
+    if rows > trace.shape[axis]:
+        raise ValueError('%s is truncated: %i draws were written, it holds '
+                         '%i' % (path, rows, trace.shape[axis]))
+    return trace[(slice(None),) * axis + (slice(0, rows),)]
+
+
+class MemmapTrace(base.Trace):
+    '''Trace of a single variable, stored in one '.npy' file per chain.'''
+
+    def __init__(self, name, getfunc=None, db=None):
+        base.Trace.__init__(self, name, getfunc=getfunc, db=db)
+        self._index = {}
+        self._complete = set()
+
+    def _path(self, chain):
+        return os.path.join(self.db.dbname, 'chain%i' % chain,
+                            self.name + '.npy')
+
+    def _initialize(self, chain, length):
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+        value = np.asarray(self._getfunc())
+        path = self._path(chain)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._trace[chain] = np.lib.format.open_memmap(
+            path, mode='w+', dtype=value.dtype, shape=(length,) + value.shape)
+        self._index[chain] = 0
+        self._complete.discard(chain)
+        write_rows(path, 0)
+
+    def tally(self, chain):
+        index = self._index[chain]
+        self._trace[chain][index] = self._getfunc()
+        self._index[chain] = index + 1
+        # Flush the dirty pages every chunk, so that they can be evicted,
+        # and record the draws they hold.
+        if (index + 1) % self.db.chunk == 0:
+            self._flush(chain)
+
+    def _flush(self, chain):
+        self._trace[chain].flush()
+        write_rows(self._path(chain), self._index[chain],
+                   complete=chain in self._complete)
+
+    def truncate(self, index, chain):
+        self._index[chain] = index
+        self._flush(chain)
+
+    def _finalize(self, chain):
+        self._complete.add(chain)
+        self._flush(chain)
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        '''Return the trace, as a lazy memory-mapped view.
+
+        :Arguments:
+            burn: number of initial draws to skip.
+            thin: keep one draw every 'thin' draws.
+            chain: index of the chain (default: last one). 'None'
+                   concatenates all chains, loading them into memory.
+            slicing: slice object, overrides 'burn' and 'thin'.
+
+        '''
+        if slicing is None:
+            slicing = slice(burn, None, thin)
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._stored(chain)[slicing]
+        return np.concatenate([self._stored(c)
+                               for c in sorted(self._trace)])[slicing]
+
+    def _stored(self, chain):
+        return self._trace[chain][:self._index[chain]]
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        if chain is not None:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            return self._index[chain]
+        return sum(self._index.values())
+
+
+class MemmapDatabase(base.Database):
+    '''PyMC database writing every variable to memory-mapped '.npy' files.
+
+    :Arguments:
+        dbname: directory of the database. Chain 'k' of variable 'name'
+                is written to 'dbname/chain<k>/name.npy'.
+        chunk: number of draws between flushes to disk (default: 1000).
+
+    '''
+
+    def __init__(self, dbname, chunk=1000):
+        base.Database.__init__(self, dbname)
+        self.__name__ = 'memmap'
+        self.__Trace__ = MemmapTrace
+        self.chunk = chunk
+        self._state_ = {}
+
+    def savestate(self, state):
+        self._state_ = state
+
+    def getstate(self):
+        return self._state_
+
+    def commit(self):
+        for trace in self._traces.values():
+            for chain in trace._trace:
+                trace._flush(chain)
+
+    close = commit
+
+
+class SummaryTrace(base.Trace):
+    '''Trace feeding an 'online.OnlineSummary', without keeping the draws.'''
+
+    def __init__(self, name, getfunc=None, db=None):
+        base.Trace.__init__(self, name, getfunc=getfunc, db=db)
+        self._buffer = []
+
+    def _initialize(self, chain, length):
+        if self._getfunc is None:
+            self._getfunc = self.db.model._funs_to_tally[self.name]
+        if self.name not in self.db.summaries:
+            self.db.summaries[self.name] = OnlineSummary(
+                comp=self.db.comp.get(self.name))
+
+    def tally(self, chain):
+        self._buffer.append(np.array(self._getfunc(), dtype=float))
+        if len(self._buffer) >= self.db.chunk:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.db.summaries[self.name].update(np.array(self._buffer))
+            self._buffer = []
+
+    def truncate(self, index, chain):
+        self._flush()
+
+    def _finalize(self, chain):
+        self._flush()
+
+    def gettrace(self, burn=0, thin=1, chain=-1, slicing=None):
+        raise AttributeError('SummaryDatabase keeps no draws, '
+                             'use its summaries instead')
+
+    __call__ = gettrace
+
+    def length(self, chain=-1):
+        return self.db.summaries[self.name].count + len(self._buffer)
+
+
+class SummaryDatabase(base.Database):
+    '''PyMC database keeping only streaming summaries of every variable.
+
+    :Arguments:
+        dbname: name of the database (not used, nothing is written).
+        comp: dictionary with a comparison value (or values) for some
+              variables, whose tail masses are counted.
+        chunk: number of draws buffered between summary updates
+               (default: 1000).
+
+    'db.summaries' maps each variable name to its 'OnlineSummary'. It can
+    be read while sampling runs, for example from another thread.
+
+    '''
+
+    def __init__(self, dbname=None, comp=None, chunk=1000):
+        base.Database.__init__(self, dbname)
+        self.__name__ = 'summary'
+        self.__Trace__ = SummaryTrace
+        self.comp = comp or {}
+        self.chunk = chunk
+        self.summaries = {}
+        self._state_ = {}
+
+    def savestate(self, state):
+        self._state_ = state
+
+    def getstate(self):
+        return self._state_
+
+
+def open_traces(dbdir, names):
+    '''Open the '.npy' trace files of 'names' saved in 'dbdir'.
+
+    Returns a dictionary of read-only 'np.memmap' arrays. Raises
+    ValueError for a file whose draws were not all written.
+
+    '''
+    return dict((name, load_trace(os.path.join(dbdir, name + '.npy')))
+                for name in names)
+
+
+def stack_chains(chain_traces, dbdir, chunk=100000):
+    '''Stack the traces of several chains into one file per variable.
+
+    :Arguments:
+        chain_traces: list with one dictionary of (draw, ...) arrays per
+                      chain, such as memory-mapped chain traces.
+        dbdir: directory where 'name.npy' is written for every variable.
+        chunk: number of draws copied at a time (default: 100000).
+
+    Returns a dictionary of read-only (chain, draw, ...) 'np.memmap'
+    arrays. Peak memory stays at one chunk of draws.
+
+    '''
+    if not os.path.isdir(dbdir):
+        os.makedirs(dbdir)
+    names = list(chain_traces[0])
+    for name in names:
+        first = chain_traces[0][name]
+        path = os.path.join(dbdir, name + '.npy')
+        out = np.lib.format.open_memmap(
+            path, mode='w+', dtype=first.dtype,
+            shape=(len(chain_traces),) + first.shape)
+        write_rows(path, 0, axis=1)
+        for c, traces in enumerate(chain_traces):
+            for start in range(0, len(first), chunk):
+                out[c, start:start + chunk] = traces[name][start:start + chunk]
+        out.flush()
+        del out
+        write_rows(path, len(first), axis=1, complete=True)
+    return open_traces(dbdir, names)
+
+
+def remove_chain_dirs(dirs):
+    '''Delete the per-chain directories left by the sampling workers.'''
+    for path in dirs:
+        shutil.rmtree(path, ignore_errors=True)